@@ -0,0 +1,348 @@
+import os
+import time
+import asyncio
+import weakref
+
+import agent
+from clients import create_async_openai_client, get_database
+from db_utils import get_async_db
+from embedding_utils import embed_texts_async
+from feed_utils import CURSOR_PROJECTION, FEED_SORT, feed_item, older_than, get_feed_cache
+from translation_utils import translate, create_translator
+from llm_gateway import gateway
+from telemetry import span, span_generator, annotate, usage_attributes, prompt_chars
+
+# --- Service Settings ---
+ADVICE_TIMEOUT_SECONDS = float(os.getenv("ADVICE_TIMEOUT_SECONDS", "60"))
+RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("RETRIEVAL_TIMEOUT_SECONDS", "10"))
+GENERATION_TIMEOUT_SECONDS = float(os.getenv("GENERATION_TIMEOUT_SECONDS", "45"))
+# Streaming: the longest wait for the next chunk once the first has arrived
+GENERATION_IDLE_TIMEOUT_SECONDS = float(os.getenv("GENERATION_IDLE_TIMEOUT_SECONDS", "15"))
+TRANSLATION_TIMEOUT_SECONDS = float(os.getenv("TRANSLATION_TIMEOUT_SECONDS", "20"))
+
+# Async clients are bound to the loop they are first used on
+_loop_resources = weakref.WeakKeyDictionary()
+
+
+def _resources() -> dict:
+    """The AsyncOpenAI client and translator for the running event loop."""
+    loop = asyncio.get_running_loop()
+    resources = _loop_resources.get(loop)
+    if resources is None:
+        resources = {"llm": create_async_openai_client(), "translator": create_translator()}
+        _loop_resources[loop] = resources
+    return resources
+
+
+async def get_latest_updates_async(limit: int = 5) -> list:
+    """Fetches the newest Knowledge Hub updates with the async driver."""
+    db = get_async_db()
+    cursor = db.updates.find({}, CURSOR_PROJECTION).sort(FEED_SORT).limit(limit)
+    return [feed_item(doc) for doc in await cursor.to_list(length=limit)]
+
+
+async def search_documents_async(query: str, k: int = 3, persona: str = None) -> list:
+    """Async counterpart of agent.search_documents."""
+    if agent.RETRIEVAL_MODE != "text":
+        try:
+            if not agent._kb_index_state["loaded"]:
+                await asyncio.to_thread(agent._ensure_kb_index)
+            query_vector = None
+            if len(agent.kb_index.vectors):
+                query_vector = (await embed_texts_async(_resources()["llm"], [query]))[0]
+            docs = agent.kb_index.search(query, k=k, mode=agent.RETRIEVAL_MODE, query_vector=query_vector,
+                                         persona=agent.persona_key(persona))
+            if docs:
+                annotate(backend="index", documents=len(docs))
+                return docs
+        except Exception as e:
+            print(f"Vector retrieval error, falling back to text search: {e}")
+
+    if agent.snapshot_path():
+        return await asyncio.to_thread(agent.snapshot_text_search, query, k, persona)
+    db = get_async_db()
+    cursor = db.knowledge_base.find(
+        agent.text_search_filter(query, persona),
+        {'score': {'$meta': 'textScore'}}
+    ).sort([('score', {'$meta': 'textScore'})]).limit(k)
+    docs = await cursor.to_list(length=k)
+    annotate(backend="text", documents=len(docs))
+    return docs
+
+
+async def search_passages_async(query: str, persona: str = None) -> list:
+    """Async counterpart of agent.search_passages."""
+    if agent.RETRIEVAL_UNIT != "passage" or agent.RETRIEVAL_MODE == "text":
+        return []
+    try:
+        if not agent._kb_index_state["loaded"]:
+            await asyncio.to_thread(agent._ensure_kb_index)
+        if not agent.use_passages():
+            return []
+        query_vector = None
+        if len(agent.passage_index.vectors):
+            query_vector = (await embed_texts_async(_resources()["llm"], [query]))[0]
+        return agent.search_passages(query, query_vector=query_vector, persona=persona)
+    except Exception as e:
+        print(f"Passage retrieval error, falling back to documents: {e}")
+        return []
+
+
+async def _retrieve_context_async(query: str, persona: str = None) -> dict:
+    with span("retrieval", mode=agent.RETRIEVAL_MODE) as s:
+        try:
+            passages = await asyncio.wait_for(search_passages_async(query, persona), RETRIEVAL_TIMEOUT_SECONDS)
+            if passages:
+                retrieved = agent.build_passage_context(passages)
+            else:
+                docs = await asyncio.wait_for(search_documents_async(query, persona=persona), RETRIEVAL_TIMEOUT_SECONDS)
+                retrieved = agent.build_context(docs)
+        except Exception as e:
+            print(f"Database retrieval error: {e!r}")
+            s.error = type(e).__name__
+            return agent.retrieval_failed_context()
+        s.set(context_chars=len(retrieved["context"]))
+        return retrieved
+
+
+async def _check_kb_version():
+    if not agent.kb_version_check_due():
+        return
+    if agent.snapshot_path():
+        await asyncio.to_thread(agent.apply_kb_version, agent.current_kb_version())
+        return
+    try:
+        doc = await get_async_db().meta.find_one({"_id": "knowledge_base"}, {"version": 1})
+    except Exception as e:
+        print(f"Error reading knowledge base version: {e}")
+        return
+    version = doc.get("version", 0) if doc else 0
+    await asyncio.to_thread(agent.apply_kb_version, version)
+
+
+async def _translate_answer(answer: str, language: str) -> tuple:
+    """Returns (display_answer, translated_ok)."""
+    if language == "English":
+        return answer, True
+    try:
+        translated = await asyncio.wait_for(
+            translate(answer, language, translator=_resources()["translator"]), TRANSLATION_TIMEOUT_SECONDS
+        )
+        return translated, True
+    except asyncio.TimeoutError:
+        print("Translation timed out. Returning the English answer.")
+        return answer, False
+
+
+async def _cancel(tasks):
+    for task in tasks:
+        if task is not None and not task.done():
+            task.cancel()
+    await asyncio.gather(*[t for t in tasks if t is not None], return_exceptions=True)
+
+
+async def get_financial_advice_async(query: str, persona: str, language: str = "English",
+                                     include_updates: bool = False, timeout: float = ADVICE_TIMEOUT_SECONDS) -> dict:
+    """
+    Async, Streamlit-free version of agent.get_financial_advice.
+    Retrieval, the knowledge base version check and (optionally) the Knowledge
+    Hub fetch run concurrently on the current event loop; generation and
+    translation follow on the same loop. Every stage has its own timeout, the
+    whole request is bounded by `timeout`, and pending work is cancelled if
+    the request finishes early or is cancelled.
+
+    Returns {"answer", "english_answer", "language", "videos", "blogs",
+    "cached", "updates", "error"}; "error" is None on success and "degraded"
+    when the LLM was unavailable and the answer is knowledge base text.
+    """
+    result = {"answer": "", "english_answer": "", "language": language, "videos": [], "blogs": [],
+              "cached": False, "updates": [], "error": None}
+    with span("advice", persona=persona, streaming=False, language=language) as request:
+        version_task = retrieval_task = updates_task = None
+        await asyncio.to_thread(agent.load_router_topics)
+        route = agent.route_query(query, load_topics=False)
+        if route == agent.OFF_TOPIC:
+            result.update(agent.off_topic_result(), english_answer=agent.OFF_TOPIC_REFUSAL)
+            result["answer"], _ = await _translate_answer(agent.OFF_TOPIC_REFUSAL, language)
+            return result
+        try:
+            async with asyncio.timeout(timeout):
+                version_task = asyncio.create_task(_check_kb_version())
+                retrieval_task = asyncio.create_task(_retrieve_context_async(query, persona))
+                if include_updates:
+                    updates_task = asyncio.create_task(get_latest_updates_async())
+
+                await version_task
+                cached = agent.answer_cache.get(query, persona)
+                request.set(cache_hit=cached is not None)
+                if cached is not None:
+                    retrieval_task.cancel()
+                    english_answer, videos, blogs = cached["answer"], list(cached["videos"]), list(cached["blogs"])
+                    result["cached"] = True
+                else:
+                    retrieved = await retrieval_task
+                    videos, blogs = retrieved["videos"], retrieved["blogs"]
+                    extracted = agent.extractive_result(query, route, retrieved)
+                    if extracted is not None:
+                        english_answer = extracted["answer"]
+                        agent.answer_cache.put(query, persona, extracted)
+                    else:
+                        messages = agent.build_messages(query, persona, retrieved["context"])
+                        model = agent.model_for_route(route)
+                        try:
+                            with span("generation", model=model, streaming=False, prompt_chars=prompt_chars(messages)) as generation:
+                                response = await gateway.achat(_resources()["llm"], deadline=GENERATION_TIMEOUT_SECONDS,
+                                                               model=model, messages=messages, temperature=0.7)
+                                generation.set(**usage_attributes(response.usage))
+                            english_answer = response.choices[0].message.content
+                            if retrieved["ok"]:
+                                agent.answer_cache.put(query, persona, {"answer": english_answer, "videos": videos, "blogs": blogs})
+                        except Exception as e:
+                            print(f"LLM generation error: {e!r}")
+                            request.error = type(e).__name__
+                            english_answer = agent.generation_failed(e, query, retrieved)
+                            result["error"] = "generation_failed" if english_answer == agent.GENERATION_FAILED else "degraded"
+
+                result.update(english_answer=english_answer, videos=videos, blogs=blogs)
+                result["answer"], translated_ok = await _translate_answer(english_answer, language)
+                if not translated_ok and result["error"] is None:
+                    result["error"] = "translation_timeout"
+
+                if updates_task is not None:
+                    try:
+                        result["updates"] = await updates_task
+                    except Exception as e:
+                        print(f"Error fetching latest updates: {e}")
+                return result
+
+        except TimeoutError:
+            print("Advice request timed out.")
+            request.error = "timeout"
+            result.update(answer="Sorry, this is taking longer than expected. Please try again.", error="timeout")
+            return result
+        except Exception as e:
+            print(f"LLM generation error: {e}")
+            request.error = type(e).__name__
+            result.update(answer=agent.GENERATION_FAILED, error="generation_failed")
+            return result
+        finally:
+            await _cancel([version_task, retrieval_task, updates_task])
+
+
+async def _timed_chunks(stream, first_timeout: float = None, idle_timeout: float = None):
+    """
+    The chunks of a streamed completion. Each provider read is timed on its
+    own (the first token within `first_timeout`, every later one within
+    `idle_timeout`), so time the consumer spends between chunks doesn't count.
+    """
+    chunks = aiter(stream)
+    read_timeout = GENERATION_TIMEOUT_SECONDS if first_timeout is None else first_timeout
+    idle_timeout = GENERATION_IDLE_TIMEOUT_SECONDS if idle_timeout is None else idle_timeout
+    while True:
+        async with asyncio.timeout(read_timeout):
+            chunk = await anext(chunks, None)
+        if chunk is None:
+            return
+        if chunk.choices and chunk.choices[0].delta.content:
+            read_timeout = idle_timeout
+        yield chunk
+
+
+@span_generator
+async def stream_financial_advice_async(query: str, persona: str):
+    """
+    Async counterpart of agent.stream_financial_advice; yields the same
+    "links", "chunk" and "error" events.
+    """
+    with span("advice", persona=persona, streaming=True) as request:
+        version_task = retrieval_task = None
+        await asyncio.to_thread(agent.load_router_topics)
+        route = agent.route_query(query, load_topics=False)
+        if route == agent.OFF_TOPIC:
+            yield {"type": "links", "videos": [], "blogs": []}
+            yield {"type": "chunk", "text": agent.OFF_TOPIC_REFUSAL}
+            return
+        try:
+            version_task = asyncio.create_task(_check_kb_version())
+            retrieval_task = asyncio.create_task(_retrieve_context_async(query, persona))
+            await version_task
+
+            cached = agent.answer_cache.get(query, persona)
+            request.set(cache_hit=cached is not None)
+            if cached is not None:
+                retrieval_task.cancel()
+                yield {"type": "links", "videos": list(cached["videos"]), "blogs": list(cached["blogs"])}
+                yield {"type": "chunk", "text": cached["answer"]}
+                return
+
+            retrieved = await retrieval_task
+            yield {"type": "links", "videos": retrieved["videos"], "blogs": retrieved["blogs"]}
+            extracted = agent.extractive_result(query, route, retrieved)
+            if extracted is not None:
+                agent.answer_cache.put(query, persona, extracted)
+                yield {"type": "chunk", "text": extracted["answer"]}
+                return
+
+            messages = agent.build_messages(query, persona, retrieved["context"])
+            model = agent.model_for_route(route)
+            parts = []
+            try:
+                with span("generation", model=model, streaming=True, prompt_chars=prompt_chars(messages)) as generation:
+                    stream = await gateway.achat(
+                        _resources()["llm"], deadline=GENERATION_TIMEOUT_SECONDS,
+                        model=model, messages=messages, temperature=0.7, stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    async for chunk in _timed_chunks(stream):
+                        if chunk.usage is not None:
+                            generation.set(**usage_attributes(chunk.usage))
+                        if not chunk.choices:
+                            continue
+                        text = chunk.choices[0].delta.content
+                        if text:
+                            if not parts:
+                                generation.set(time_to_first_token_ms=round((time.time() - generation.start) * 1000, 1))
+                            parts.append(text)
+                            yield {"type": "chunk", "text": text}
+            except Exception as e:
+                print(f"LLM generation error: {e!r}")
+                request.error = type(e).__name__
+                if parts:
+                    yield {"type": "error", "text": agent.GENERATION_FAILED}
+                else:
+                    yield {"type": "chunk", "text": agent.generation_failed(e, query, retrieved), "degraded": True}
+                return
+
+            if retrieved["ok"] and parts:
+                agent.answer_cache.put(query, persona, {"answer": "".join(parts), "videos": retrieved["videos"], "blogs": retrieved["blogs"]})
+        finally:
+            await _cancel([version_task, retrieval_task])
+
+
+async def translate_async(text: str, language: str) -> str:
+    """Translates with this loop's translator (see translation_utils.translate)."""
+    translated, _ = await _translate_answer(text, language)
+    return translated
+
+
+def _feed_cache():
+    """The process-wide Knowledge Hub cache (see feed_utils), or None without a database."""
+    _, db = get_database()
+    return get_feed_cache(db.updates) if db is not None else None
+
+
+async def get_updates_page_async(before=None, before_id=None, limit: int = 5) -> list:
+    """
+    Knowledge Hub page: the newest updates, or those after the cursor
+    (before, before_id) of the last one shown. The first page comes from the in-memory feed cache, so clients
+    polling it don't cost a database query each.
+    """
+    if before is None:
+        feed = await asyncio.to_thread(_feed_cache)
+        if feed is not None and limit <= feed.size:
+            return feed.latest(limit)
+        return await get_latest_updates_async(limit)
+    db = get_async_db()
+    cursor = db.updates.find(older_than(before, before_id), CURSOR_PROJECTION)
+    return [feed_item(doc) for doc in await cursor.sort(FEED_SORT).limit(limit).to_list(length=limit)]
+
@@ -1,95 +1,586 @@
 import os
 import json
+import time
+import threading
 from dotenv import load_dotenv
-from openai import OpenAI
-from db_utils import get_db_connection
+from clients import get_openai_client, get_database
+from db_utils import get_kb_version
+from cache_utils import AnswerCache
+from embedding_utils import embed_texts
+from retrieval_utils import KnowledgeIndex, PassageIndex
+from snapshot import SNAPSHOT_DIR, current_snapshot, load_snapshot
+from chunking import pack_context, context_blocks, count_tokens, CONTEXT_TOKEN_BUDGET
+from llm_gateway import gateway, LLMUnavailable
+from prompt_builder import PromptBuilder
+from extractive import ExtractiveAnswerer, EXTRACTIVE_ENABLED, EXTRACTIVE_MIN_CONFIDENCE
+from router import QueryRouter, ROUTER_ENABLED, ROUTER_SIMPLE_MODEL, OFF_TOPIC, DEFINITIONAL, COMPLEX, OFF_TOPIC_REFUSAL
+from telemetry import span, span_generator, annotate, usage_attributes, prompt_chars
 
-# --- Load API Key and Initialize Clients ---
+# --- Settings and Clients ---
+# Reads .env so the settings below see it. The OpenAI and MongoDB clients are
+# created on first use (see clients.py), so importing this module is cheap and
+# does no network I/O.
 load_dotenv()
-openai_api_key = os.getenv("LLM_API_KEY")
-if not openai_api_key:
-    raise ValueError("LLM_API_KEY not found. Please check your .env file.")
 
-client = OpenAI(api_key=openai_api_key)
-db_client, db, knowledge_base, updates = get_db_connection()
+# --- Answer Cache ---
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512")),
+    ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")),
+)
+# How often (in seconds) to check whether knowledge_base has changed.
+KB_VERSION_CHECK_SECONDS = float(os.getenv("KB_VERSION_CHECK_SECONDS", "60"))
+_kb_state = {"version": None, "checked_at": 0.0}
+
+# --- Retrieval Index ---
+# 'hybrid' (BM25 + vector), 'vector', or 'text' (MongoDB $text search only).
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# 'passage' packs the best chunks from knowledge_chunks into the prompt (see
+# chunking.py); 'document' sends whole documents. Passage retrieval falls back
+# to documents until the passages have been built.
+RETRIEVAL_UNIT = os.getenv("RETRIEVAL_UNIT", "passage")
+PASSAGE_CANDIDATES = int(os.getenv("PASSAGE_CANDIDATES", "12"))
+# App personas and the values ingestion stores in each document's 'personas'
+PERSONA_KEYS = {"Student": "student", "Early-Career": "professional"}
+# How often (in seconds) the indexes also check MongoDB for deleted documents
+KB_RECONCILE_SECONDS = float(os.getenv("KB_RECONCILE_SECONDS", "900"))
+kb_index = KnowledgeIndex(embed_fn=lambda texts: embed_texts(get_openai_client(), texts),
+                          reconcile_seconds=KB_RECONCILE_SECONDS)
+passage_index = PassageIndex(embed_fn=lambda texts: embed_texts(get_openai_client(), texts),
+                             reconcile_seconds=KB_RECONCILE_SECONDS)
+_kb_index_lock = threading.Lock()
+_kb_index_state = {"loaded": False, "snapshot": None}
+
+# --- Local Snapshot ---
+# With SNAPSHOT_DIR set and a snapshot published there (python snapshot.py),
+# the indexes are loaded from the snapshot and requests don't query MongoDB:
+# the version check reads the `current` link instead of the meta collection,
+# and keyword search runs on the in-memory BM25 index instead of $text.
+
+# --- Prompts ---
+# Compiled per persona at import so requests only fill in context and question
+prompt_builder = PromptBuilder()
+
+# --- Model Routing ---
+# Off-topic questions get a canned refusal, short definitional ones go to
+# ROUTER_SIMPLE_MODEL, and only the rest go to GENERATION_MODEL (see router.py).
+GENERATION_MODEL = "gpt-4o"
+query_router = QueryRouter()
+
+# --- Extractive Answers ---
+# Definitional questions are answered from the retrieved text when the
+# extractive answer is confident enough (see extractive.py). When the LLM
+# can't be reached (circuit open, deadline passed, retries exhausted) every
+# question gets the extractive answer, whatever its confidence.
+extractive_answerer = ExtractiveAnswerer()
+CORPUS_ONLY_NOTICE = "*I can't reach my AI coach right now, so here is what my knowledge base says on this:*\n\n"
+NO_CONTEXT = "No specific information found. Please provide general advice."
+GENERATION_FAILED = "Sorry, I am having trouble processing your request right now."
+
+
+def _collections() -> tuple:
+    """(knowledge_base, knowledge_chunks) on the shared database."""
+    _, db = get_database()
+    return db.knowledge_base, db.knowledge_chunks
+
+
+def snapshot_path():
+    """The published snapshot to serve from, or None to use MongoDB."""
+    return current_snapshot(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+
+
+def _load_snapshot(path: str):
+    """Replaces the indexes with the snapshot's (call with _kb_index_lock held)."""
+    snapshot = load_snapshot(path)
+    count = kb_index.load_snapshot(*snapshot.index_rows("knowledge_base"))
+    print(f"Loaded {count} knowledge base documents from snapshot {snapshot.version}.")
+    query_router.learn_topics(list(kb_index.docs.values()))
+    if RETRIEVAL_UNIT == "passage" and snapshot.has("knowledge_chunks"):
+        count = passage_index.load_snapshot(*snapshot.index_rows("knowledge_chunks"))
+        print(f"Loaded {count} passages from snapshot {snapshot.version}.")
+    _kb_index_state["snapshot"] = path
+
+
+def _ensure_kb_index():
+    """Loads the in-memory indexes on first use (once per process)."""
+    if _kb_index_state["loaded"]:
+        return
+    with _kb_index_lock:
+        if not _kb_index_state["loaded"]:
+            path = snapshot_path()
+            if path:
+                _load_snapshot(path)
+                _kb_index_state["loaded"] = True
+                return
+            knowledge_base, knowledge_chunks = _collections()
+            count = kb_index.refresh(knowledge_base)
+            print(f"Loaded {count} knowledge base documents into the retrieval index.")
+            query_router.learn_topics(list(kb_index.docs.values()))
+            if RETRIEVAL_UNIT == "passage":
+                count = passage_index.refresh(knowledge_chunks)
+                print(f"Loaded {count} passages into the passage index.")
+            _kb_index_state["loaded"] = True
+
+
+def _refresh_indexes() -> int:
+    """Pulls changes (and, when due, deletions) from MongoDB into the indexes. Returns how many documents changed."""
+    knowledge_base, knowledge_chunks = _collections()
+    count = kb_index.refresh(knowledge_base)
+    if count:
+        query_router.learn_topics(list(kb_index.docs.values()))
+    if RETRIEVAL_UNIT == "passage":
+        count += passage_index.refresh(knowledge_chunks)
+    return count
+
+
+def kb_version_check_due() -> bool:
+    """True (and marks the check as done) if it's time to look at the KB version again."""
+    now = time.time()
+    if now - _kb_state["checked_at"] < KB_VERSION_CHECK_SECONDS:
+        return False
+    _kb_state["checked_at"] = now
+    return True
+
+
+def apply_kb_version(version):
+    """
+    If knowledge_base changed since the last check, clears the answer cache
+    and pulls the changed documents into the retrieval index, or loads the
+    newly published snapshot. Deletions don't always bump the version, so
+    the index also looks for them every KB_RECONCILE_SECONDS.
+    """
+    if version is None:
+        return
+    changed = _kb_state["version"] is not None and version != _kb_state["version"]
+    path = snapshot_path()
+    if changed or (path and _kb_index_state["loaded"] and path != _kb_index_state["snapshot"]):
+        print("Knowledge base changed. Clearing the answer cache.")
+        answer_cache.invalidate()
+        if _kb_index_state["loaded"] and path:
+            try:
+                with _kb_index_lock:
+                    if path != _kb_index_state["snapshot"]:
+                        _load_snapshot(path)
+            except Exception as e:
+                print(f"Error loading snapshot {path}: {e}")
+        elif _kb_index_state["loaded"]:
+            try:
+                _refresh_indexes()
+            except Exception as e:
+                print(f"Error refreshing the retrieval index: {e}")
+    elif _kb_index_state["loaded"] and not path and (kb_index.reconcile_due() or passage_index.reconcile_due()):
+        try:
+            if _refresh_indexes():
+                print("Knowledge base changed. Clearing the answer cache.")
+                answer_cache.invalidate()
+        except Exception as e:
+            print(f"Error refreshing the retrieval index: {e}")
+    _kb_state["version"] = version
+
+
+def current_kb_version():
+    """The published snapshot's name in snapshot mode, otherwise the version counter in MongoDB."""
+    path = snapshot_path()
+    if path:
+        return os.path.basename(path)
+    return get_kb_version(get_database()[1])
+
+
+def database_available() -> bool:
+    """A snapshot or a MongoDB connection to answer from."""
+    return bool(snapshot_path() or get_database()[0])
+
+
+def _sync_with_kb():
+    if kb_version_check_due():
+        with span("kb_version_check"):
+            apply_kb_version(current_kb_version())
+
+
+def _copy_result(result: dict) -> dict:
+    return {"answer": result["answer"], "videos": list(result["videos"]), "blogs": list(result["blogs"])}
+
+
+def persona_key(persona: str):
+    """The stored persona value for an app persona, or None to search every document."""
+    if persona is None:
+        return None
+    return PERSONA_KEYS.get(persona, persona.lower())
+
+
+def text_search_filter(query: str, persona: str = None) -> dict:
+    """The $text query, limited to the persona's documents and those written for everyone."""
+    query_filter = {"$text": {"$search": query}}
+    key = persona_key(persona)
+    if key is not None:
+        query_filter["personas"] = {"$in": [key, None, []]}
+    return query_filter
+
+
+def search_documents(query: str, k: int = 3, persona: str = None) -> list:
+    """
+    Finds the k most relevant knowledge base documents for the persona.
+    Uses the in-memory vector/hybrid index and falls back to MongoDB $text
+    search if the index is empty or the query could not be embedded.
+    """
+    if RETRIEVAL_MODE != "text":
+        try:
+            _ensure_kb_index()
+            docs = kb_index.search(query, k=k, mode=RETRIEVAL_MODE, persona=persona_key(persona))
+            if docs:
+                annotate(backend="index", documents=len(docs))
+                return docs
+        except Exception as e:
+            print(f"Vector retrieval error, falling back to text search: {e}")
+
+    docs = snapshot_text_search(query, k, persona)
+    if docs is not None:
+        return docs
+    knowledge_base, _ = _collections()
+    docs = list(knowledge_base.find(
+        text_search_filter(query, persona),
+        {'score': {'$meta': 'textScore'}}
+    ).sort([('score', {'$meta': 'textScore'})]).limit(k))
+    annotate(backend="text", documents=len(docs))
+    return docs
+
+
+def snapshot_text_search(query: str, k: int = 3, persona: str = None):
+    """Keyword search on the snapshot's in-memory BM25 index, or None when not serving from a snapshot."""
+    if not snapshot_path():
+        return None
+    _ensure_kb_index()
+    docs = kb_index.search(query, k=k, mode="bm25", persona=persona_key(persona))
+    annotate(backend="snapshot_text", documents=len(docs))
+    return docs
+
+
+def use_passages() -> bool:
+    return RETRIEVAL_UNIT == "passage" and RETRIEVAL_MODE != "text" and len(passage_index) > 0
+
+
+def search_passages(query: str, k: int = PASSAGE_CANDIDATES, query_vector=None, persona: str = None) -> list:
+    """The k best passages, or [] if passage retrieval is off, not built yet, or failed."""
+    if RETRIEVAL_UNIT != "passage" or RETRIEVAL_MODE == "text":
+        return []
+    try:
+        _ensure_kb_index()
+        if not use_passages():
+            return []
+        return passage_index.search(query, k=k, mode=RETRIEVAL_MODE, query_vector=query_vector,
+                                    persona=persona_key(persona))
+    except Exception as e:
+        print(f"Passage retrieval error, falling back to documents: {e}")
+        return []
+
+
+def build_passage_context(passages: list, budget_tokens: int = CONTEXT_TOKEN_BUDGET) -> dict:
+    """Packs the best passages into the token budget; links come from the passages that were used."""
+    context, chosen = pack_context(passages, budget_tokens)
+    videos, blogs = [], []
+    for passage in chosen:
+        videos.extend(passage.get('related_videos') or [])
+        blogs.extend(passage.get('related_blogs') or [])
+    annotate(backend="passages", passages=len(chosen), context_tokens=count_tokens(context))
+    return {"context": context, "videos": list(dict.fromkeys(videos)), "blogs": list(dict.fromkeys(blogs)),
+            "sources": context_blocks(chosen), "ok": True}
+
+
+def build_context(retrieved_docs: list) -> dict:
+    """Turns retrieved documents into the prompt context plus related links."""
+    context = "\n---\n".join([doc['content'] for doc in retrieved_docs])
+    
+    # --- NEW: Extract related links ---
+    related_videos = []
+    related_blogs = []
+    for doc in retrieved_docs:
+        related_videos.extend(doc.get('related_videos', []))
+        related_blogs.extend(doc.get('related_blogs', []))
+    
+    # Remove duplicate links
+    related_videos = list(set(related_videos))
+    related_blogs = list(set(related_blogs))
+
+    if not context:
+        context = NO_CONTEXT
+
+    sources = [(doc.get('topic', ''), doc['content']) for doc in retrieved_docs]
+    return {"context": context, "videos": related_videos, "blogs": related_blogs, "sources": sources, "ok": True}
+
+
+def retrieval_failed_context() -> dict:
+    return {"context": "Error retrieving information. Please provide general advice.", "videos": [], "blogs": [],
+            "sources": [], "ok": False}
+
+
+def retrieve_context(query: str, persona: str = None) -> dict:
+    """
+    Runs the retrieval step and returns the prompt context plus related links.
+    'ok' is False when the database query failed.
+    """
+    with span("retrieval", mode=RETRIEVAL_MODE) as s:
+        try:
+            passages = search_passages(query, persona=persona)
+            if passages:
+                retrieved = build_passage_context(passages)
+            else:
+                # We retrieve the full documents now, not just the content
+                retrieved = build_context(search_documents(query, persona=persona))
+        except Exception as e:
+            print(f"Database retrieval error: {e}")
+            s.error = type(e).__name__
+            return retrieval_failed_context()
+        s.set(context_chars=len(retrieved["context"]))
+        return retrieved
+
+
+def retrieve_contexts(requests: list) -> list:
+    """
+    retrieve_context for a batch of (query, persona) pairs, in order. The
+    queries are embedded together and each index scores the whole batch in
+    one pass. Queries the indexes can't answer, and every query in 'text'
+    mode or after an index error, go through retrieve_context one by one.
+    """
+    if RETRIEVAL_MODE == "text":
+        return [retrieve_context(query, persona) for query, persona in requests]
+    with span("batch_retrieval", mode=RETRIEVAL_MODE, queries=len(requests)) as s:
+        try:
+            _ensure_kb_index()
+            queries = [query for query, _ in requests]
+            personas = [persona_key(persona) for _, persona in requests]
+            vectors = kb_index.embed_fn(queries) if len(kb_index.vectors) or len(passage_index.vectors) else None
+            passages = [[] for _ in requests]
+            if use_passages():
+                passages = passage_index.search_many(queries, k=PASSAGE_CANDIDATES, mode=RETRIEVAL_MODE,
+                                                     query_vectors=vectors, personas=personas)
+            missing = [i for i, found in enumerate(passages) if not found]
+            docs = dict(zip(missing, kb_index.search_many(
+                [queries[i] for i in missing], mode=RETRIEVAL_MODE, personas=[personas[i] for i in missing],
+                query_vectors=None if vectors is None else vectors[missing]))) if missing else {}
+        except Exception as e:
+            print(f"Batch retrieval error, retrieving one query at a time: {e}")
+            s.error = type(e).__name__
+            return [retrieve_context(query, persona) for query, persona in requests]
+
+        results = []
+        for i, (query, persona) in enumerate(requests):
+            if passages[i]:
+                results.append(build_passage_context(passages[i]))
+            elif docs[i]:
+                results.append(build_context(docs[i]))
+            else:
+                results.append(retrieve_context(query, persona))
+        s.set(passage_hits=len(requests) - len(missing), fallbacks=sum(1 for i in missing if not docs[i]))
+        return results
+
+
+def load_router_topics():
+    """
+    Loads the indexes, and with them the router's knowledge base topics, so
+    the first questions of a process aren't routed on the keyword list alone.
+    Routing still works (on keywords) if the knowledge base can't be loaded.
+    """
+    if not ROUTER_ENABLED or _kb_index_state["loaded"]:
+        return
+    try:
+        _ensure_kb_index()
+    except Exception as e:
+        print(f"Could not load knowledge base topics for routing: {e}")
+
+
+def route_query(query: str, load_topics: bool = True) -> str:
+    """
+    Picks the route for a question and records it on the request span.
+    Pass load_topics=False if load_router_topics() was already called (e.g.
+    off the event loop).
+    """
+    if load_topics:
+        load_router_topics()
+    with span("routing") as s:
+        route = query_router.classify(query) if ROUTER_ENABLED else COMPLEX
+        s.set(route=route)
+    annotate(route=route)
+    return route
+
+
+def model_for_route(route: str) -> str:
+    return ROUTER_SIMPLE_MODEL if route == DEFINITIONAL else GENERATION_MODEL
+
+
+def off_topic_result() -> dict:
+    return {"answer": OFF_TOPIC_REFUSAL, "videos": [], "blogs": []}
+
+
+def extract_answer(query: str, retrieved: dict):
+    """The extractive answer from the retrieved sources, or None (see extractive.py)."""
+    with span("extractive") as s:
+        extracted = extractive_answerer.answer(query, retrieved["sources"])
+        s.set(confidence=extracted["confidence"] if extracted else 0.0)
+    return extracted
+
+
+def extractive_result(query: str, route: str, retrieved: dict):
+    """The result for a definitional question the knowledge base answers confidently, else None."""
+    if not EXTRACTIVE_ENABLED or route != DEFINITIONAL or not retrieved["ok"]:
+        return None
+    extracted = extract_answer(query, retrieved)
+    # Only a document about the term itself can answer without the LLM
+    if extracted is None or not extracted["topic_match"] or extracted["confidence"] < EXTRACTIVE_MIN_CONFIDENCE:
+        return None
+    annotate(answered_by="extractive")
+    return {"answer": extracted["answer"], "videos": retrieved["videos"], "blogs": retrieved["blogs"]}
+
+
+def generation_failed(error: Exception, query: str, retrieved: dict) -> str:
+    """The answer to show when generation failed: the extractive answer if there is one."""
+    reason = error.reason if isinstance(error, LLMUnavailable) else type(error).__name__
+    extracted = extract_answer(query, retrieved)
+    if extracted is None:
+        return GENERATION_FAILED
+    annotate(degraded=reason, answered_by="extractive")
+    return CORPUS_ONLY_NOTICE + extracted["answer"]
+
+
+def build_messages(query: str, persona: str, context: str) -> list:
+    """Builds the chat messages for the generation step (see prompt_builder.py for the layout)."""
+    return prompt_builder.build(query, persona, context)
 
 
 def get_financial_advice(query: str, persona: str) -> dict:
     """
     This is the core RAG function.
     It now returns a dictionary with the answer and related links.
+    Repeated and near-identical questions are served from the answer cache.
     """
-    if not db_client:
+    if not database_available():
         return {"answer": "Error: Database connection is not available.", "videos": [], "blogs": []}
 
-    # --- 1. RETRIEVAL ---
-    try:
-        # We retrieve the full documents now, not just the content
-        retrieved_docs = list(knowledge_base.find(
-            {"$text": {"$search": query}},
-            {'score': {'$meta': 'textScore'}}
-        ).sort([('score', {'$meta': 'textScore'})]).limit(3))
+    with span("advice", persona=persona, streaming=False) as request:
+        route = route_query(query)
+        if route == OFF_TOPIC:
+            return off_topic_result()
 
-        context = "\n---\n".join([doc['content'] for doc in retrieved_docs])
-        
-        # --- NEW: Extract related links ---
-        related_videos = []
-        related_blogs = []
-        for doc in retrieved_docs:
-            related_videos.extend(doc.get('related_videos', []))
-            related_blogs.extend(doc.get('related_blogs', []))
-        
-        # Remove duplicate links
-        related_videos = list(set(related_videos))
-        related_blogs = list(set(related_blogs))
+        _sync_with_kb()
+        cached = answer_cache.get(query, persona)
+        request.set(cache_hit=cached is not None)
+        if cached is not None:
+            return _copy_result(cached)
 
-        if not context:
-            context = "No specific information found. Please provide general advice."
+        # --- 1. RETRIEVAL ---
+        retrieved = retrieve_context(query, persona)
+        extracted = extractive_result(query, route, retrieved)
+        if extracted is not None:
+            answer_cache.put(query, persona, extracted)
+            return _copy_result(extracted)
 
-    except Exception as e:
-        print(f"Database retrieval error: {e}")
-        context = "Error retrieving information. Please provide general advice."
-        related_videos, related_blogs = [], []
-
-    # --- 2. AUGMENTATION: Upgraded Prompt ---
-    system_prompt = f"""
-    You are 'Arthavivek', a friendly and wise financial coach for India's youth.
-    Your user is a '{persona}'. Your goal is to provide simple, safe, and encouraging financial education, NOT specific investment advice.
-    RULES:
-    1.  Use the provided 'CONTEXT' to form your primary answer.
-    2.  Format your answer using markdown. Use headings, bold text, and bullet points to make it easy to read.
-    3.  **If the user's question is not related to finance, economics, investing, or careers, you MUST politely decline to answer. Gently guide them back to financial topics. Do not answer non-financial questions.**
-    4.  Do NOT recommend any specific stocks, mutual funds, or products.
-    5.  Speak in simple and clear English.
-    6.  Keep the tone encouraging, like a knowledgeable friend.
-    7.  Do not include a disclaimer in your response, as it is already handled by the user interface.
+        # --- 2. AUGMENTATION: Upgraded Prompt ---
+        messages = build_messages(query, persona, retrieved["context"])
+
+        # --- 3. GENERATION ---
+        model = model_for_route(route)
+        try:
+            with span("generation", model=model, streaming=False, prompt_chars=prompt_chars(messages)) as generation:
+                response = gateway.chat(
+                    get_openai_client(),
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                )
+                generation.set(**usage_attributes(response.usage))
+            answer = response.choices[0].message.content
+
+            # Return a dictionary now
+            result = {
+                "answer": answer,
+                "videos": retrieved["videos"],
+                "blogs": retrieved["blogs"]
+            }
+            # Don't cache answers that were generated without the knowledge base
+            if retrieved["ok"]:
+                answer_cache.put(query, persona, result)
+            return _copy_result(result)
+
+        except Exception as e:
+            print(f"LLM generation error: {e}")
+            request.error = type(e).__name__
+            # Not cached, so the next request tries the LLM again
+            return {"answer": generation_failed(e, query, retrieved), "videos": retrieved["videos"], "blogs": retrieved["blogs"]}
+
+
+@span_generator
+def stream_financial_advice(query: str, persona: str):
     """
-    
-    user_prompt = f"CONTEXT:\n{context}\n\nMY QUESTION:\n{query}"
-    
+    Streaming variant of get_financial_advice.
+    Yields events as dictionaries:
+      {"type": "links", "videos": [...], "blogs": [...]}  -- once, right after retrieval
+      {"type": "chunk", "text": "..."}                    -- answer text as the LLM produces it
+                                                          (with "degraded": True when it is a fallback
+                                                          for a failed generation)
+      {"type": "error", "text": "..."}                    -- if something went wrong
+    """
+    if not database_available():
+        yield {"type": "error", "text": "Error: Database connection is not available."}
+        return
 
-    # --- 3. GENERATION ---
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.7,
-        )
-        answer = response.choices[0].message.content
-        
-        # Return a dictionary now
-        return {
-            "answer": answer,
-            "videos": related_videos,
-            "blogs": related_blogs
-        }
+    with span("advice", persona=persona, streaming=True) as request:
+        route = route_query(query)
+        if route == OFF_TOPIC:
+            yield {"type": "links", "videos": [], "blogs": []}
+            yield {"type": "chunk", "text": OFF_TOPIC_REFUSAL}
+            return
 
-    except Exception as e:
-        print(f"LLM generation error: {e}")
-        return {"answer": "Sorry, I am having trouble processing your request right now.", "videos": [], "blogs": []}
+        _sync_with_kb()
+        cached = answer_cache.get(query, persona)
+        request.set(cache_hit=cached is not None)
+        if cached is not None:
+            yield {"type": "links", "videos": list(cached["videos"]), "blogs": list(cached["blogs"])}
+            yield {"type": "chunk", "text": cached["answer"]}
+            return
+
+        retrieved = retrieve_context(query, persona)
+        yield {"type": "links", "videos": retrieved["videos"], "blogs": retrieved["blogs"]}
+        extracted = extractive_result(query, route, retrieved)
+        if extracted is not None:
+            answer_cache.put(query, persona, extracted)
+            yield {"type": "chunk", "text": extracted["answer"]}
+            return
+
+        messages = build_messages(query, persona, retrieved["context"])
+        model = model_for_route(route)
+        parts = []
+        try:
+            with span("generation", model=model, streaming=True, prompt_chars=prompt_chars(messages)) as generation:
+                stream = gateway.chat(
+                    get_openai_client(),
+                    model=model,
+                    messages=messages,
+                    temperature=0.7,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+                for chunk in stream:
+                    if chunk.usage is not None:
+                        generation.set(**usage_attributes(chunk.usage))
+                    if not chunk.choices:
+                        continue
+                    text = chunk.choices[0].delta.content
+                    if text:
+                        if not parts:
+                            generation.set(time_to_first_token_ms=round((time.time() - generation.start) * 1000, 1))
+                        parts.append(text)
+                        yield {"type": "chunk", "text": text}
+
+        except Exception as e:
+            print(f"LLM generation error: {e}")
+            request.error = type(e).__name__
+            if parts:
+                yield {"type": "error", "text": GENERATION_FAILED}
+            else:
+                yield {"type": "chunk", "text": generation_failed(e, query, retrieved), "degraded": True}
+            return
+
+        # Only cache complete answers
+        if retrieved["ok"] and parts:
+            answer_cache.put(query, persona, {"answer": "".join(parts), "videos": retrieved["videos"], "blogs": retrieved["blogs"]})
 
 
 # import os
@@ -0,0 +1,258 @@
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+import agent
+import advice_service
+from db_utils import get_db_health
+from llm_gateway import gateway
+from pretranslate import get_pretranslator
+from prompt_builder import PERSONAS
+from telemetry import memory_exporter
+from translation_utils import LANG_CODE_MAP
+
+# --- API Settings ---
+# In-flight LLM requests allowed at once, and how many more may wait for a slot
+# before new requests are turned away with 429.
+API_LLM_CONCURRENCY = int(os.getenv("API_LLM_CONCURRENCY", "16"))
+API_MAX_WAITING = int(os.getenv("API_MAX_WAITING", "64"))
+API_RETRY_AFTER_SECONDS = 5
+
+
+class Overloaded(Exception):
+    pass
+
+
+class LLMGate:
+    """Global cap on concurrent LLM work with a bounded wait queue."""
+
+    def __init__(self, max_in_flight: int = API_LLM_CONCURRENCY, max_waiting: int = API_MAX_WAITING):
+        self.max_waiting = max_waiting
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+
+    async def acquire(self):
+        """Waits for a slot, or raises Overloaded if too many requests are already waiting."""
+        if self._semaphore.locked() and self._waiting >= self.max_waiting:
+            raise Overloaded()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+    def release(self):
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        return {"waiting": self._waiting, "available_slots": self._semaphore._value}
+
+
+class GatedStreamingResponse(StreamingResponse):
+    """
+    A streaming response that holds an LLM slot. The slot is released when
+    the response ends, including when the client disconnects or the
+    response is cancelled before its body was ever iterated.
+    """
+
+    def __init__(self, content, gate: LLMGate = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self._gate = gate
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+    def release(self):
+        gate, self._gate = self._gate, None
+        if gate is not None:
+            gate.release()
+
+
+llm_gate = LLMGate()
+# Identical in-flight advice requests share one task
+_in_flight = {}
+
+
+def _error(message: str, status_code: int, **headers) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+def _overloaded() -> JSONResponse:
+    return _error("Too many requests. Please try again shortly.", 429, **{"Retry-After": str(API_RETRY_AFTER_SECONDS)})
+
+
+async def _read_advice_request(request):
+    """Validates the JSON body shared by the advice endpoints."""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, _error("Request body must be JSON.", 400)
+    query = (body.get("query") or "").strip()
+    persona = body.get("persona", "Student")
+    language = body.get("language", "English")
+    if not query:
+        return None, _error("'query' is required.", 400)
+    if persona not in PERSONAS:
+        return None, _error(f"'persona' must be one of {list(PERSONAS)}.", 400)
+    if language != "English" and language not in LANG_CODE_MAP:
+        return None, _error("Language not supported.", 400)
+    return (query, persona, language), None
+
+
+async def _gated_advice(query: str, persona: str, language: str) -> dict:
+    if agent.answer_cache.peek(query, persona):
+        # Cached answers don't need an LLM slot
+        return await advice_service.get_financial_advice_async(query, persona, language)
+    async with llm_gate.slot():
+        return await advice_service.get_financial_advice_async(query, persona, language)
+
+
+async def advice(request):
+    """POST /advice {"query", "persona", "language"} -> the full answer as JSON."""
+    parsed, error = await _read_advice_request(request)
+    if error:
+        return error
+    query, persona, language = parsed
+
+    key = (*agent.answer_cache.make_key(query, persona), language)
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_gated_advice(query, persona, language))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    try:
+        # shield() so one client disconnecting doesn't cancel the shared work
+        result = await asyncio.shield(task)
+    except Overloaded:
+        return _overloaded()
+    if result["error"] is None:
+        # Popular answers are pre-translated here, where every client's requests arrive
+        get_pretranslator().record(result["english_answer"])
+    return JSONResponse(result, status_code=504 if result["error"] == "timeout" else 200)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def advice_stream(request):
+    """
+    POST /advice/stream -> Server-Sent Events: "links", then "chunk" events as
+    the answer is generated, an optional "translation", and finally "done".
+    """
+    parsed, error = await _read_advice_request(request)
+    if error:
+        return error
+    query, persona, language = parsed
+
+    gated = not agent.answer_cache.peek(query, persona)
+    if gated:
+        try:
+            await llm_gate.acquire()
+        except Overloaded:
+            return _overloaded()
+
+    async def events():
+        parts, degraded = [], False
+        async for event in advice_service.stream_financial_advice_async(query, persona):
+            if event["type"] == "chunk":
+                parts.append(event["text"])
+                degraded = degraded or event.get("degraded", False)
+            yield _sse(event["type"], {k: v for k, v in event.items() if k != "type"})
+            if event["type"] == "error":
+                return
+        if not degraded:
+            # Same rule as /advice: only real answers are worth pre-translating
+            get_pretranslator().record("".join(parts))
+        if language != "English" and parts:
+            translated = await advice_service.translate_async("".join(parts), language)
+            yield _sse("translation", {"text": translated, "language": language})
+        yield _sse("done", {})
+
+    # The response, not the generator, owns the slot: a generator that never starts never runs its finally
+    return GatedStreamingResponse(events(), gate=llm_gate if gated else None, media_type="text/event-stream",
+                                  headers={"Cache-Control": "no-cache"})
+
+
+async def updates(request):
+    """GET /updates?limit=5&before=<ISO date>&before_id=<id> -> Knowledge Hub page after that cursor."""
+    try:
+        limit = min(int(request.query_params.get("limit", 5)), 50)
+        before = request.query_params.get("before")
+        before = datetime.fromisoformat(before) if before else None
+    except ValueError:
+        return _error("Invalid 'limit' or 'before'.", 400)
+    before_id = request.query_params.get("before_id") or None
+    try:
+        articles = await advice_service.get_updates_page_async(before=before, before_id=before_id, limit=limit)
+    except Exception as e:
+        print(f"Error fetching latest updates: {e}")
+        return _error("Could not connect to the Knowledge Hub.", 503)
+    for article in articles:
+        if isinstance(article.get("date_published"), datetime):
+            article["date_published"] = article["date_published"].isoformat()
+    return JSONResponse({"updates": articles})
+
+
+async def translate_text(request):
+    """POST /translate {"text", "language"} -> {"text"}."""
+    try:
+        body = await request.json()
+    except ValueError:
+        return _error("Request body must be JSON.", 400)
+    text, language = body.get("text") or "", body.get("language", "English")
+    if language != "English" and language not in LANG_CODE_MAP:
+        return _error("Language not supported.", 400)
+    return JSONResponse({"text": await advice_service.translate_async(text, language)})
+
+
+async def health(request):
+    return JSONResponse({"database": get_db_health(), "llm_gate": llm_gate.stats(), "llm_gateway": gateway.stats(),
+                         "answer_cache": agent.answer_cache.stats(), "in_flight": len(_in_flight)})
+
+
+async def metrics(request):
+    """GET /metrics?window=900 -> per-stage, per-route and per-answer-source latency percentiles over the last `window` seconds."""
+    exporter = memory_exporter()
+    if exporter is None:
+        return _error("The in-memory telemetry exporter is disabled (see TELEMETRY_EXPORTERS).", 404)
+    try:
+        window = float(request.query_params.get("window", 900))
+    except ValueError:
+        return _error("Invalid 'window'.", 400)
+    return JSONResponse({"window_seconds": window, "stages": exporter.summary(window_seconds=window),
+                         "routes": exporter.breakdown("advice", "route", window_seconds=window),
+                         "answered_by": exporter.breakdown("advice", "answered_by", window_seconds=window)})
+
+
+app = Starlette(routes=[
+    Route("/advice", advice, methods=["POST"]),
+    Route("/advice/stream", advice_stream, methods=["POST"]),
+    Route("/updates", updates, methods=["GET"]),
+    Route("/translate", translate_text, methods=["POST"]),
+    Route("/health", health, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+])
+
+
+# Run with: uvicorn api:app --host 0.0.0.0 --port 8000
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
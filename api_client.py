@@ -0,0 +1,82 @@
+import os
+import json
+import httpx
+
+# Set ARTHAVIVEK_API_URL (e.g. http://localhost:8000) to make the Streamlit app
+# a client of the HTTP API instead of calling the agent in-process.
+API_URL = os.getenv("ARTHAVIVEK_API_URL")
+API_TIMEOUT_SECONDS = float(os.getenv("ARTHAVIVEK_API_TIMEOUT", "90"))
+
+_client = None
+
+
+def _http() -> httpx.Client:
+    global _client
+    if _client is None:
+        _client = httpx.Client(base_url=API_URL, timeout=API_TIMEOUT_SECONDS)
+    return _client
+
+
+def _iter_sse(response):
+    """Parses a text/event-stream response into (event, data) pairs."""
+    event, data = "message", []
+    for line in response.iter_lines():
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+
+def stream_financial_advice(query: str, persona: str):
+    """
+    Same events as agent.stream_financial_advice, served by the HTTP API.
+    Too-many-requests and other HTTP errors are turned into an "error" event.
+    """
+    try:
+        with _http().stream("POST", "/advice/stream", json={"query": query, "persona": persona}) as response:
+            if response.status_code == 429:
+                yield {"type": "error", "text": "Arthavivek is very busy right now. Please try again in a few seconds."}
+                return
+            response.raise_for_status()
+            for event, data in _iter_sse(response):
+                if event in ("links", "chunk", "error"):
+                    yield {"type": event, **data}
+    except httpx.HTTPError as e:
+        print(f"API request error: {e}")
+        yield {"type": "error", "text": "Sorry, I am having trouble processing your request right now."}
+
+
+def get_updates(before=None, before_id=None, limit: int = 5):
+    """
+    A page of the Knowledge Hub (GET /updates), newest first, after the
+    cursor (before, before_id) if given, or None if the API can't be reached.
+    """
+    params = {"limit": limit}
+    if before is not None:
+        params["before"] = before if isinstance(before, str) else before.isoformat()
+    if before_id is not None:
+        params["before_id"] = before_id
+    try:
+        response = _http().get("/updates", params=params)
+        response.raise_for_status()
+        return response.json()["updates"]
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        print(f"API request error: {e}")
+        return None
+
+
+def translate(text: str, language: str) -> str:
+    """The translation served by POST /translate, or the original text if the API can't translate it."""
+    if language == "English" or not text:
+        return text
+    try:
+        response = _http().post("/translate", json={"text": text, "language": language})
+        response.raise_for_status()
+        return response.json()["text"]
+    except (httpx.HTTPError, ValueError, KeyError) as e:
+        print(f"API request error: {e}")
+        return text
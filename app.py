@@ -5,10 +5,20 @@ import nest_asyncio
 # --- Apply the patch ---
 nest_asyncio.apply()
 
-from db_utils import get_db_connection, get_latest_updates
-from agent import get_financial_advice
+from db_utils import get_db_connection
+from feed_utils import get_feed_cache
+import api_client
+if api_client.API_URL:
+    # Streamlit is just a client of the HTTP API (see api.py): advice, the
+    # Knowledge Hub and translations all come from it
+    from api_client import stream_financial_advice
+else:
+    from agent import stream_financial_advice
 # Import the new, larger language map
 from translation_utils import translate, LANG_CODE_MAP
+from pretranslate import get_pretranslator
+from telemetry import span, memory_exporter
+from llm_gateway import gateway
 
 # --- Page Configuration ---
 st.set_page_config(page_title="Arthavivek", page_icon="🎓", layout="wide")
@@ -25,6 +35,31 @@ with st.sidebar:
     st.divider()
     st.info("Arthavivek is an AI-powered financial literacy coach designed for India's youth.")
 
+    # --- Admin Panel (open the app with ?admin=1) ---
+    telemetry_spans = memory_exporter()
+    if st.query_params.get("admin") == "1" and telemetry_spans is not None:
+        with st.expander("📊 Performance", expanded=True):
+            window_minutes = st.select_slider("Window (minutes)", options=[5, 15, 60, 240], value=15)
+            summary = telemetry_spans.summary(window_seconds=window_minutes * 60)
+            if summary:
+                st.dataframe([{"stage": name, **row} for name, row in summary.items()], hide_index=True)
+            else:
+                st.caption("No requests in this window yet.")
+            routes = telemetry_spans.breakdown("advice", "route", window_seconds=window_minutes * 60)
+            if routes:
+                st.caption("Requests by route")
+                st.dataframe([{"route": name, **row} for name, row in routes.items()], hide_index=True)
+            llm = gateway.stats()
+            st.caption(f"LLM circuit breaker: {llm['breaker']['state']} · {llm['retries']} retries · "
+                       f"{llm['hedges']} hedged requests ({llm['hedge_wins']} won) · {llm['breaker']['rejected']} failed fast")
+            if api_client.API_URL:
+                st.caption("Advice runs in the API process; only this app's own stages are shown here.")
+            recent = [s for s in telemetry_spans.spans() if s["name"] == "advice"][-10:]
+            if recent:
+                st.caption("Latest requests")
+                st.dataframe([{"ms": s["duration_ms"], "error": s["error"], **s["attributes"]} for s in reversed(recent)],
+                             hide_index=True)
+
 # --- Main Title ---
 st.title("🎓 Arthavivek")
 st.caption("Financial Wisdom for India's Youth | भारत के युवाओं के लिए वित्तीय विवेक")
@@ -41,8 +76,29 @@ st.caption("Financial Wisdom for India's Youth | भारत के युव
 # st.title("🎓 Arthavivek")
 # st.caption("Financial Wisdom for India's Youth | भारत के युवाओं के लिए वित्तीय विवेक")
 
-# --- Database Connection ---
-client, db, knowledge_base, updates_collection = get_db_connection()
+# --- Background pre-translation of popular answers ---
+# With the API, pre-translation runs in the API process instead.
+pretranslator = None if api_client.API_URL else get_pretranslator()
+
+# --- Backend ---
+# Reuses the process-wide pooled client; no new connection or ping per rerun.
+# With the API, this app never connects to MongoDB itself.
+if api_client.API_URL:
+    client = None
+    backend_ready = True
+
+    def latest_updates(limit=5):
+        return api_client.get_updates(limit=limit)
+
+    def older_updates(before, before_id=None, limit=5):
+        return api_client.get_updates(before=before, before_id=before_id, limit=limit) or []
+else:
+    client, db, knowledge_base, updates_collection = get_db_connection()
+    backend_ready = bool(client)
+    if client:
+        # Served from the shared in-memory feed; no database query per rerun
+        feed = get_feed_cache(updates_collection)
+        latest_updates, older_updates = feed.latest, feed.page
 
 # --- Two-Column Layout ---
 col1, col2 = st.columns([2, 1], gap="large")
@@ -61,38 +117,82 @@ with col1:
         user_query = st.text_area("Enter your financial question here:", placeholder="e.g., How can I start an SIP?", height=150, label_visibility="collapsed")
 
         if st.button("Get Advice", type="primary", use_container_width=True):
-            if user_query and client:
-                with st.spinner("Arthavivek is thinking..."):
-                    try:
-                        # --- NEW: Added a try...except block for robustness ---
-                        response_data = get_financial_advice(user_query, persona_english)
-                        english_answer = response_data['answer']
-                        
-                        # # --- NEW: Render the structured JSON response ---
-                        # with st.container(border=True):
-                        #     for section in english_answer:
-                        #         st.subheader(section.get('heading', ''))
-                        #         for point in section.get('points', []):
-                        #             st.markdown(f"- {point}")
-                        
-                        display_answer = asyncio.run(translate(english_answer, language))
-                        st.markdown(display_answer)
-
-                        if response_data['videos'] or response_data['blogs']:
-                            st.divider()
-                            st.subheader("For Deeper Knowledge 📚")
-                            for video_url in response_data['videos']:
-                                st.video(video_url)
-                            for blog_url in response_data['blogs']:
-                                st.link_button("Read a related blog post ↗️", blog_url)
-                    except Exception as e:
-                        st.error(f"An error occurred: {e}")
-                        st.error("Sorry, I couldn't process your request. Please try again later.")
-
-            elif not client:
+            if user_query and backend_ready:
+                try:
+                    with span("ui.request", persona=persona_english, language=language):
+                        # --- Stream the answer as the LLM writes it ---
+                        # Related links arrive first (retrieval finishes before generation),
+                        # but we render them below the answer once it is complete.
+                        links = {"videos": [], "blogs": []}
+                        failure = {}
+                        fallback = {"degraded": False}
+
+                        def answer_chunks():
+                            for event in stream_financial_advice(user_query, persona_english):
+                                if event["type"] == "links":
+                                    links["videos"], links["blogs"] = event["videos"], event["blogs"]
+                                elif event["type"] == "error":
+                                    # Not part of the answer; shown on its own below
+                                    failure["text"] = event["text"]
+                                    return
+                                else:
+                                    fallback["degraded"] = fallback["degraded"] or event.get("degraded", False)
+                                    yield event["text"]
+
+                        answer_box = st.empty()
+                        english_answer = answer_box.write_stream(answer_chunks())
+
+                        st.session_state.pop("last_answer", None)
+                        if failure:
+                            # A partial answer is neither kept, translated nor pre-translated
+                            answer_box.empty()
+                            st.error(failure["text"])
+                        else:
+                            # Keep the answer so a language switch (which reruns the script)
+                            # can re-render it from the translation cache without asking again.
+                            st.session_state["last_answer"] = {"answer": english_answer, **links, **fallback}
+                            st.session_state["last_answer_streamed"] = True
+                except Exception as e:
+                    st.error(f"An error occurred: {e}")
+                    st.error("Sorry, I couldn't process your request. Please try again later.")
+
+            elif not backend_ready:
                 st.error("Database connection failed. Please check your credentials and network.")
             else:
                 st.warning("Please enter a question.")
+
+        # --- Render the latest answer in the selected language ---
+        last_answer = st.session_state.get("last_answer")
+        if last_answer:
+            def translated_answer():
+                if api_client.API_URL:
+                    return api_client.translate(last_answer["answer"], language)
+                # Serve a pre-translated copy instantly when the worker already made one
+                stored = pretranslator.get(last_answer["answer"], language)
+                if stored is not None:
+                    return stored
+                return asyncio.run(translate(last_answer["answer"], language))
+
+            if st.session_state.pop("last_answer_streamed", False):
+                # Already on screen in English from the stream
+                if pretranslator is not None and not last_answer.get("degraded"):
+                    # Fallback answers for a failed generation aren't pre-translated (same as the API)
+                    pretranslator.record(last_answer["answer"])
+                if language != "English":
+                    with st.spinner("Translating..."):
+                        display_answer = translated_answer()
+                    answer_box.markdown(display_answer)
+            else:
+                display_answer = translated_answer() if language != "English" else last_answer["answer"]
+                st.markdown(display_answer)
+
+            if last_answer['videos'] or last_answer['blogs']:
+                st.divider()
+                st.subheader("For Deeper Knowledge 📚")
+                for video_url in last_answer['videos']:
+                    st.video(video_url)
+                for blog_url in last_answer['blogs']:
+                    st.link_button("Read a related blog post ↗️", blog_url)
     
     st.divider()
     # --- NEW: Added a permanent, visible disclaimer ---
@@ -108,8 +208,9 @@ with col1:
 # --- Column 2: The Knowledge Hub ---
 with col2:
     st.header("💡 Knowledge Hub")
-    if client:
-        latest_articles = get_latest_updates(updates_collection, limit=5)
+    latest_articles = latest_updates(limit=5) if backend_ready else None
+    if latest_articles is not None:
+        latest_articles += st.session_state.get("older_articles", [])
         if latest_articles:
             for article in latest_articles:
                 with st.container(border=True):
@@ -118,6 +219,15 @@ with col2:
                     st.markdown(article['summary'])
                     if article.get('original_link') != "#":
                         st.link_button("Read More ↗️", article['original_link'])
+
+            if st.button("Load more", use_container_width=True):
+                last = latest_articles[-1]
+                older = older_updates(before=last['date_published'], before_id=last.get('id'), limit=5)
+                if older:
+                    st.session_state["older_articles"] = st.session_state.get("older_articles", []) + older
+                    st.rerun()
+                else:
+                    st.info("You've reached the end of the Knowledge Hub.")
         else:
             st.info("No articles found in the Knowledge Hub yet.")
     else:
@@ -0,0 +1,310 @@
+"""
+Answers many questions in one run, for evaluation sets and bulk content (FAQ pages per persona).
+
+    python batch_advice.py questions.jsonl answers.jsonl
+    python batch_advice.py questions.jsonl answers.jsonl --batch-api    # OpenAI Batch API (cheaper, slower)
+
+Each input line is {"query": ..., "persona": ...} with an optional "id"
+(the line number otherwise). Questions that only differ in case and
+punctuation, for the same persona, are answered once. Each answer is
+appended to the output as soon as it is ready:
+    {"key", "query", "persona", "ids", "answer", "videos", "blogs", "route", "answered_by"}
+"ids" lists every input the answer belongs to. Answers that fell back to
+the knowledge base because generation failed also carry "error".
+
+The output file is the checkpoint: re-running the same command skips every
+question already answered there and retries the failed ones. Off-topic
+refusals are not final either; they are routed again on the next run.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import agent
+from cache_utils import AnswerCache
+from clients import get_openai_client
+from llm_gateway import LLMGateway
+from batch_llm import run_batch, clear_batch_state, BATCH_POLL_SECONDS
+from prompt_builder import PERSONAS
+from router import OFF_TOPIC, COMPLEX, ROUTER_ENABLED
+from telemetry import span, usage_attributes, prompt_chars
+
+# --- Batch Advice Settings ---
+# Chat completions in flight at once (the gateway's rate limit still applies)
+BATCH_ADVICE_CONCURRENCY = int(os.getenv("BATCH_ADVICE_CONCURRENCY", "8"))
+# Questions retrieved together; bounds the (questions x documents) score matrix
+BATCH_ADVICE_CHUNK = int(os.getenv("BATCH_ADVICE_CHUNK", "256"))
+# Nobody is waiting on a single answer: a longer deadline and no hedged requests
+BATCH_ADVICE_DEADLINE_SECONDS = float(os.getenv("BATCH_ADVICE_DEADLINE_SECONDS", "120"))
+BATCH_ADVICE_STATE_PATH = os.getenv("BATCH_ADVICE_STATE_PATH", ".cache/batch_advice_state")
+GENERATION_TEMPERATURE = 0.7
+
+llm = LLMGateway(deadline_seconds=BATCH_ADVICE_DEADLINE_SECONDS, hedge=False)
+
+
+def request_key(query: str, persona: str) -> str:
+    """Stable id of a question, shared by its near-identical copies (see AnswerCache.make_key)."""
+    normalized, persona_lower = AnswerCache.make_key(query, persona)
+    return hashlib.sha256(f"{persona_lower}\n{normalized}".encode("utf-8")).hexdigest()[:16]
+
+
+def read_requests(path: str) -> list:
+    """[(id, query, persona), ...] from a JSONL file."""
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("query"):
+                raise ValueError(f"{path}:{number + 1}: missing 'query'.")
+            requests.append((item.get("id", number), item["query"], item.get("persona") or PERSONAS[0]))
+    return requests
+
+
+def deduplicate(requests: list) -> dict:
+    """{key: {"query", "persona", "ids"}}, one entry per distinct question, in input order."""
+    unique = {}
+    for request_id, query, persona in requests:
+        item = unique.setdefault(request_key(query, persona), {"query": query, "persona": persona, "ids": []})
+        item["ids"].append(request_id)
+    return unique
+
+
+class ResultWriter:
+    """
+    Appends results to a JSONL file, one line per question, flushed as they
+    arrive, and counts them by how they were answered. On open, keeps the
+    lines of an earlier run that answered their question and drops failed
+    ones, router refusals and a line cut short by a crash, so those are
+    asked again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        kept, dropped, unterminated = [], 0, False
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        dropped += 1
+                        continue
+                    if record.get("error") or record.get("answered_by") == "router":
+                        dropped += 1
+                    else:
+                        unterminated = not line.endswith("\n")
+                        kept.append(line if not unterminated else line + "\n")
+                        self.done.add(record["key"])
+        except FileNotFoundError:
+            pass
+        # A complete last line without its newline is rewritten too, or the next result would join it
+        if dropped or unterminated:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(kept)
+            os.replace(tmp_path, path)
+        if kept or dropped:
+            print(f"Resuming from {path}: {len(kept)} answers kept, {dropped} to retry.")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.done.add(record["key"])
+            self.counts["failed" if record.get("error") else record["answered_by"]] += 1
+
+    def close(self):
+        self._file.close()
+
+
+# --- Pipeline ---
+def _record(key: str, item: dict, route: str, result: dict, answered_by: str, error: str = None) -> dict:
+    record = {"key": key, "query": item["query"], "persona": item["persona"], "ids": item["ids"],
+              "answer": result["answer"], "videos": result["videos"], "blogs": result["blogs"],
+              "route": route, "answered_by": answered_by}
+    if error:
+        record["error"] = error
+    return record
+
+
+def _failed(key: str, item: dict, route: str, retrieved: dict, error: Exception) -> dict:
+    """The record of a question whose generation failed: the extractive answer, marked for retry."""
+    answer = agent.generation_failed(error, item["query"], retrieved)
+    answered_by = "generation_failed" if answer == agent.GENERATION_FAILED else "extractive"
+    return _record(key, item, route, dict(retrieved, answer=answer), answered_by,
+                   error=getattr(error, "reason", None) or type(error).__name__)
+
+
+def _generate(key: str, item: dict, route: str, retrieved: dict, messages: list, model: str) -> dict:
+    """One chat completion through the gateway, as an output record."""
+    try:
+        with span("generation", model=model, streaming=False, batch=True, prompt_chars=prompt_chars(messages)) as s:
+            response = llm.chat(get_openai_client(), model=model, messages=messages, temperature=GENERATION_TEMPERATURE)
+            s.set(**usage_attributes(response.usage))
+    except Exception as e:
+        print(f"Generation failed for {key}: {e}")
+        return _failed(key, item, route, retrieved, e)
+    return _record(key, item, route, dict(retrieved, answer=response.choices[0].message.content), "llm")
+
+
+def _prepare(unique: dict, keys: list, writer: ResultWriter) -> list:
+    """
+    Routes and retrieves a chunk of questions, writing the ones that need no
+    LLM (off-topic, confident extractive answers). Returns the rest as
+    (key, route, retrieved, messages, model).
+    """
+    # The router needs the knowledge base topics, which come with the indexes
+    agent.load_router_topics()
+    routes = {key: agent.query_router.classify(unique[key]["query"]) if ROUTER_ENABLED else COMPLEX
+              for key in keys}
+    for key in keys:
+        if routes[key] == OFF_TOPIC:
+            writer.write(_record(key, unique[key], OFF_TOPIC, agent.off_topic_result(), "router"))
+    keys = [key for key in keys if routes[key] != OFF_TOPIC]
+
+    pending = []
+    retrieved_all = agent.retrieve_contexts([(unique[key]["query"], unique[key]["persona"]) for key in keys])
+    for key, retrieved in zip(keys, retrieved_all):
+        item, route = unique[key], routes[key]
+        extracted = agent.extractive_result(item["query"], route, retrieved)
+        if extracted is not None:
+            writer.write(_record(key, item, route, extracted, "extractive"))
+            continue
+        messages = agent.build_messages(item["query"], item["persona"], retrieved["context"])
+        # The context is in the messages now; only the links and sources are still needed
+        retrieved = {"videos": retrieved["videos"], "blogs": retrieved["blogs"], "sources": retrieved["sources"],
+                     "ok": retrieved["ok"]}
+        pending.append((key, route, retrieved, messages, agent.model_for_route(route)))
+    return pending
+
+
+def _run_provider_batch(unique: dict, pending: list, writer: ResultWriter, state_path: str,
+                        poll_seconds: float) -> list:
+    """
+    Generates through the OpenAI Batch API, one batch run per model, all
+    polled at once. Returns the entries the batch could not answer.
+    """
+    by_model = {}
+    for entry in pending:
+        by_model.setdefault(entry[4], []).append(entry)
+
+    def run(model, entries):
+        path = f"{state_path}.{model}.json"
+        results, errors = run_batch(get_openai_client(), {entry[0]: entry[3] for entry in entries}, path, model,
+                                    poll_seconds=poll_seconds, temperature=GENERATION_TEMPERATURE)
+        return path, results, errors
+
+    retry = []
+    with ThreadPoolExecutor(max_workers=max(len(by_model), 1), thread_name_prefix="batch") as pool:
+        runs = [(entries, pool.submit(run, model, entries)) for model, entries in by_model.items()]
+        for entries, future in runs:
+            path, results, errors = future.result()
+            for key, route, retrieved, messages, model in entries:
+                if key in results:
+                    writer.write(_record(key, unique[key], route, dict(retrieved, answer=results[key]), "llm"))
+                else:
+                    print(f"Batch request for {key} failed: {errors.get(key)}")
+                    retry.append((key, route, retrieved, messages, model))
+            # Every answer is in the output now, so the batch progress is no longer needed
+            clear_batch_state(path)
+    return retry
+
+
+def run_batch_advice(requests: list, output_path: str, concurrency: int = BATCH_ADVICE_CONCURRENCY,
+                     chunk_size: int = BATCH_ADVICE_CHUNK, batch_api: bool = False,
+                     batch_state_path: str = BATCH_ADVICE_STATE_PATH, batch_poll_seconds: float = BATCH_POLL_SECONDS) -> dict:
+    """
+    Answers (id, query, persona) requests into `output_path` (see the module
+    docstring) and returns counts per outcome. Questions are deduplicated,
+    then retrieved `chunk_size` at a time with one embedding call and one
+    scoring pass per index. Off-topic and confidently extractive questions
+    are written straight away; the rest are generated by up to
+    `concurrency` parallel gateway calls, which start while later chunks
+    are still being retrieved. With batch_api=True they go through the
+    OpenAI Batch API instead (progress in `batch_state_path`), and only
+    requests the batch could not answer fall back to regular calls.
+    """
+    start = time.perf_counter()
+    unique = deduplicate(requests)
+    writer = ResultWriter(output_path)
+    keys = [key for key in unique if key not in writer.done]
+    counts = Counter(requests=len(requests), unique=len(unique), already_answered=len(unique) - len(keys))
+    print(f"{len(requests)} questions, {len(unique)} distinct, {len(keys)} to answer.")
+    if keys and not agent.database_available():
+        writer.close()
+        raise RuntimeError("Database connection is not available.")
+
+    def finish(future):
+        try:
+            writer.write(future.result())
+        finally:
+            slots.release()
+
+    # Bounds the questions queued for generation, so retrieval stays just ahead of it
+    slots = threading.BoundedSemaphore(concurrency * 2)
+    batch_pending = []
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="advice") as pool:
+            for offset in range(0, len(keys), chunk_size):
+                pending = _prepare(unique, keys[offset:offset + chunk_size], writer)
+                if batch_api:
+                    batch_pending.extend(pending)
+                    pending = []
+                for key, route, retrieved, messages, model in pending:
+                    slots.acquire()
+                    pool.submit(_generate, key, unique[key], route, retrieved, messages, model).add_done_callback(finish)
+                print(f"  Prepared {min(offset + chunk_size, len(keys))}/{len(keys)} questions.")
+
+            if batch_pending:
+                print(f"Generating {len(batch_pending)} answers with the Batch API (state: {batch_state_path}.*)...")
+                for key, route, retrieved, messages, model in _run_provider_batch(
+                        unique, batch_pending, writer, batch_state_path, batch_poll_seconds):
+                    slots.acquire()
+                    pool.submit(_generate, key, unique[key], route, retrieved, messages, model).add_done_callback(finish)
+    finally:
+        writer.close()
+
+    counts.update(writer.counts)
+    counts["seconds"] = round(time.perf_counter() - start, 2)
+    return dict(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of (query, persona) questions in bulk.")
+    parser.add_argument("input", help="JSONL file with one {\"query\", \"persona\"[, \"id\"]} per line.")
+    parser.add_argument("output", help="JSONL file the answers are appended to (also the resume checkpoint).")
+    parser.add_argument("--concurrency", type=int, default=BATCH_ADVICE_CONCURRENCY, help="Parallel LLM calls.")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_ADVICE_CHUNK, help="Questions retrieved together.")
+    parser.add_argument("--batch-api", action="store_true",
+                        help="Generate with the OpenAI Batch API (cheaper, slower). Re-run to resume after a restart.")
+    parser.add_argument("--batch-state", default=BATCH_ADVICE_STATE_PATH, help="Prefix of the batch progress files.")
+    parser.add_argument("--batch-poll", type=float, default=BATCH_POLL_SECONDS, help="Seconds between batch status checks.")
+    args = parser.parse_args()
+
+    try:
+        counts = run_batch_advice(read_requests(args.input), args.output, concurrency=args.concurrency,
+                                  chunk_size=args.chunk_size, batch_api=args.batch_api,
+                                  batch_state_path=args.batch_state, batch_poll_seconds=args.batch_poll)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"Batch failed: {e}")
+        return 1
+    print(json.dumps(counts, indent=2))
+    return 1 if counts.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import tempfile
+import threading
+
+# --- Batch Settings ---
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW = "24h"
+# The Batch API accepts up to 50,000 requests per input file
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000"))
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "30"))
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchState:
+    """
+    The progress of a batch run, saved as JSON after every step so a
+    restarted process picks up where it stopped:
+      "batches": submitted jobs {"input_file_id", "batch_id", "custom_ids", "status"}
+      "results": finished responses {custom_id: message content}
+      "errors":  failed requests {custom_id: error message}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.data = {"batches": [], "results": {}, "errors": {}}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+            print(f"Resuming batch run from {path}.")
+        except FileNotFoundError:
+            pass
+
+    @property
+    def batches(self) -> list:
+        return self.data["batches"]
+
+    @property
+    def results(self) -> dict:
+        return self.data["results"]
+
+    @property
+    def errors(self) -> dict:
+        return self.data["errors"]
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, encoding="utf-8") as f:
+                json.dump(self.data, f)
+            os.replace(f.name, self.path)
+
+
+
+def clear_batch_state(path: str):
+    """Removes the saved progress once its results have been stored."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _write_input_file(requests_by_id: dict, model: str, **params) -> str:
+    """Writes the Batch API JSONL input and returns its path."""
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+        for custom_id, messages in requests_by_id.items():
+            body = dict(params, model=model, messages=messages)
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + "\n")
+    return f.name
+
+
+def _submit(client, job: dict, requests_by_id: dict, model: str, state: BatchState, **params):
+    """Uploads the input file and creates the batch, saving state after each step."""
+    if not job.get("input_file_id"):
+        # Ids from an earlier run that are no longer requested are dropped before upload
+        job["custom_ids"] = [cid for cid in job["custom_ids"] if cid in requests_by_id]
+        path = _write_input_file({cid: requests_by_id[cid] for cid in job["custom_ids"]}, model, **params)
+        try:
+            with open(path, "rb") as f:
+                job["input_file_id"] = client.files.create(file=f, purpose="batch").id
+        finally:
+            os.remove(path)
+        state.save()
+
+    if not job.get("batch_id"):
+        # After a crash between creating the batch and saving its id, reuse that batch
+        existing = next((b for b in client.batches.list(limit=100) if b.input_file_id == job["input_file_id"]), None)
+        batch = existing or client.batches.create(
+            input_file_id=job["input_file_id"], endpoint=BATCH_ENDPOINT, completion_window=BATCH_COMPLETION_WINDOW,
+        )
+        job.update(batch_id=batch.id, status=batch.status)
+        state.save()
+        print(f"  Submitted batch {batch.id} with {len(job['custom_ids'])} requests.")
+
+
+def _collect(client, job: dict, batch, state: BatchState):
+    """Reads the output and error files of a finished batch into the state."""
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            custom_id, response = record["custom_id"], record.get("response") or {}
+            if response.get("status_code") == 200:
+                state.results[custom_id] = response["body"]["choices"][0]["message"]["content"]
+            else:
+                error = record.get("error") or response.get("body", {}).get("error") or {}
+                state.errors[custom_id] = error.get("message", f"status {response.get('status_code')}")
+    # Requests that never produced a line (e.g. the batch expired) count as failed
+    for custom_id in job["custom_ids"]:
+        if custom_id not in state.results and custom_id not in state.errors:
+            state.errors[custom_id] = f"batch {batch.status}"
+    job["status"] = "collected"
+    state.save()
+
+
+def run_batch(client, requests_by_id: dict, state_path: str, model: str, poll_seconds: float = BATCH_POLL_SECONDS,
+              max_requests: int = BATCH_MAX_REQUESTS, **params) -> tuple:
+    """
+    Runs chat completions through the OpenAI Batch API.
+    `requests_by_id` maps a stable custom id to the request's messages; extra
+    keyword arguments (e.g. temperature) go into every request body.
+    Progress is kept in `state_path`, so calling this again after a restart
+    only submits requests that were never submitted and waits for the batches
+    that are still running.
+
+    Returns ({custom_id: content}, {custom_id: error}) for the requested ids.
+    """
+    state = BatchState(state_path)
+    assigned = {cid for job in state.batches for cid in job["custom_ids"]}
+    new_ids = [cid for cid in requests_by_id if cid not in assigned and cid not in state.results]
+    for start in range(0, len(new_ids), max_requests):
+        state.batches.append({"custom_ids": new_ids[start:start + max_requests], "input_file_id": None,
+                              "batch_id": None, "status": "pending"})
+    state.save()
+
+    jobs = [job for job in state.batches if not requests_by_id.keys().isdisjoint(job["custom_ids"])]
+    for job in jobs:
+        if job["status"] != "collected":
+            _submit(client, job, requests_by_id, model, state, **params)
+
+    while True:
+        running = [job for job in jobs if job["status"] != "collected"]
+        if not running:
+            break
+        for job in running:
+            batch = client.batches.retrieve(job["batch_id"])
+            if batch.status != job["status"]:
+                counts = batch.request_counts
+                progress = f" ({counts.completed}/{counts.total})" if counts else ""
+                print(f"  Batch {batch.id}: {batch.status}{progress}")
+                job["status"] = batch.status
+                state.save()
+            if batch.status in TERMINAL_STATUSES:
+                _collect(client, job, batch, state)
+        if any(job["status"] != "collected" for job in running):
+            time.sleep(poll_seconds)
+
+    results = {cid: state.results[cid] for cid in requests_by_id if cid in state.results}
+    errors = {cid: state.errors.get(cid, "not submitted") for cid in requests_by_id if cid not in results}
+    return results, errors
@@ -0,0 +1,97 @@
+import os
+import random
+import tempfile
+from datetime import datetime, timezone
+
+from benchmarks.fake_openai import FakeOpenAI
+
+TOPICS = [
+    "SIP", "UPI", "Inflation", "Emergency Fund", "Credit Score", "Term Insurance", "Health Insurance",
+    "Index Funds", "ELSS", "PPF", "Demat Account", "Home Loan", "Education Loan", "Budgeting", "Compounding",
+    "Fixed Deposit", "Mutual Funds", "Stock Market", "Intraday Trading", "Form 16",
+]
+FILLER = [
+    "saving regularly builds wealth", "start small and stay consistent", "compare fees before you invest",
+    "understand the risks involved", "keep an emergency buffer", "read the terms carefully",
+    "long-term investing smooths volatility", "taxes reduce your real returns",
+]
+
+
+def start_backends(scenario: dict) -> dict:
+    """
+    Points the app at offline stand-ins. Must run before importing agent or
+    scripts.ingest, since they read these settings at import time.
+    Returns {"fake": FakeOpenAI, "db": database}.
+    """
+    fake = FakeOpenAI(**scenario.get("llm", {}))
+    base_url = fake.start()
+    os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+    os.environ["LLM_API_KEY"] = "benchmark"
+    os.environ["TRANSLATION_BACKEND"] = "stub"
+    scratch = tempfile.mkdtemp(prefix="arthavivek-bench-")
+    os.environ["TRANSLATION_CACHE_PATH"] = os.path.join(scratch, "translations.sqlite3")
+    os.environ["FETCHER_CACHE_DIR"] = os.path.join(scratch, "http")
+    os.environ["INGEST_BATCH_STATE_PATH"] = os.path.join(scratch, "batch_state.json")
+
+    import db_utils
+    if scenario.get("mongo", "mongomock") == "mongomock":
+        import mongomock
+        os.environ.setdefault("MONGO_URI", "mongodb://mongomock")
+        db_utils.set_mongo_client(mongomock.MongoClient())
+    else:
+        # A real (local) mongod, e.g. "mongodb://localhost:27017"
+        os.environ["MONGO_URI"] = scenario["mongo"]
+
+    _, db, knowledge_base, updates = db_utils.get_db_connection()
+    knowledge_base.delete_many({})
+    db.knowledge_chunks.delete_many({})
+    updates.delete_many({})
+    seed_corpus(knowledge_base, scenario.get("corpus_size", 30), dim=fake.embedding_dim)
+    seed_chunks(knowledge_base, db.knowledge_chunks, dim=fake.embedding_dim)
+    if scenario.get("snapshot"):
+        # Serve retrieval from a local snapshot of the seeded corpus (see snapshot.py)
+        os.environ["SNAPSHOT_DIR"] = os.path.join(scratch, "snapshots")
+        from snapshot import export_snapshot
+        export_snapshot(db, os.environ["SNAPSHOT_DIR"])
+    return {"fake": fake, "db": db}
+
+
+def seed_corpus(knowledge_base, size: int, dim: int):
+    """Inserts `size` synthetic documents with embeddings."""
+    from embedding_utils import hashed_embedding, document_embedding_text
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc)
+    documents = []
+    for i in range(size):
+        topic = TOPICS[i % len(TOPICS)] + ("" if i < len(TOPICS) else f" (part {i // len(TOPICS) + 1})")
+        content = f"{topic} is one of the basics of personal finance. " + ". ".join(rng.choice(FILLER) for _ in range(25)) + "."
+        doc = {
+            "topic": topic, "content": content, "tags": [topic.lower()], "personas": ["student", "professional"],
+            "related_videos": [], "related_blogs": [], "updated_at": now,
+            "source_url": f"https://example.com/kb/{i}",
+        }
+        doc["embedding"] = hashed_embedding(document_embedding_text(doc), dim).tolist()
+        documents.append(doc)
+    if documents:
+        knowledge_base.insert_many(documents)
+
+
+def seed_chunks(knowledge_base, knowledge_chunks, dim: int):
+    """Builds the passage index for the seeded documents, as ingestion would."""
+    from embedding_utils import hashed_embedding
+    from chunking import chunk_document, chunk_embedding_text
+    now = datetime.now(timezone.utc)
+    chunks = [chunk for doc in knowledge_base.find() for chunk in chunk_document(doc)]
+    for chunk in chunks:
+        chunk.update(_id=f"{chunk['doc_id']}:{chunk['chunk_index']}", retired=False, updated_at=now,
+                     embedding=hashed_embedding(chunk_embedding_text(chunk), dim).tolist())
+    if chunks:
+        knowledge_chunks.insert_many(chunks)
+
+
+def make_articles(base_url: str, count: int) -> list:
+    """Article specs for scripts.ingest, served by the fake web server."""
+    return [{
+        "url": f"{base_url}/articles/{i}", "topic": f"Benchmark Article {i}", "personas": ["student"],
+        "tags": ["benchmark"], "related_videos": [], "related_blogs": [],
+    } for i in range(count)]
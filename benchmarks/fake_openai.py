@@ -0,0 +1,274 @@
+import json
+import time
+import random
+import threading
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from embedding_utils import hashed_embedding
+
+
+class FakeOpenAI:
+    """
+    A local stand-in for the OpenAI API (and for the article websites) so the
+    pipeline can be benchmarked offline.
+    Serves /v1/chat/completions (streaming and not), /v1/embeddings, the
+    Batch API (/v1/files and /v1/batches), and synthetic article pages at
+    /articles/<n>. Latency is configurable: `first_token_latency` before the
+    first token, then `tokens_per_second`; a batch completes `batch_latency`
+    seconds after it is created. To simulate a provider brownout, a share
+    `error_rate` of chat requests fails with a 503 and a share `slow_rate`
+    waits an extra `slow_latency` seconds before the first token.
+    """
+
+    def __init__(self, first_token_latency=0.3, tokens_per_second=60, answer_tokens=150,
+                 embedding_latency=0.02, embedding_dim=256, page_latency=0.1, batch_latency=1.0,
+                 prompt_cache_min_tokens=1024, error_rate=0.0, slow_rate=0.0, slow_latency=2.0, seed=0):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.embedding_latency = embedding_latency
+        self.embedding_dim = embedding_dim
+        self.page_latency = page_latency
+        self.batch_latency = batch_latency
+        self.prompt_cache_min_tokens = prompt_cache_min_tokens
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self._random = random.Random(seed)
+        self._prompt_prefixes = set()
+        self._prompt_lock = threading.Lock()
+        self.requests = {"chat": 0, "chat_errors": 0, "embeddings": 0, "pages": 0, "batches": 0, "batch_requests": 0}
+        self.files = {}
+        self.batches = {}
+        self._batch_lock = threading.Lock()
+        # Bump a page's revision to change its content (and ETag)
+        self.page_revisions = {}
+        self._server = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def answer_words(self) -> list:
+        words = ["## Getting", " started\n", "- Save", " a", " little", " every", " month."]
+        return [words[i % len(words)] for i in range(self.answer_tokens)]
+
+    def cached_tokens(self, messages: list) -> int:
+        """
+        Simulates prompt caching: the longest prefix of this prompt (in steps of
+        128 tokens, from `prompt_cache_min_tokens` on) that an earlier request
+        also started with. Words stand in for tokens.
+        """
+        tokens = "\n".join(f"{m.get('role')}:{m.get('content') or ''}" for m in messages).split()
+        cached = 0
+        with self._prompt_lock:
+            for end in range(self.prompt_cache_min_tokens, len(tokens) + 1, 128):
+                key = hash(tuple(tokens[:end]))
+                if key in self._prompt_prefixes:
+                    cached = end
+                else:
+                    self._prompt_prefixes.add(key)
+        return cached
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> dict:
+        file = {"id": f"file-{uuid.uuid4().hex[:24]}", "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+        self.files[file["id"]] = (file, content)
+        return file
+
+    def batch(self, batch_id: str) -> dict:
+        """The batch object; once `batch_latency` has passed it is completed and its output file exists."""
+        with self._batch_lock:
+            batch = self.batches[batch_id]
+            if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.batch_latency:
+                self._complete(batch)
+            return dict(batch)
+
+    def _complete(self, batch: dict):
+        _, content = self.files[batch["input_file_id"]]
+        lines = []
+        for line in content.decode("utf-8").splitlines():
+            request = json.loads(line)
+            self.requests["batch_requests"] += 1
+            body = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+                    "model": request["body"].get("model"), "choices": [{
+                        "index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": "".join(self.answer_words())}}]}
+            lines.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex[:16]}", "custom_id": request["custom_id"],
+                                     "response": {"status_code": 200, "body": body}, "error": None}))
+        output = self.add_file("\n".join(lines).encode("utf-8"), "output.jsonl", "batch_output")
+        total = len(lines)
+        batch.update(status="completed", output_file_id=output["id"], completed_at=int(time.time()),
+                     request_counts={"total": total, "completed": total, "failed": 0})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            file_id = self.path.split("/")[3]
+            if file_id not in self.fake.files:
+                return self._send_json({"error": {"message": "No such file"}}, 404)
+            _, content = self.fake.files[file_id]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif self.path.startswith("/v1/batches/"):
+            batch_id = self.path.split("/")[3]
+            if batch_id not in self.fake.batches:
+                return self._send_json({"error": {"message": "No such batch"}}, 404)
+            self._send_json(self.fake.batch(batch_id))
+        elif self.path.startswith("/v1/batches"):
+            data = [self.fake.batch(batch_id) for batch_id in reversed(list(self.fake.batches))]
+            self._send_json({"object": "list", "data": data, "has_more": False,
+                             "first_id": data[0]["id"] if data else None, "last_id": data[-1]["id"] if data else None})
+        elif self.path.startswith("/articles/"):
+            self.fake.requests["pages"] += 1
+            time.sleep(self.fake.page_latency)
+            n = self.path.rsplit("/", 1)[-1]
+            revision = self.fake.page_revisions.get(n, 0)
+            etag = f'"{n}-{revision}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            paragraphs = "".join(f"<p>Article {n} (revision {revision}) paragraph {i} about saving, budgeting and investing.</p>"
+                                 for i in range(60))
+            body = f"<html><body><nav>menu</nav><article>{paragraphs}</article></body></html>".encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json({"error": {"message": "not found"}}, 404)
+
+    def do_POST(self):
+        if self.path.endswith("/files"):
+            return self._upload_file()
+        payload = self._read_json()
+        if self.path.endswith("/batches"):
+            self._create_batch(payload)
+        elif self.path.endswith("/chat/completions"):
+            self.fake.requests["chat"] += 1
+            try:
+                self._chat(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client closed the stream early, e.g. a hedged request that lost the race
+                pass
+        elif self.path.endswith("/embeddings"):
+            self.fake.requests["embeddings"] += 1
+            self._embeddings(payload)
+        else:
+            self._send_json({"error": {"message": "not found"}}, 404)
+
+    def _chat(self, payload: dict):
+        fake = self.fake
+        words = fake.answer_words()
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in payload.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words),
+                 "prompt_tokens_details": {"cached_tokens": fake.cached_tokens(payload.get("messages", []))}}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": payload.get("model", "gpt-4o")}
+        roll = fake._random.random()
+        if roll < fake.error_rate:
+            fake.requests["chat_errors"] += 1
+            time.sleep(fake.first_token_latency / 2)
+            return self._send_json({"error": {"message": "The server is overloaded.", "type": "server_error"}}, 503)
+        time.sleep(fake.first_token_latency + (fake.slow_latency if roll < fake.error_rate + fake.slow_rate else 0))
+
+        if not payload.get("stream"):
+            time.sleep(len(words) / fake.tokens_per_second)
+            self._send_json(dict(base, object="chat.completion", choices=[{
+                "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(words)},
+            }], usage=usage))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(1 / fake.tokens_per_second)
+            chunk = dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {"content": word}, "finish_reason": None}])
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            chunk = dict(base, object="chat.completion.chunk", choices=[], usage=usage)
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _upload_file(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + self.rfile.read(length)
+        fields = {part.get_param("name", header="content-disposition"): part
+                  for part in BytesParser(policy=HTTP).parsebytes(raw).iter_parts()}
+        upload = fields["file"]
+        file = self.fake.add_file(upload.get_payload(decode=True), upload.get_filename() or "upload.jsonl",
+                                  fields["purpose"].get_content().strip())
+        self._send_json(file)
+
+    def _create_batch(self, payload: dict):
+        if payload.get("input_file_id") not in self.fake.files:
+            return self._send_json({"error": {"message": "No such file"}}, 400)
+        self.fake.requests["batches"] += 1
+        batch = {"id": f"batch_{uuid.uuid4().hex[:24]}", "object": "batch", "endpoint": payload["endpoint"],
+                 "input_file_id": payload["input_file_id"], "completion_window": payload["completion_window"],
+                 "status": "in_progress", "created_at": int(time.time()), "output_file_id": None, "error_file_id": None,
+                 "request_counts": {"total": 0, "completed": 0, "failed": 0}}
+        self.fake.batches[batch["id"]] = batch
+        self._send_json(batch)
+
+    def _embeddings(self, payload: dict):
+        time.sleep(self.fake.embedding_latency)
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = [{"object": "embedding", "index": i, "embedding": hashed_embedding(text, self.fake.embedding_dim).tolist()}
+                for i, text in enumerate(inputs)]
+        tokens = sum(len(text.split()) for text in inputs)
+        self._send_json({"object": "list", "data": data, "model": payload.get("model"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
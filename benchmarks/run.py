@@ -0,0 +1,172 @@
+"""
+Offline benchmark harness for the RAG pipeline.
+
+    python -m benchmarks.run benchmarks/scenarios/single_query.json
+    python -m benchmarks.run benchmarks/scenarios/concurrent_users.json --output bench_output.json
+
+Each scenario starts a fake OpenAI server (which also serves the article
+pages for ingestion), mongomock or a local mongod, and the stub translator,
+then reports latency percentiles, time-to-first-token, throughput and memory.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from benchmarks.backends import start_backends, make_articles
+
+DEFAULT_QUERIES = [
+    "How do I start a SIP?", "What is UPI?", "How does inflation affect my savings?",
+    "How big should my emergency fund be?", "How can I improve my credit score?",
+    "Do I need term insurance?", "What are index funds?", "How does ELSS save tax?",
+]
+
+
+def _percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50_ms": round(p50 * 1000, 1), "p95_ms": round(p95 * 1000, 1), "p99_ms": round(p99 * 1000, 1),
+            "mean_ms": round(float(np.mean(samples)) * 1000, 1), "count": len(samples)}
+
+
+def _one_query(agent, translate, query: str, persona: str, language: str) -> tuple:
+    """Runs one streamed request. Returns (total_seconds, time_to_first_token_seconds)."""
+    start = time.perf_counter()
+    first_token = None
+    parts = []
+    for event in agent.stream_financial_advice(query, persona):
+        if event["type"] == "chunk":
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            parts.append(event["text"])
+    if language != "English":
+        asyncio.run(translate("".join(parts), language))
+    return time.perf_counter() - start, first_token
+
+
+def _run_advice_phase(scenario: dict, cache_mode: str) -> dict:
+    import agent
+    from translation_utils import translate
+
+    queries = scenario.get("queries", DEFAULT_QUERIES)
+    users = scenario.get("users", 1)
+    per_user = scenario.get("queries_per_user", len(queries))
+    persona = scenario.get("persona", "Student")
+    language = scenario.get("language", "English")
+
+    agent.answer_cache.invalidate()
+    if cache_mode == "cold":
+        # Every request misses: nothing is ever kept
+        agent.answer_cache.max_entries = 0
+    else:
+        agent.answer_cache.max_entries = 512
+        for query in queries:
+            _one_query(agent, translate, query, persona, language)
+
+    jobs = [queries[(u + i) % len(queries)] for u in range(users) for i in range(per_user)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(pool.map(lambda q: _one_query(agent, translate, q, persona, language), jobs))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "cache": cache_mode,
+        "latency": _percentiles([total for total, _ in results]),
+        "time_to_first_token": _percentiles([ttft for _, ttft in results if ttft is not None]),
+        "throughput_rps": round(len(jobs) / elapsed, 2),
+        "answer_cache": agent.answer_cache.stats(),
+    }
+
+
+def run_advice(scenario: dict, backends: dict) -> dict:
+    modes = scenario.get("cache", "cold")
+    modes = modes if isinstance(modes, list) else [modes]
+    return {"phases": [_run_advice_phase(scenario, mode) for mode in modes]}
+
+
+def run_ingest(scenario: dict, backends: dict) -> dict:
+    """
+    Ingests the articles `passes` times. Before every pass after the first,
+    the first `changed_pages` pages get new content, so later passes measure
+    incremental re-ingestion.
+    """
+    from scripts import ingest
+
+    fake = backends["fake"]
+    count = scenario.get("articles", 20)
+    articles = make_articles(fake.base_url, count)
+    passes = []
+    for number in range(scenario.get("passes", 1)):
+        if number:
+            for n in range(scenario.get("changed_pages", 0)):
+                fake.page_revisions[str(n)] = number
+        summaries_before = fake.requests["chat"] + fake.requests["batch_requests"]
+        start = time.perf_counter()
+        ingest.ingest_articles(articles, **scenario.get("ingest_options", {}))
+        elapsed = time.perf_counter() - start
+        passes.append({
+            "wall_seconds": round(elapsed, 2),
+            "throughput_articles_per_s": round(count / elapsed, 2),
+            "llm_summaries": fake.requests["chat"] + fake.requests["batch_requests"] - summaries_before,
+        })
+    return {
+        "articles": count,
+        "stored": backends["db"].knowledge_base.count_documents({"topic": {"$regex": "^Benchmark Article"}}),
+        "passes": passes,
+    }
+
+
+RUNNERS = {"advice": run_advice, "ingest": run_ingest}
+
+
+def run_scenario(scenario: dict) -> dict:
+    tracemalloc.start()
+    backends = start_backends(scenario)
+    try:
+        report = RUNNERS[scenario.get("kind", "advice")](scenario, backends)
+    finally:
+        backends["fake"].stop()
+    from telemetry import memory_exporter
+    if memory_exporter() is not None:
+        report["stages"] = memory_exporter().summary()
+        report["routes"] = memory_exporter().breakdown("advice", "route")
+        report["answered_by"] = memory_exporter().breakdown("advice", "answered_by")
+        report["degraded"] = memory_exporter().breakdown("advice", "degraded")
+    if scenario.get("kind", "advice") == "advice":
+        from llm_gateway import gateway
+        report["llm_gateway"] = gateway.stats()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report.update(
+        name=scenario.get("name"),
+        llm_requests=dict(backends["fake"].requests),
+        python_peak_mb=round(peak / 2 ** 20, 1),
+        max_rss_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run offline benchmarks for the RAG pipeline.")
+    parser.add_argument("scenario", help="Path to a scenario JSON file.")
+    parser.add_argument("--output", help="Also write the report as JSON to this file.")
+    args = parser.parse_args()
+
+    # Backends are configured through module-level state, so one scenario per process
+    with open(args.scenario) as f:
+        scenario = json.load(f)
+    report = run_scenario(scenario)
+    print(json.dumps(report, indent=2, default=str))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
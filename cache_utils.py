@@ -0,0 +1,79 @@
+import time
+import threading
+from collections import OrderedDict
+from embedding_utils import normalize_query
+
+
+class AnswerCache:
+    """
+    Cache for RAG answers, keyed on (normalized query, persona). Only exact
+    keys match: near-duplicate questions can differ in one word ("should I
+    not invest...") that flips the advice, so answers are never reused across
+    different questions. Entries expire after `ttl_seconds` and the least recently used entry is
+    evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def make_key(query: str, persona: str) -> tuple:
+        return normalize_query(query), persona.lower()
+
+    def get(self, query: str, persona: str):
+        """Returns the cached value for this query, or None on a miss."""
+        key = self.make_key(query, persona)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry["value"]
+
+            self._stats["misses"] += 1
+            return None
+
+    def peek(self, query: str, persona: str) -> bool:
+        """True if an exact, unexpired entry exists. Doesn't count as a lookup."""
+        key = self.make_key(query, persona)
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (not self.ttl_seconds or time.time() - entry["created_at"] <= self.ttl_seconds)
+
+    def put(self, query: str, persona: str, value):
+        key = self.make_key(query, persona)
+        entry = {"value": value, "created_at": time.time()}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self):
+        """Drops every entry, e.g. after the knowledge base has changed."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    # --- Internal helpers (call with the lock held) ---
+    def _expire(self, now: float):
+        if not self.ttl_seconds:
+            return
+        expired = [k for k, e in self._entries.items() if now - e["created_at"] > self.ttl_seconds]
+        for k in expired:
+            del self._entries[k]
+        self._stats["expirations"] += len(expired)
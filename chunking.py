@@ -0,0 +1,159 @@
+import os
+import threading
+from functools import lru_cache
+from retrieval_utils import tokenize
+
+# --- Chunking Settings ---
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+# Prompt tokens spent on retrieved context per question
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Passages sharing at least this fraction of words with a chosen one are skipped
+DUPLICATE_THRESHOLD = 0.8
+TOKENIZER_ENCODING = "o200k_base"  # GPT-4o
+
+# Fields copied from the parent document onto each chunk
+CHUNK_FIELDS = ("topic", "tags", "personas", "related_videos", "related_blogs")
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder():
+    """The tiktoken encoder, or False if it can't be loaded (e.g. offline without a cached encoding)."""
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                try:
+                    import tiktoken
+                    _encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+                except Exception as e:
+                    print(f"Tokenizer unavailable ({e.__class__.__name__}); estimating tokens as characters / 4.")
+                    _encoder = False
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    encoder = _get_encoder()
+    if encoder:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of `text` that fits in `max_tokens`."""
+    encoder = _get_encoder()
+    if encoder:
+        tokens = encoder.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+@lru_cache(maxsize=4)
+def get_splitter(chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    # Only ingestion splits text; the app imports this module for token counting
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_tokens, chunk_overlap=overlap_tokens, length_function=count_tokens)
+
+
+def chunk_document(doc: dict, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list:
+    """
+    Splits a knowledge_base document's content into overlapping passages.
+    Each chunk records its parent's _id, its position and its character
+    offsets in the content, plus the parent's topic, tags and links.
+    """
+    content = doc.get("content") or ""
+    chunks, search_from = [], 0
+    for index, piece in enumerate(get_splitter(chunk_tokens, overlap_tokens).split_text(content)):
+        # Chunks come in order and each one starts after the previous one's start
+        start = content.find(piece, search_from)
+        if start < 0:
+            start = max(content.find(piece), 0)
+        search_from = start + 1
+        chunk = {field: doc.get(field) for field in CHUNK_FIELDS}
+        chunk.update(doc_id=doc["_id"], chunk_index=index, text=piece, start=start, end=start + len(piece))
+        chunks.append(chunk)
+    return chunks
+
+
+def chunk_embedding_text(chunk: dict) -> str:
+    """The text we embed for a passage: its topic gives short passages context."""
+    return f"{chunk.get('topic', '')}\n{chunk.get('text', '')}"
+
+
+# --- Context Packing ---
+def _novel_text(passage: dict, chosen_ranges: list) -> str:
+    """The part of the passage not already covered by chosen passages of the same document."""
+    start, end = passage["start"], passage["end"]
+    for chosen_start, chosen_end in chosen_ranges:
+        if chosen_start <= start < chosen_end:
+            start = chosen_end
+        if chosen_start < end <= chosen_end:
+            end = chosen_start
+    if start >= end:
+        return ""
+    return passage["text"][start - passage["start"]:end - passage["start"]]
+
+
+def _is_duplicate(words: set, chosen_words: list) -> bool:
+    for other in chosen_words:
+        if words and len(words & other) / min(len(words), len(other)) >= DUPLICATE_THRESHOLD:
+            return True
+    return False
+
+
+def pack_context(passages: list, budget_tokens: int = CONTEXT_TOKEN_BUDGET) -> tuple:
+    """
+    Picks the best passages (by 'score') that fit in `budget_tokens`.
+    Overlap between neighbouring chunks of one document is counted once, and
+    passages that repeat a chosen passage nearly word for word are skipped.
+    Returns (context text, chosen passages). The context groups passages by
+    document, in reading order, under the document's topic.
+    """
+    chosen, chosen_words, ranges_by_doc, used = [], [], {}, 0
+    for passage in sorted(passages, key=lambda p: p.get("score", 0.0), reverse=True):
+        novel = _novel_text(passage, ranges_by_doc.get(passage["doc_id"], []))
+        if not novel.strip():
+            continue
+        words = set(tokenize(novel))
+        if _is_duplicate(words, chosen_words):
+            continue
+        cost = count_tokens(novel)
+        if used + cost > budget_tokens:
+            continue
+        chosen.append(passage)
+        chosen_words.append(words)
+        ranges_by_doc.setdefault(passage["doc_id"], []).append((passage["start"], passage["end"]))
+        used += cost
+
+    blocks = context_blocks(chosen)
+    return "\n---\n".join(f"{topic}:\n{text}" for topic, text in blocks), chosen
+
+
+def context_blocks(chosen: list) -> list:
+    """
+    [(topic, text), ...] for the chosen passages: one block per document, in
+    order of first appearance, with the passages in reading order.
+    """
+    sections, order = {}, []
+    for passage in chosen:
+        if passage["doc_id"] not in sections:
+            order.append(passage["doc_id"])
+            sections[passage["doc_id"]] = []
+        sections[passage["doc_id"]].append(passage)
+
+    blocks = []
+    for doc_id in order:
+        parts, covered_to = [], None
+        for passage in sorted(sections[doc_id], key=lambda p: p["start"]):
+            text = passage["text"]
+            if covered_to is not None and passage["start"] < covered_to:
+                # Continue where the previous passage ended instead of repeating the overlap
+                text = text[covered_to - passage["start"]:]
+            elif covered_to is not None:
+                parts.append(" … ")
+            parts.append(text)
+            covered_to = max(covered_to or 0, passage["end"])
+        blocks.append((sections[doc_id][0].get("topic", ""), "".join(parts).strip()))
+    return blocks
@@ -0,0 +1,62 @@
+"""
+Process-wide clients, built on first use and then reused.
+Importing this module does no network I/O and doesn't import the OpenAI SDK;
+the first call to each factory does.
+"""
+import os
+import threading
+from dotenv import load_dotenv
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get_or_create(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def get_openai_api_key() -> str:
+    load_dotenv()
+    api_key = os.getenv("LLM_API_KEY")
+    if not api_key:
+        raise ValueError("LLM_API_KEY not found. Please check your .env file.")
+    return api_key
+
+
+def get_openai_client():
+    """The shared synchronous OpenAI client."""
+    def create():
+        from openai import OpenAI
+        return OpenAI(api_key=get_openai_api_key())
+    return _get_or_create("openai", create)
+
+
+def create_async_openai_client():
+    """A new AsyncOpenAI client (these are bound to one event loop, so callers keep one per loop)."""
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=get_openai_api_key())
+
+
+def get_database():
+    """
+    (MongoClient, database) for the app, or (None, None) if the connection
+    could not be set up. Missing declared indexes (see db_schema.py) are
+    created the first time the database is used in this process.
+    """
+    def create():
+        from db_utils import get_db_connection
+        from db_schema import ensure_indexes
+        db_client, db, _, _ = get_db_connection()
+        if not db_client:
+            return None
+        ensure_indexes(db)
+        return db_client, db
+    # A failed connection isn't cached, so the next call tries again
+    return _get_or_create("mongo", create) or (None, None)
+
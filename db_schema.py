@@ -0,0 +1,206 @@
+"""
+Declared MongoDB indexes and a query-plan check for the hot queries.
+
+    python db_schema.py            # create missing indexes and rebuild ones that differ
+    python db_schema.py --explain  # also explain every hot query; exits 1 on a COLLSCAN
+"""
+import sys
+import argparse
+from datetime import datetime, timezone
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure, PyMongoError
+
+# --- Index Declarations ---
+# Every index the app's queries rely on, by collection. ensure_indexes() creates
+# the missing ones; `python db_schema.py` also rebuilds existing indexes that
+# have the same keys but other options from these declarations.
+INDEXES = {
+    "knowledge_base": [
+        # Fallback $text retrieval; a topic or tag match counts more than a content match
+        IndexModel([("topic", TEXT), ("tags", TEXT), ("content", TEXT)], name="kb_text",
+                   weights={"topic": 10, "tags": 5, "content": 1}, default_language="english"),
+        # Ingestion upserts by topic and by source URL
+        IndexModel([("topic", ASCENDING)], name="topic_unique", unique=True),
+        IndexModel([("source_url", ASCENDING)], name="source_url_unique", unique=True,
+                   partialFilterExpression={"source_url": {"$type": "string"}}),
+        # Persona and tag filters (multikey: both fields are arrays)
+        IndexModel([("personas", ASCENDING)], name="personas"),
+        IndexModel([("tags", ASCENDING)], name="tags"),
+        # Incremental refresh of the in-memory retrieval index
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "knowledge_chunks": [
+        IndexModel([("doc_id", ASCENDING)], name="doc_id"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "updates": [
+        # Latest-first Knowledge Hub feed and its (date_published, _id) pagination
+        IndexModel([("date_published", DESCENDING), ("_id", DESCENDING)], name="date_published_id_desc"),
+    ],
+}
+
+# Indexes an earlier version declared; rebuilding (the CLI) drops them
+RETIRED_INDEXES = {
+    "updates": ["date_published_desc"],
+}
+
+# Error codes for "an index with these keys already exists with other options"
+INDEX_CONFLICT_CODES = {85, 86}
+
+
+def _key(spec) -> tuple:
+    """A comparable form of an index key, e.g. (('topic', 1),); all text indexes share one key."""
+    key = tuple((field, direction) for field, direction in spec)
+    if any(direction == TEXT for _, direction in key) or any(field == "_fts" for field, _ in key):
+        return (("_fts", "text"),)
+    return key
+
+
+def ensure_collection_indexes(collection, name: str = None, rebuild: bool = False) -> list:
+    """
+    Creates the declared indexes of one collection that are missing
+    (idempotent). An existing index on the same keys is left alone unless
+    `rebuild` is set, in which case one with a different name or options is
+    dropped and rebuilt. Rebuilding is only done from the command line, never
+    by a service that is taking traffic; it also drops RETIRED_INDEXES.
+    Returns the names of the new indexes.
+    """
+    declared = INDEXES[name or collection.name]
+    existing = {_key(info["key"]): index_name for index_name, info in collection.index_information().items()}
+    created = []
+    for model in declared:
+        document = model.document
+        current = existing.get(_key(document["key"].items()))
+        if current is not None and not rebuild:
+            if current != document["name"]:
+                print(f"Index '{current}' on {collection.name} differs from the declared '{document['name']}'; "
+                      f"run `python db_schema.py` to rebuild it.")
+            continue
+        try:
+            try:
+                collection.create_indexes([model])
+            except OperationFailure as e:
+                if e.code not in INDEX_CONFLICT_CODES or current is None:
+                    raise
+                print(f"Rebuilding index '{current}' on {collection.name} as '{document['name']}'.")
+                collection.drop_index(current)
+                collection.create_indexes([model])
+            else:
+                if current not in (None, document["name"]):
+                    # The server let both coexist (e.g. different partial filters); keep only the declared one
+                    collection.drop_index(current)
+        except PyMongoError as e:
+            # E.g. duplicate topics block the unique index; the app still works without it
+            print(f"Could not create index '{document['name']}' on {collection.name}: {e}")
+            continue
+        if current != document["name"]:
+            created.append(document["name"])
+    if rebuild:
+        for retired in RETIRED_INDEXES.get(name or collection.name, []):
+            if retired in existing.values():
+                print(f"Dropping retired index '{retired}' on {collection.name}.")
+                collection.drop_index(retired)
+    return created
+
+
+def ensure_indexes(db, rebuild: bool = False) -> list:
+    """Creates the missing declared indexes of every collection (see ensure_collection_indexes). Returns the new ones."""
+    created = []
+    for name in INDEXES:
+        try:
+            created.extend(ensure_collection_indexes(db[name], name, rebuild=rebuild))
+        except PyMongoError as e:
+            print(f"Could not check the indexes on {name}: {e}")
+    if created:
+        print(f"Created indexes: {', '.join(created)}.")
+    return created
+
+
+# --- Query Plan Checks ---
+def hot_queries() -> list:
+    """The queries that run on every request or every ingested article, with sample values."""
+    now = datetime.now(timezone.utc)
+    return [
+        {"name": "kb text search", "collection": "knowledge_base",
+         "filter": {"$text": {"$search": "emergency fund"}}, "projection": {"score": {"$meta": "textScore"}},
+         "sort": [("score", {"$meta": "textScore"})], "limit": 3},
+        {"name": "kb text search for a persona", "collection": "knowledge_base",
+         "filter": {"$text": {"$search": "emergency fund"}, "personas": {"$in": ["student", None, []]}},
+         "projection": {"score": {"$meta": "textScore"}}, "sort": [("score", {"$meta": "textScore"})], "limit": 3},
+        {"name": "kb refresh since watermark", "collection": "knowledge_base", "filter": {"updated_at": {"$gt": now}}},
+        {"name": "kb upsert by topic", "collection": "knowledge_base", "filter": {"topic": "Emergency Fund"}},
+        {"name": "kb stored lookup", "collection": "knowledge_base",
+         "filter": {"$or": [{"source_url": {"$in": ["https://example.com/a"]}}, {"topic": {"$in": ["Emergency Fund"]}}]}},
+        {"name": "kb persona filter", "collection": "knowledge_base", "filter": {"personas": "student"}},
+        {"name": "kb tag filter", "collection": "knowledge_base", "filter": {"tags": "budgeting"}},
+        {"name": "chunks refresh since watermark", "collection": "knowledge_chunks", "filter": {"updated_at": {"$gt": now}}},
+        {"name": "chunks by document", "collection": "knowledge_chunks", "filter": {"doc_id": "sample"}},
+        {"name": "latest updates", "collection": "updates", "filter": {},
+         "sort": [("date_published", DESCENDING), ("_id", DESCENDING)], "limit": 5},
+        {"name": "updates page", "collection": "updates",
+         "filter": {"$or": [{"date_published": {"$lt": now}}, {"date_published": now, "_id": {"$lt": "sample"}}]},
+         "sort": [("date_published", DESCENDING), ("_id", DESCENDING)], "limit": 5},
+    ]
+
+
+def _stages(plan) -> list:
+    """Every 'stage' name in an explain() plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_stages(item))
+    return stages
+
+
+def explain_query(db, query: dict) -> list:
+    """The stages of the winning plan for one hot query."""
+    cursor = db[query["collection"]].find(query["filter"], query.get("projection"))
+    if query.get("sort"):
+        cursor = cursor.sort(query["sort"])
+    if query.get("limit"):
+        cursor = cursor.limit(query["limit"])
+    return _stages(cursor.explain()["queryPlanner"]["winningPlan"])
+
+
+def check_query_plans(db) -> list:
+    """Explains every hot query. Returns the names of those that scan a whole collection."""
+    scans = []
+    for query in hot_queries():
+        stages = explain_query(db, query)
+        scanned = "COLLSCAN" in stages
+        print(f"{'COLLSCAN' if scanned else 'ok':8} {query['name']}: {' <- '.join(stages)}")
+        if scanned:
+            scans.append(query["name"])
+    return scans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or rebuild the declared MongoDB indexes and check query plans.")
+    parser.add_argument("--explain", action="store_true", help="Explain the hot queries and fail on a collection scan.")
+    args = parser.parse_args()
+
+    from db_utils import get_db_connection, close_db_connection
+    db_client, db, _, _ = get_db_connection()
+    if not db_client:
+        print("Database connection failed.")
+        return 1
+    try:
+        ensure_indexes(db, rebuild=True)
+        if args.explain:
+            scans = check_query_plans(db)
+            if scans:
+                print(f"{len(scans)} hot queries scan a whole collection.")
+                return 1
+            print("Every hot query uses an index.")
+        return 0
+    finally:
+        close_db_connection()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
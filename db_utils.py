@@ -1,45 +1,226 @@
 import os
+import atexit
+import threading
+import time
+import weakref
+import asyncio
 import pymongo
+from pymongo import monitoring
 from dotenv import load_dotenv
+from feed_utils import FEED_PROJECTION
+from telemetry import span, record_span
 
-def get_db_connection():
+DB_NAME = "vittavivek_db"
+
+# --- Shared Connection State ---
+# One pooled MongoClient per process. Streamlit reruns the app script on every
+# interaction but keeps imported modules alive, so this client is reused across
+# reruns and sessions instead of being rebuilt (and pinged) on every click.
+_client = None
+_client_lock = threading.Lock()
+
+_health = {"ok": None, "checked_at": None, "error": None}
+_health_thread = None
+_health_stop = threading.Event()
+
+
+class _CommandTimer(monitoring.CommandListener):
+    """Records every MongoDB command (find, aggregate, bulk writes, ...) as a telemetry span."""
+
+    IGNORED = {"ping", "hello", "ismaster", "isMaster", "endSessions"}
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if event.command_name not in self.IGNORED:
+            record_span(f"mongo.{event.command_name}", event.duration_micros / 1000, database=event.database_name)
+
+    def failed(self, event):
+        if event.command_name not in self.IGNORED:
+            record_span(f"mongo.{event.command_name}", event.duration_micros / 1000,
+                        error=str(event.failure.get("codeName", "failed")), database=event.database_name)
+
+
+def _client_options() -> dict:
+    """Reads the pool size and timeouts from the environment (see README)."""
+    return {
+        "event_listeners": [_CommandTimer()],
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "20")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000")),
+    }
+
+
+def get_mongo_client():
     """
-    Establishes a connection to the MongoDB database and returns the client,
-    the database, and the two main collections.
+    Returns the process-wide MongoClient, creating it on first use.
+    Creating the client does not block on the network; pymongo connects in the
+    background and the health check thread takes care of pinging.
     """
-    # Load environment variables from .env file
-    load_dotenv()
-    mongo_uri = os.getenv("MONGO_URI")
+    global _client
+    if _client is not None:
+        return _client
+
+    with _client_lock:
+        if _client is None:
+            # Load environment variables from .env file
+            load_dotenv()
+            mongo_uri = os.getenv("MONGO_URI")
+            if not mongo_uri:
+                raise ValueError("MONGO_URI not found in environment variables. Please check your .env file.")
 
-    if not mongo_uri:
-        raise ValueError("MONGO_URI not found in environment variables. Please check your .env file.")
+            _client = pymongo.MongoClient(mongo_uri, **_client_options())
+            start_health_check()
+    return _client
 
+
+def set_mongo_client(client):
+    """
+    Replaces the shared client, e.g. with mongomock in benchmarks.
+    Must be called before anything else connects.
+    """
+    global _client
+    with _client_lock:
+        _client = client
+
+
+def get_db_connection():
+    """
+    Returns the shared client, the database, and the two main collections.
+    Cheap to call repeatedly: every call reuses the same pooled client.
+    """
     try:
-        # Create a new client and connect to the server
-        client = pymongo.MongoClient(mongo_uri)
-        # Send a ping to confirm a successful connection
-        client.admin.command('ping')
-        print("Pinged your deployment. You successfully connected to MongoDB!")
-        
+        client = get_mongo_client()
+
         # Define the database and collections
-        db = client.vittavivek_db
+        db = client[DB_NAME]
         knowledge_base = db.knowledge_base
         updates = db.updates
-        
+
         return client, db, knowledge_base, updates
-    
+
+    except ValueError:
+        raise
     except Exception as e:
         print(f"An error occurred: {e}")
         return None, None, None, None
 
-# Add this function to db_utils.py
+
+# --- Background Health Check ---
+def _run_health_check(interval: float):
+    while not _health_stop.is_set():
+        client = _client
+        if client is None:
+            break
+        try:
+            with span("mongo.health_check"):
+                client.admin.command('ping')
+            if _health["ok"] is not True:
+                print("Pinged your deployment. You successfully connected to MongoDB!")
+            _health.update(ok=True, error=None)
+        except Exception as e:
+            if _health_stop.is_set():
+                break
+            if _health["ok"] is not False:
+                print(f"MongoDB health check failed: {e}")
+            _health.update(ok=False, error=str(e))
+        _health["checked_at"] = time.time()
+        _health_stop.wait(interval)
+
+
+def start_health_check(interval: float = None):
+    """Starts the daemon thread that pings the deployment off the request path."""
+    global _health_thread
+    if _health_thread is not None and _health_thread.is_alive():
+        return
+    if interval is None:
+        interval = float(os.getenv("MONGO_HEALTH_CHECK_INTERVAL", "30"))
+    _health_stop.clear()
+    _health_thread = threading.Thread(
+        target=_run_health_check, args=(interval,), name="mongo-health-check", daemon=True
+    )
+    _health_thread.start()
+
+
+def get_db_health() -> dict:
+    """
+    Returns the result of the most recent background ping.
+    'ok' is None until the first ping has completed.
+    """
+    return dict(_health)
+
+
+def close_db_connection():
+    """Stops the health check and closes the shared client. Safe to call twice."""
+    global _client, _health_thread
+    _health_stop.set()
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+    _health_thread = None
+    _health.update(ok=None, checked_at=None, error=None)
+
+
+atexit.register(close_db_connection)
+
+
+# --- Async Connections ---
+# AsyncMongoClient is bound to the event loop it is used on, so we keep one
+# pooled client per running loop.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_db():
+    """Returns the database on the current event loop's shared AsyncMongoClient."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        load_dotenv()
+        mongo_uri = os.getenv("MONGO_URI")
+        if not mongo_uri:
+            raise ValueError("MONGO_URI not found in environment variables. Please check your .env file.")
+        client = pymongo.AsyncMongoClient(mongo_uri, **_client_options())
+        _async_clients[loop] = client
+    return client[DB_NAME]
+
+
+async def close_async_db_connection():
+    """Closes the current event loop's AsyncMongoClient, if any."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+def get_kb_version(db) -> int:
+    """
+    Returns the knowledge base version counter stored in the 'meta' collection.
+    Ingestion bumps it whenever knowledge_base changes, so caches can invalidate.
+    """
+    try:
+        doc = db.meta.find_one({"_id": "knowledge_base"}, {"version": 1})
+        return doc.get("version", 0) if doc else 0
+    except Exception as e:
+        print(f"Error reading knowledge base version: {e}")
+        return None
+
+
+def bump_kb_version(db):
+    """Marks the knowledge base as changed."""
+    db.meta.update_one({"_id": "knowledge_base"}, {"$inc": {"version": 1}}, upsert=True)
+
+
 def get_latest_updates(updates_collection, limit=5):
     """
     Fetches the latest documents from the updates collection, sorted by date.
     """
     try:
         # Sort by date_published in descending order and limit the number of results
-        latest = updates_collection.find().sort("date_published", -1).limit(limit)
+        latest = updates_collection.find({}, FEED_PROJECTION).sort("date_published", -1).limit(limit)
         return list(latest)
     except Exception as e:
         print(f"Error fetching latest updates: {e}")
@@ -49,7 +230,8 @@ def get_latest_updates(updates_collection, limit=5):
 if __name__ == "__main__":
     client, db, kb, upd = get_db_connection()
     if client:
+        client.admin.command('ping')
         # Do something to test, e.g., print collection names
         print(f"Database: {db.name}")
         print(f"Collections: {db.list_collection_names()}")
-        client.close()
\ No newline at end of file
+        close_db_connection()
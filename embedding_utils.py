@@ -0,0 +1,69 @@
+import re
+import zlib
+import numpy as np
+
+# Words that carry no meaning for matching financial questions against each other.
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "what", "how", "to", "i", "my", "me",
+    "do", "does", "can", "should", "of", "in", "on", "for", "and", "or", "it",
+    "about", "please", "tell", "explain", "kya", "hai", "kaise", "ka", "ki", "ke",
+}
+
+
+def normalize_query(text: str) -> str:
+    """Lowercases, drops punctuation and collapses whitespace."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def hashed_embedding(text: str, dim: int = 512) -> np.ndarray:
+    """
+    A local, network-free embedding for short queries.
+    Hashes content words and their character trigrams into a fixed-size,
+    L2-normalised vector, so paraphrases that share most words land close together.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    words = [w for w in normalize_query(text).split() if w not in STOPWORDS]
+    for word in words:
+        features = [word] + [word[i:i + 3] for i in range(len(word) - 2)]
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# --- Semantic Embeddings (OpenAI) ---
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def embed_texts(client, texts: list, model: str = EMBEDDING_MODEL, batch_size: int = 100) -> np.ndarray:
+    """
+    Embeds a list of texts with the OpenAI embeddings endpoint.
+    Returns an (n, dim) float32 matrix with L2-normalised rows.
+    """
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        response = client.embeddings.create(model=model, input=texts[start:start + batch_size])
+        vectors.extend(item.embedding for item in response.data)
+
+    return _normalize_rows(vectors)
+
+
+async def embed_texts_async(async_client, texts: list, model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """Same as embed_texts, using an AsyncOpenAI client."""
+    response = await async_client.embeddings.create(model=model, input=texts)
+    return _normalize_rows([item.embedding for item in response.data])
+
+
+def _normalize_rows(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def document_embedding_text(doc: dict) -> str:
+    """The text we embed for a knowledge_base document."""
+    return f"{doc.get('topic', '')}\n{', '.join(doc.get('tags', []))}\n{doc.get('content', '')}"
@@ -0,0 +1,122 @@
+import os
+import re
+from embedding_utils import STOPWORDS
+from retrieval_utils import BM25Index, tokenize
+from router import definition_term, ARTICLES
+
+# --- Extractive Answer Settings ---
+# Set EXTRACTIVE_ENABLED=false to send every definitional question to the LLM.
+EXTRACTIVE_ENABLED = os.getenv("EXTRACTIVE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Extractive answers at or above this confidence are returned without calling the LLM
+EXTRACTIVE_MIN_CONFIDENCE = float(os.getenv("EXTRACTIVE_MIN_CONFIDENCE", "0.6"))
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "3"))
+EXTRACTIVE_MIN_WORDS = 4
+
+# Sentence score = BM25 (scaled to 0..1) plus these bonuses
+TOPIC_BONUS = 0.5       # times the share of question terms in the document's topic
+DEFINITION_BONUS = 0.5  # the sentence opens by defining the term ("X is ...", "An X refers to ...")
+POSITION_BONUS = 0.2    # divided by (1 + the sentence's position in its document)
+# Confidence = weighted share of question terms the answer covers, in its topic, and whether it defines the term
+COVERAGE_WEIGHT = 0.45
+TOPIC_WEIGHT = 0.35
+DEFINITION_WEIGHT = 0.2
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+| … ")
+MARKDOWN_HEADING = re.compile(r"^\s*#{1,6}\s")
+MARKDOWN_PREFIX = re.compile(r"^\s*([-*+•]\s+|\d+[.)]\s+)")
+# Words that, right after the term, make a sentence its definition ("is" covers "is called", "is known as", ...)
+DEFINITION_CUES = (("is",), ("are",), ("refers", "to"), ("refer", "to"), ("means",), ("mean",), ("stands", "for"))
+LEADING_ARTICLES = {"a", "an", "the"}
+PARENTHETICAL = re.compile(r"\([^)]*\)")
+QUESTION_WORDS = {"why", "when", "which", "who", "where", "define", "definition", "meaning", "full", "form"}
+
+
+def split_sentences(text: str) -> list:
+    """The statements of a (markdown) summary, without list markers; headings and questions are skipped."""
+    sentences = []
+    for part in SENTENCE_BREAK.split(text):
+        if MARKDOWN_HEADING.match(part):
+            continue
+        sentence = MARKDOWN_PREFIX.sub("", part).strip()
+        if len(sentence.split()) >= EXTRACTIVE_MIN_WORDS and sentence[-1] not in "?:":
+            sentences.append(sentence)
+    return sentences
+
+
+def _stem(word: str) -> str:
+    """Folds simple plurals ("funds" -> "fund") so questions and summaries match."""
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def _defines(sentence: str, term: list) -> bool:
+    """True if the sentence opens with the (stemmed) term followed by a definition cue: "An NPS (...) is ..."."""
+    words = tokenize(PARENTHETICAL.sub(" ", sentence))
+    while words and words[0] in LEADING_ARTICLES:
+        words = words[1:]
+    if not term or [_stem(w) for w in words[:len(term)]] != term:
+        return False
+    rest = words[len(term):]
+    return any(rest[:len(cue)] == list(cue) for cue in DEFINITION_CUES)
+
+
+def _terms(text: str) -> set:
+    return {_stem(w) for w in tokenize(text) if w not in STOPWORDS and w not in ARTICLES and w not in QUESTION_WORDS}
+
+
+class ExtractiveAnswerer:
+    """
+    Answers a question from the retrieved knowledge base text alone.
+    Every sentence of the sources is scored with BM25 against the question
+    terms, plus bonuses for a topic that names the term, a sentence that
+    defines it, and an early position. The best document's top sentences,
+    in reading order under the document's topic, make the answer. Its
+    confidence (0..1) says how well it covers the question; "topic_match"
+    says whether the answer's document is about the term at all.
+    """
+
+    def __init__(self, max_sentences: int = EXTRACTIVE_MAX_SENTENCES):
+        self.max_sentences = max_sentences
+
+    def answer(self, query: str, sources: list):
+        """
+        `sources` is [(topic, text), ...], best first. Returns {"answer",
+        "confidence", "topic", "topic_match"}, or None if no sentence mentions
+        the question.
+        """
+        term = definition_term(query)
+        terms = {_stem(w) for w in term} or _terms(query)
+        rows = [(block, position, sentence) for block, (_, text) in enumerate(sources)
+                for position, sentence in enumerate(split_sentences(text))]
+        if not terms or not rows:
+            return None
+
+        bm25 = BM25Index()
+        bm25.build([" ".join(_stem(w) for w in tokenize(sentence)) for _, _, sentence in rows])
+        lexical = bm25.scores(" ".join(terms))
+        if not lexical.any():
+            return None
+        lexical = lexical / lexical.max()
+        topic_share = [len(terms & _terms(topic)) / len(terms) for topic, _ in sources]
+        term_stems = [_stem(w) for w in term]
+        defines = [_defines(sentence, term_stems) for _, _, sentence in rows]
+        scores = [lexical[i] + TOPIC_BONUS * topic_share[block] + DEFINITION_BONUS * defines[i]
+                  + POSITION_BONUS / (1 + position) for i, (block, position, _) in enumerate(rows)]
+
+        best = max(range(len(rows)), key=lambda i: (lexical[i] > 0, scores[i]))
+        block = rows[best][0]
+        candidates = [i for i, row in enumerate(rows) if row[0] == block and (lexical[i] > 0 or defines[i])]
+        chosen = sorted(sorted(candidates, key=lambda i: scores[i], reverse=True)[:self.max_sentences],
+                        key=lambda i: rows[i][1])
+
+        topic = sources[block][0]
+        covered = set().union(*(_terms(rows[i][2]) for i in chosen)) | _terms(topic)
+        confidence = (COVERAGE_WEIGHT * len(terms & covered) / len(terms) + TOPIC_WEIGHT * topic_share[block]
+                      + DEFINITION_WEIGHT * any(defines[i] for i in chosen))
+        text = " ".join(_sentence(rows[i][2]) for i in chosen)
+        return {"answer": f"### {topic}\n\n{text}" if topic else text, "confidence": round(confidence, 3), "topic": topic,
+                "topic_match": topic_share[block] > 0}
+
+
+def _sentence(text: str) -> str:
+    text = text[0].upper() + text[1:]
+    return text if text[-1] in ".!?" else text + "."
@@ -0,0 +1,170 @@
+import os
+import threading
+import pymongo
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+from db_schema import ensure_collection_indexes
+
+# --- Knowledge Hub Feed Settings ---
+FEED_CACHE_SIZE = int(os.getenv("FEED_CACHE_SIZE", "20"))
+FEED_POLL_SECONDS = float(os.getenv("FEED_POLL_SECONDS", "60"))
+
+# Only the fields the Knowledge Hub renders
+FEED_PROJECTION = {"_id": 0, "title": 1, "source": 1, "date_published": 1, "summary": 1, "original_link": 1}
+# Feed queries also fetch each _id: it tells apart updates published at the
+# same time, and (date_published, _id) is the cursor for "Load more"
+CURSOR_PROJECTION = dict(FEED_PROJECTION, _id=1)
+FEED_SORT = [("date_published", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]
+
+
+def feed_item(doc: dict) -> dict:
+    """An update as served to the Knowledge Hub: _id becomes the string 'id' used as the paging cursor."""
+    item = {key: value for key, value in doc.items() if key != "_id"}
+    if "_id" in doc:
+        item["id"] = str(doc["_id"])
+    return item
+
+
+def older_than(before, before_id=None) -> dict:
+    """
+    Filter for the updates after the cursor (before, before_id) in FEED_SORT
+    order, so updates sharing the boundary timestamp aren't skipped. Without
+    an id, only updates published strictly before `before` match.
+    """
+    if before_id is None:
+        return {"date_published": {"$lt": before}}
+    if isinstance(before_id, str) and ObjectId.is_valid(before_id):
+        before_id = ObjectId(before_id)
+    return {"$or": [{"date_published": {"$lt": before}}, {"date_published": before, "_id": {"$lt": before_id}}]}
+
+
+def ensure_feed_index(updates_collection):
+    """Creates the index that backs the latest-first feed queries (idempotent)."""
+    ensure_collection_indexes(updates_collection, "updates")
+
+
+class FeedCache:
+    """
+    Holds the newest `size` Knowledge Hub updates in process memory, shared by
+    every session. A background thread keeps it fresh, either from a change
+    stream (when the deployment supports one) or by polling for documents
+    published at or after the `date_published` watermark, skipping the ones
+    already cached.
+    """
+
+    def __init__(self, updates_collection, size=FEED_CACHE_SIZE, poll_interval=FEED_POLL_SECONDS):
+        self.collection = updates_collection
+        self.size = size
+        self.poll_interval = poll_interval
+        self._articles = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        try:
+            ensure_feed_index(self.collection)
+        except PyMongoError as e:
+            print(f"Could not create the feed index: {e}")
+        self.reload()
+        self._thread = threading.Thread(target=self._run, name="feed-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def latest(self, limit=5) -> list:
+        with self._lock:
+            return [feed_item(article) for article in self._articles[:limit]]
+
+    def page(self, before, before_id=None, limit=5) -> list:
+        """Returns the next `limit` updates after the cursor of the last one shown (a range query, not skip)."""
+        try:
+            cursor = self.collection.find(older_than(before, before_id), CURSOR_PROJECTION)
+            return [feed_item(doc) for doc in cursor.sort(FEED_SORT).limit(limit)]
+        except PyMongoError as e:
+            print(f"Error fetching older updates: {e}")
+            return []
+
+    def reload(self):
+        """Replaces the cached feed with the newest documents."""
+        try:
+            cursor = self.collection.find({}, CURSOR_PROJECTION).sort(FEED_SORT).limit(self.size)
+            articles = list(cursor)
+        except PyMongoError as e:
+            print(f"Error fetching latest updates: {e}")
+            return
+        with self._lock:
+            self._articles = articles
+
+    def poll(self):
+        """
+        Merges in documents published at or after the newest cached one.
+        Several updates can share a timestamp, so the query includes the
+        watermark itself and drops the documents that are already cached.
+        """
+        with self._lock:
+            watermark = self._articles[0]["date_published"] if self._articles else None
+            known = {article["_id"] for article in self._articles if article["date_published"] == watermark}
+        if watermark is None:
+            self.reload()
+            return
+        try:
+            cursor = self.collection.find({"date_published": {"$gte": watermark}}, CURSOR_PROJECTION)
+            found = cursor.sort(FEED_SORT).limit(self.size + len(known))
+            newer = [article for article in found if article["_id"] not in known]
+        except PyMongoError as e:
+            print(f"Error polling for new updates: {e}")
+            return
+        if newer:
+            new_ids = {article["_id"] for article in newer}
+            with self._lock:
+                merged = newer + [article for article in self._articles if article["_id"] not in new_ids]
+                merged.sort(key=lambda article: (article["date_published"], article["_id"]), reverse=True)
+                self._articles = merged[:self.size]
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._watch()
+            except OperationFailure:
+                # Change streams need a replica set; standalone servers fall back to polling
+                self._poll_forever()
+                return
+            except PyMongoError as e:
+                print(f"Feed change stream interrupted: {e}")
+                self._poll_once_and_wait()
+
+    def _watch(self):
+        with self.collection.watch(max_await_time_ms=int(self.poll_interval * 1000)) as stream:
+            while not self._stop.is_set():
+                change = stream.try_next()
+                if change is None:
+                    continue
+                if change["operationType"] == "insert":
+                    self.poll()
+                else:
+                    # Edits and deletes can touch any cached article
+                    self.reload()
+
+    def _poll_once_and_wait(self):
+        self.poll()
+        self._stop.wait(self.poll_interval)
+
+    def _poll_forever(self):
+        while not self._stop.is_set():
+            self._poll_once_and_wait()
+
+
+_feed_cache = None
+_feed_cache_lock = threading.Lock()
+
+
+def get_feed_cache(updates_collection) -> FeedCache:
+    """Returns the process-wide feed cache, loading it on first use."""
+    global _feed_cache
+    with _feed_cache_lock:
+        if _feed_cache is None:
+            _feed_cache = FeedCache(updates_collection)
+            _feed_cache.start()
+    return _feed_cache
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from lxml import etree
+from telemetry import span
+
+# --- Fetcher Settings ---
+# live: fetch over the network (with the on-disk cache)
+# record: like live, and also save every page as a fixture
+# replay: serve saved fixtures only; no network access
+FETCHER_MODE = os.getenv("FETCHER_MODE", "live")
+FETCHER_CACHE_DIR = os.getenv("FETCHER_CACHE_DIR", ".cache/http")
+FETCHER_FIXTURES_DIR = os.getenv("FETCHER_FIXTURES_DIR", "fixtures/html")
+FETCHER_POOL_SIZE = int(os.getenv("FETCHER_POOL_SIZE", "16"))
+FETCHER_TIMEOUT_SECONDS = float(os.getenv("FETCHER_TIMEOUT_SECONDS", "10"))
+
+USER_AGENT = "Mozilla/5.0"
+MAX_ARTICLE_CHARS = 4000
+CHUNK_SIZE = 16 * 1024
+
+
+class ResponseStore:
+    """
+    Pages saved on disk, keyed by URL: <sha256>.html holds the body and
+    <sha256>.json the URL, validators and whether the body is complete.
+    Used both for the HTTP cache and for recorded fixtures.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _paths(self, url: str) -> tuple:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}.json"), os.path.join(self.directory, f"{key}.html")
+
+    def get(self, url: str):
+        """Returns (meta, body) or None."""
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url: str, body: bytes, etag: str = None, last_modified: str = None, encoding: str = None,
+            complete: bool = True):
+        meta_path, body_path = self._paths(url)
+        meta = {"url": url, "etag": etag, "last_modified": last_modified, "encoding": encoding,
+                "complete": complete, "saved_at": time.time()}
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to temporary files first so readers never see half a page
+            with open(body_path + ".tmp", "wb") as f:
+                f.write(body)
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(body_path + ".tmp", body_path)
+            os.replace(meta_path + ".tmp", meta_path)
+
+
+class ArticleExtractor:
+    """
+    Incremental lxml extraction of the paragraph text of a page.
+    Text is collected separately for <article>, <main> and <body>, and the
+    first non-empty one wins, as before. Once the <article> text fills the
+    character budget, `done` is set so the caller can stop downloading.
+    """
+
+    def __init__(self, max_chars: int = MAX_ARTICLE_CHARS, encoding: str = None):
+        self.max_chars = max_chars
+        self.done = False
+        # Without a declared encoding lxml falls back to the page's <meta charset>
+        self._parser = etree.HTMLPullParser(events=("start", "end"), encoding=encoding)
+        self._open = {"article": 0, "main": 0, "body": 0}
+        self._paragraphs = {"article": [], "main": [], "body": []}
+        self._chars = {"article": 0, "main": 0, "body": 0}
+
+    def feed(self, data: bytes):
+        self._parser.feed(data)
+        self._consume()
+
+    def close(self) -> str:
+        if not self.done:
+            try:
+                self._parser.close()
+            except etree.LxmlError:
+                pass
+            self._consume()
+        for region in ("article", "main", "body"):
+            if self._paragraphs[region]:
+                return " ".join(self._paragraphs[region])[:self.max_chars]
+        return ""
+
+    def _consume(self):
+        for event, element in self._parser.read_events():
+            tag = element.tag if isinstance(element.tag, str) else ""
+            if tag in self._open:
+                self._open[tag] += 1 if event == "start" else -1
+            elif tag == "p" and event == "end":
+                text = "".join(element.itertext())
+                for region, depth in self._open.items():
+                    if depth > 0 and self._chars[region] <= self.max_chars:
+                        self._paragraphs[region].append(text)
+                        self._chars[region] += len(text) + 1
+                element.clear()
+                if self._chars["article"] > self.max_chars:
+                    self.done = True
+                    return
+
+
+def extract_article_text(html: bytes, max_chars: int = MAX_ARTICLE_CHARS, encoding: str = None) -> str:
+    """Paragraph text of <article>, else <main>, else <body>, truncated to max_chars."""
+    extractor = ArticleExtractor(max_chars, encoding)
+    for start in range(0, len(html), CHUNK_SIZE):
+        extractor.feed(html[start:start + CHUNK_SIZE])
+        if extractor.done:
+            break
+    return extractor.close()
+
+
+class Fetcher:
+    """
+    Downloads article pages over a pooled keep-alive session and extracts
+    their text.
+    Responses are cached on disk and revalidated with ETag/Last-Modified;
+    the body is parsed while it streams in, and the download stops once the
+    article text budget is filled.
+    """
+
+    def __init__(self, mode: str = FETCHER_MODE, cache_dir: str = FETCHER_CACHE_DIR,
+                 fixtures_dir: str = FETCHER_FIXTURES_DIR, pool_size: int = FETCHER_POOL_SIZE,
+                 timeout: float = FETCHER_TIMEOUT_SECONDS):
+        if mode not in ("live", "record", "replay"):
+            raise ValueError(f"Unknown fetcher mode '{mode}'. Use live, record or replay.")
+        self.mode = mode
+        self.timeout = timeout
+        self.cache = ResponseStore(cache_dir) if cache_dir else None
+        self.fixtures = ResponseStore(fixtures_dir)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url: str, etag: str = None, last_modified: str = None) -> dict:
+        """
+        Fetches and extracts one article.
+        `etag`/`last_modified` are the validators the caller already has; if
+        the page is unchanged since then the result is "not_modified".
+        Returns {"status": "ok" | "not_modified" | "failed", "text", "etag",
+        "last_modified", "from_cache"}.
+        """
+        with span("fetch", mode=self.mode) as s:
+            if self.mode == "replay":
+                result = self._replay(url)
+            else:
+                result = self._fetch_live(url, etag, last_modified)
+            s.set(status=result["status"], cache_hit=result["from_cache"], chars=len(result["text"]))
+            return result
+
+    def _replay(self, url: str) -> dict:
+        saved = self.fixtures.get(url)
+        if saved is None:
+            print(f"  No recorded fixture for {url}.")
+            return _result("failed")
+        meta, body = saved
+        return _result("ok", extract_article_text(body, encoding=meta.get("encoding")), meta.get("etag"),
+                       meta.get("last_modified"), from_cache=True)
+
+    def _fetch_live(self, url: str, etag: str, last_modified: str) -> dict:
+        cached = self.cache.get(url) if self.cache and self.mode == "live" else None
+        headers = {}
+        validators = (cached[0]["etag"], cached[0]["last_modified"]) if cached else (etag, last_modified)
+        if validators[0]:
+            headers["If-None-Match"] = validators[0]
+        if validators[1]:
+            headers["If-Modified-Since"] = validators[1]
+
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304:
+                if cached is None or (etag, last_modified) == validators:
+                    return _result("not_modified", etag=validators[0], last_modified=validators[1])
+                meta, body = cached
+                return _result("ok", extract_article_text(body, encoding=meta.get("encoding")), meta["etag"],
+                               meta["last_modified"], from_cache=True)
+            response.raise_for_status()
+
+            new_etag, new_last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+            encoding = _declared_encoding(response)
+            if self.mode == "record":
+                # Fixtures keep the whole page so replays are faithful
+                body = response.content
+                text = extract_article_text(body, encoding=encoding)
+                self.fixtures.put(url, body, new_etag, new_last_modified, encoding)
+            else:
+                extractor = ArticleExtractor(encoding=encoding)
+                parts = []
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    parts.append(chunk)
+                    extractor.feed(chunk)
+                    if extractor.done:
+                        break
+                body, text = b"".join(parts), extractor.close()
+                if self.cache and (new_etag or new_last_modified):
+                    self.cache.put(url, body, new_etag, new_last_modified, encoding, complete=not extractor.done)
+            return _result("ok", text, new_etag, new_last_modified)
+
+
+def _declared_encoding(response) -> str:
+    """The charset from the Content-Type header, if the server sent one."""
+    content_type = response.headers.get("Content-Type", "")
+    return requests.utils.get_encoding_from_headers({"content-type": content_type}) if "charset" in content_type.lower() else None
+
+
+def _result(status: str, text: str = "", etag: str = None, last_modified: str = None, from_cache: bool = False) -> dict:
+    return {"status": status, "text": text, "etag": etag, "last_modified": last_modified, "from_cache": from_cache}
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher() -> Fetcher:
+    """The process-wide fetcher (one pooled session), configured from the environment."""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = Fetcher()
+    return _fetcher
+
+
+def set_fetcher(fetcher: Fetcher):
+    """Replaces the process-wide fetcher, e.g. to switch to replay mode from a CLI flag."""
+    global _fetcher
+    with _fetcher_lock:
+        _fetcher = fetcher
@@ -0,0 +1,462 @@
+"""
+One resilient path for every chat completion call.
+
+    response = gateway.chat(client, model="gpt-4o", messages=messages)
+    response = await gateway.achat(async_client, model="gpt-4o", messages=messages)
+
+Each call gets:
+  - a deadline that covers queueing, every attempt and every backoff sleep
+  - jittered exponential retries on 429, 5xx, timeouts and connection errors
+    (honouring Retry-After)
+  - an optional hedged second request once the call has taken longer than
+    the recent p95 for that model
+  - a circuit breaker: after repeated provider failures calls fail fast with
+    LLMUnavailable until a probe request succeeds
+  - a token bucket shared by every thread and event loop in the process
+
+Streaming calls (stream=True) are retried and hedged up to the moment the
+stream opens; the caller reads the chunks.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+# --- Gateway Settings ---
+# Total time allowed for one call, retries included
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+# Hedging: send a second request when the first is slower than this latency quantile
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "0.25"))
+LLM_LATENCY_WINDOW = 200
+# Circuit breaker: open after this many consecutive failures, probe again after the cooldown
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+# Client-side rate limit (requests per second, 0 = unlimited); retries and hedges count too
+LLM_REQUESTS_PER_SECOND = float(os.getenv("LLM_REQUESTS_PER_SECOND", "10"))
+LLM_BURST = int(os.getenv("LLM_BURST", "20"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "32"))
+
+
+class LLMUnavailable(Exception):
+    """Raised without calling the provider: the breaker is open, or the deadline or rate limit leaves no room."""
+
+    def __init__(self, reason: str, message: str = None):
+        super().__init__(message or f"LLM unavailable ({reason})")
+        self.reason = reason
+
+
+def is_retryable(error: Exception) -> bool:
+    """429, 5xx, timeouts and connection errors are worth another attempt; other 4xx are not."""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        from openai import APIConnectionError  # includes APITimeoutError
+    except ImportError:
+        return False
+    return isinstance(error, APIConnectionError)
+
+
+def retry_after(error: Exception):
+    """Seconds from the provider's Retry-After header, if it sent one."""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Allows `rate` requests per second with bursts of `capacity`. Thread-safe; rate <= 0 disables it."""
+
+    def __init__(self, rate: float = LLM_REQUESTS_PER_SECOND, capacity: int = LLM_BURST):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is free and returns 0, otherwise returns the seconds until one will be."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout: float) -> bool:
+        """Waits up to `timeout` seconds for a token."""
+        give_up = time.monotonic() + timeout
+        while True:
+            wait_seconds = self.try_acquire()
+            if not wait_seconds:
+                return True
+            if time.monotonic() + wait_seconds > give_up:
+                return False
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self, timeout: float) -> bool:
+        give_up = time.monotonic() + timeout
+        while True:
+            wait_seconds = self.try_acquire()
+            if not wait_seconds:
+                return True
+            if time.monotonic() + wait_seconds > give_up:
+                return False
+            await asyncio.sleep(wait_seconds)
+
+
+class CircuitBreaker:
+    """
+    closed    -- calls go through; `failure_threshold` consecutive failures open it
+    open      -- calls fail fast until `cooldown_seconds` have passed
+    half_open -- one probe call goes through; success closes, failure re-opens
+    A call admitted as the probe must end in record_success(), record_failure()
+    or, if it never reached the provider, release_probe().
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, cooldown_seconds: float = LLM_BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"opened": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                return "half_open"
+            return self._state
+
+    def admit(self):
+        """"closed" or "probe" if the call may go ahead, None if it must fail fast."""
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self._state, self._probing = "half_open", False
+            if self._state == "closed":
+                return "closed"
+            if self._state == "half_open" and not self._probing:
+                self._probing = True
+                return "probe"
+            self._stats["rejected"] += 1
+            return None
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                print("LLM circuit breaker closed.")
+            self._state, self._failures, self._probing = "closed", 0, False
+
+    def release_probe(self):
+        """Lets another call probe when the probe ended without an outcome (rate limited, cancelled...)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                if self._state == "closed":
+                    self._stats["opened"] += 1
+                print(f"LLM circuit breaker open for {self.cooldown_seconds:.0f}s after {self._failures} failures.")
+                self._state, self._opened_at, self._probing = "open", time.monotonic(), False
+
+    def stats(self) -> dict:
+        state = self.state
+        with self._lock:
+            return dict(self._stats, state=state, consecutive_failures=self._failures)
+
+
+class LatencyTracker:
+    """Recent successful request latencies per (model, streaming), for the hedge threshold."""
+
+    def __init__(self, window: int = LLM_LATENCY_WINDOW, min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: tuple, seconds: float):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, key: tuple, q: float):
+        """The q-quantile in seconds, or None until there are `min_samples` samples."""
+        with self._lock:
+            samples = list(self._samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return float(np.quantile(samples, q))
+
+
+class LLMGateway:
+    """Deadlines, retries, hedging, circuit breaking and rate limiting around chat.completions.create."""
+
+    def __init__(self, deadline_seconds: float = LLM_DEADLINE_SECONDS, max_retries: int = LLM_MAX_RETRIES,
+                 hedge: bool = LLM_HEDGE_ENABLED, hedge_quantile: float = LLM_HEDGE_QUANTILE,
+                 breaker: CircuitBreaker = None, bucket: TokenBucket = None, latencies: LatencyTracker = None):
+        self.deadline_seconds = deadline_seconds
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.breaker = breaker or CircuitBreaker()
+        self.bucket = bucket or TokenBucket()
+        self.latencies = latencies or LatencyTracker()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats = {"calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0,
+                       "deadline_exceeded": 0, "rate_limited": 0}
+        self._stats_lock = threading.Lock()
+
+    # --- Synchronous calls ---
+    def chat(self, client, deadline: float = None, hedge: bool = None, max_retries: int = None, **params):
+        """
+        client.chat.completions.create(**params) within `deadline` seconds.
+        Raises LLMUnavailable if the call was not attempted (or could not be
+        retried) in time, and the provider's last error if every attempt failed.
+        """
+        give_up = time.monotonic() + (deadline or self.deadline_seconds)
+        key = (params.get("model"), bool(params.get("stream")))
+        hedge = self.hedge if hedge is None else hedge
+        retries = self.max_retries if max_retries is None else max_retries
+        self._count("calls")
+        for attempt in range(retries + 1):
+            probe = self._admit(give_up)
+            try:
+                if not self.bucket.acquire(self._remaining(give_up)):
+                    self._count("rate_limited")
+                    raise LLMUnavailable("rate_limited", "LLM rate limit leaves no room before the deadline.")
+                return self._attempt(client, params, key, give_up, hedge)
+            except Exception as e:
+                if not self._should_retry(e, attempt, retries):
+                    raise
+                delay = self._backoff(e, attempt, give_up)
+                print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+            finally:
+                if probe:
+                    # No-op once the attempt recorded an outcome
+                    self.breaker.release_probe()
+            time.sleep(delay)
+
+    def _attempt(self, client, params: dict, key: tuple, give_up: float, hedge: bool):
+        threshold = self._hedge_delay(key) if hedge else None
+        if threshold is None or threshold >= self._remaining(give_up):
+            return self._timed_create(client, params, key, self._remaining(give_up))
+
+        pool = self._pool()
+        primary = pool.submit(self._timed_create, client, params, key, self._remaining(give_up))
+        done, _ = wait([primary], timeout=threshold)
+        # Only hedge while the breaker is closed; a hedge must not take the half-open probe
+        if done or self.breaker.state != "closed" or self.bucket.try_acquire():
+            return primary.result()
+        self._count("hedges")
+        secondary = pool.submit(self._timed_create, client, params, key, self._remaining(give_up))
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=self._remaining(give_up), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is secondary:
+                        self._count("hedge_wins")
+                    for loser in (primary, secondary):
+                        if loser is not future:
+                            loser.add_done_callback(_discard)
+                    return future.result()
+                error = future.exception()
+        for loser in pending:
+            loser.add_done_callback(_discard)
+        raise error or TimeoutError("LLM request exceeded its deadline.")
+
+    def _timed_create(self, client, params: dict, key: tuple, timeout: float):
+        self._count("attempts")
+        start = time.monotonic()
+        try:
+            response = client.with_options(max_retries=0, timeout=max(timeout, 0.001)).chat.completions.create(**params)
+        except Exception as e:
+            # Only provider-side trouble counts against the breaker; a 400 means it is up
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.latencies.record(key, time.monotonic() - start)
+        return response
+
+    # --- Asynchronous calls ---
+    async def achat(self, client, deadline: float = None, hedge: bool = None, max_retries: int = None, **params):
+        """Async counterpart of chat() for AsyncOpenAI clients."""
+        give_up = time.monotonic() + (deadline or self.deadline_seconds)
+        key = (params.get("model"), bool(params.get("stream")))
+        hedge = self.hedge if hedge is None else hedge
+        retries = self.max_retries if max_retries is None else max_retries
+        self._count("calls")
+        for attempt in range(retries + 1):
+            probe = self._admit(give_up)
+            try:
+                if not await self.bucket.acquire_async(self._remaining(give_up)):
+                    self._count("rate_limited")
+                    raise LLMUnavailable("rate_limited", "LLM rate limit leaves no room before the deadline.")
+                return await self._attempt_async(client, params, key, give_up, hedge)
+            except Exception as e:
+                if not self._should_retry(e, attempt, retries):
+                    raise
+                delay = self._backoff(e, attempt, give_up)
+                print(f"LLM call failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+            finally:
+                if probe:
+                    self.breaker.release_probe()
+            await asyncio.sleep(delay)
+
+    async def _attempt_async(self, client, params: dict, key: tuple, give_up: float, hedge: bool):
+        threshold = self._hedge_delay(key) if hedge else None
+        primary = asyncio.ensure_future(self._timed_create_async(client, params, key, self._remaining(give_up)))
+        tasks, winner = [primary], None
+        try:
+            if threshold is not None and threshold < self._remaining(give_up):
+                done, _ = await asyncio.wait(tasks, timeout=threshold)
+                if not done and self.breaker.state == "closed" and not self.bucket.try_acquire():
+                    self._count("hedges")
+                    tasks.append(asyncio.ensure_future(self._timed_create_async(client, params, key, self._remaining(give_up))))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self._remaining(give_up), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        winner = task
+                        return task.result()
+                    error = task.exception()
+            raise error or TimeoutError("LLM request exceeded its deadline.")
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and not task.cancelled() and task.exception() is None:
+                    # Close a stream opened by the request that lost the race
+                    await _adiscard(task.result())
+
+    async def _timed_create_async(self, client, params: dict, key: tuple, timeout: float):
+        self._count("attempts")
+        start = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                client.with_options(max_retries=0, timeout=max(timeout, 0.001)).chat.completions.create(**params),
+                max(timeout, 0.001),
+            )
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        self.latencies.record(key, time.monotonic() - start)
+        return response
+
+    # --- Shared helpers ---
+    def _admit(self, give_up: float) -> bool:
+        """Raises if the call may not go ahead. Returns whether it holds the breaker's half-open probe."""
+        if self._remaining(give_up) <= 0:
+            self._count("deadline_exceeded")
+            raise LLMUnavailable("deadline", "LLM call ran out of time.")
+        admitted = self.breaker.admit()
+        if admitted is None:
+            raise LLMUnavailable("circuit_open", "LLM provider is failing; the circuit breaker is open.")
+        return admitted == "probe"
+
+    def _should_retry(self, error: Exception, attempt: int, retries: int) -> bool:
+        if isinstance(error, LLMUnavailable) or not is_retryable(error) or attempt == retries:
+            self._count("failures")
+            return False
+        self._count("retries")
+        return True
+
+    def _backoff(self, error: Exception, attempt: int, give_up: float) -> float:
+        """Full-jitter exponential backoff, at least Retry-After; raises if it would pass the deadline."""
+        delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+        delay = max(delay, retry_after(error) or 0.0)
+        if delay >= self._remaining(give_up):
+            self._count("deadline_exceeded")
+            raise error
+        return delay
+
+    def _hedge_delay(self, key: tuple):
+        """Seconds to wait before hedging, or None while there is too little latency history."""
+        threshold = self.latencies.quantile(key, self.hedge_quantile)
+        return None if threshold is None else max(threshold, LLM_HEDGE_MIN_DELAY_SECONDS)
+
+    @staticmethod
+    def _remaining(give_up: float) -> float:
+        return give_up - time.monotonic()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["breaker"] = self.breaker.stats()
+        return stats
+
+
+def _discard(future):
+    """Closes the stream of a request that lost a hedge race."""
+    if not future.cancelled() and future.exception() is None:
+        close = getattr(future.result(), "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+async def _adiscard(response):
+    close = getattr(response, "close", None)
+    if close is not None:
+        try:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            pass
+
+
+# Shared by every caller in the process, so the breaker and rate limit see all traffic
+gateway = LLMGateway()
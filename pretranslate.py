@@ -0,0 +1,140 @@
+import os
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from translation_utils import translate_markdown, create_translator, translation_cache, LANG_CODE_MAP
+
+# --- Pre-translation Settings ---
+# An answer is queued once it has been served this many times.
+PRETRANSLATE_MIN_HITS = int(os.getenv("PRETRANSLATE_MIN_HITS", "2"))
+PRETRANSLATE_QUEUE_SIZE = int(os.getenv("PRETRANSLATE_QUEUE_SIZE", "100"))
+
+
+def answer_key(answer: str) -> str:
+    return hashlib.sha256(answer.encode("utf-8")).hexdigest()
+
+
+class Pretranslator:
+    """
+    Background worker that translates popular English answers into every
+    language in LANG_CODE_MAP ahead of time.
+    Answers are counted with record(); once an answer reaches `min_hits` it is
+    queued, and the worker always picks the most popular queued answer next.
+    The queue and the popularity counts are bounded, with the least popular
+    entries dropped first. Finished translations are stored with the answer's
+    hash in the persistent TranslationCache, so they survive restarts and are
+    shared by the app and API processes.
+    """
+
+    def __init__(self, translator=None, languages=None, min_hits=PRETRANSLATE_MIN_HITS,
+                 queue_size=PRETRANSLATE_QUEUE_SIZE, cache=None):
+        self.translator = translator
+        self.languages = list(languages or LANG_CODE_MAP)
+        self.min_hits = min_hits
+        self.queue_size = queue_size
+        self.cache = cache or translation_cache
+
+        self._popularity = OrderedDict()
+        self._queue = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Public API ---
+    def record(self, answer: str):
+        """Counts one more view of this answer and queues it when it becomes popular."""
+        if not answer:
+            return
+        key = answer_key(answer)
+        with self._lock:
+            hits = self._popularity.pop(key, 0) + 1
+            self._popularity[key] = hits
+            while len(self._popularity) > self.queue_size * 10:
+                self._popularity.popitem(last=False)
+            if hits < self.min_hits or key in self._queue:
+                return
+        if self._is_complete(key):
+            return
+        with self._lock:
+            self._queue[key] = answer
+            if len(self._queue) > self.queue_size:
+                least_popular = min(self._queue, key=lambda k: self._popularity.get(k, 0))
+                del self._queue[least_popular]
+        self._wakeup.set()
+
+    def get(self, answer: str, target_language: str):
+        """Returns the stored translation, or None if it hasn't been made yet."""
+        return self.cache.get_answer(answer_key(answer), target_language)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pretranslator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {"queued": len(self._queue), "tracked_answers": len(self._popularity)}
+        return dict(stats, stored_answers=self.cache.count_answers())
+
+    # --- Worker ---
+    def _is_complete(self, key: str) -> bool:
+        return set(self.languages) <= self.cache.answer_languages(key)
+
+    def _next_job(self):
+        with self._lock:
+            if not self._queue:
+                return None, None
+            key = max(self._queue, key=lambda k: self._popularity.get(k, 0))
+            return key, self._queue.pop(key)
+
+    def _run(self):
+        # The worker owns its event loop and translator, separate from Streamlit's
+        loop = asyncio.new_event_loop()
+        translator = self.translator or create_translator()
+        try:
+            while not self._stop.is_set():
+                key, answer = self._next_job()
+                if key is None:
+                    self._wakeup.wait(timeout=5)
+                    self._wakeup.clear()
+                    continue
+                done = self.cache.answer_languages(key)
+                for language in self.languages:
+                    if self._stop.is_set():
+                        break
+                    if language in done:
+                        continue
+                    try:
+                        translated, complete = loop.run_until_complete(
+                            translate_markdown(answer, LANG_CODE_MAP[language], translator=translator)
+                        )
+                    except Exception as e:
+                        print(f"Pre-translation error ({language}): {e}")
+                        continue
+                    # Partial translations are not worth serving later; try again next time
+                    if complete:
+                        self.cache.put_answer(key, language, translated)
+        finally:
+            loop.close()
+
+
+_pretranslator = None
+_pretranslator_lock = threading.Lock()
+
+
+def get_pretranslator() -> Pretranslator:
+    """Returns the process-wide pre-translator, starting its worker on first use."""
+    global _pretranslator
+    with _pretranslator_lock:
+        if _pretranslator is None:
+            _pretranslator = Pretranslator()
+            _pretranslator.start()
+    return _pretranslator
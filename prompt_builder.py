@@ -0,0 +1,99 @@
+import os
+import threading
+from chunking import count_tokens, truncate_to_tokens
+from telemetry import annotate
+
+# --- Prompt Settings ---
+# Input tokens allowed per request (instructions + persona + context + question).
+# The context is trimmed to whatever the other sections leave.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+QUESTION_TOKEN_LIMIT = int(os.getenv("QUESTION_TOKEN_LIMIT", "300"))
+# Chat formatting adds a few tokens per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+PERSONAS = ("Student", "Early-Career")
+
+# The instructions never change, so every request starts with the same bytes
+# and the provider can reuse its cached prefix. Anything that varies (persona,
+# context, question) must come after them.
+INSTRUCTIONS = """You are 'Arthavivek', a friendly and wise financial coach for India's youth.
+Your goal is to provide simple, safe, and encouraging financial education, NOT specific investment advice.
+RULES:
+1.  Use the provided 'CONTEXT' to form your primary answer.
+2.  Format your answer using markdown. Use headings, bold text, and bullet points to make it easy to read.
+3.  **If the user's question is not related to finance, economics, investing, or careers, you MUST politely decline to answer. Gently guide them back to financial topics. Do not answer non-financial questions.**
+4.  Do NOT recommend any specific stocks, mutual funds, or products.
+5.  Speak in simple and clear English.
+6.  Keep the tone encouraging, like a knowledgeable friend.
+7.  Do not include a disclaimer in your response, as it is already handled by the user interface.
+8.  Tailor your answer to the user described in the next message."""
+
+PERSONA_TEMPLATE = "Your user is a '{persona}'."
+USER_TEMPLATE = "CONTEXT:\n{context}\n\nMY QUESTION:\n{question}"
+
+
+class PromptBuilder:
+    """
+    Builds the generation messages in cache-friendly order:
+      1. system: the static instructions (identical for every request)
+      2. system: the persona line
+      3. user:   the retrieved context and the question
+    The first two messages are compiled once per persona. Each section is
+    counted in tokens; the question is capped at `question_tokens` and the
+    context is trimmed so the whole prompt fits in `budget_tokens`.
+    Token counts of the fixed sections are taken on first use, since loading
+    the tokenizer may need a download.
+    """
+
+    def __init__(self, personas=PERSONAS, budget_tokens: int = PROMPT_TOKEN_BUDGET,
+                 question_tokens: int = QUESTION_TOKEN_LIMIT):
+        self.budget_tokens = budget_tokens
+        self.question_tokens = question_tokens
+        self._instructions = {"role": "system", "content": INSTRUCTIONS}
+        self._compiled = {}
+        self._section_tokens = {}
+        self._lock = threading.Lock()
+        for persona in personas:
+            self._compile(persona)
+
+    def _compile(self, persona: str) -> dict:
+        """The persona message, cached per persona."""
+        compiled = self._compiled.get(persona)
+        if compiled is None:
+            compiled = {"role": "system", "content": PERSONA_TEMPLATE.format(persona=persona)}
+            with self._lock:
+                self._compiled[persona] = compiled
+        return compiled
+
+    def _fixed_tokens(self, text: str) -> int:
+        """Token count of a fixed section (including message overhead), counted once."""
+        tokens = self._section_tokens.get(text)
+        if tokens is None:
+            tokens = self._section_tokens[text] = count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+        return tokens
+
+    def build(self, query: str, persona: str, context: str) -> list:
+        persona_message = self._compile(persona)
+        instruction_tokens = self._fixed_tokens(INSTRUCTIONS)
+        persona_tokens = self._fixed_tokens(persona_message["content"])
+        template_tokens = self._fixed_tokens(USER_TEMPLATE.format(context="", question=""))
+        question = truncate_to_tokens(query, self.question_tokens)
+        question_tokens = count_tokens(question)
+
+        fixed_tokens = instruction_tokens + persona_tokens + template_tokens + question_tokens
+        context_budget = max(self.budget_tokens - fixed_tokens, 0)
+        context_tokens = count_tokens(context)
+        trimmed_tokens = 0
+        if context_tokens > context_budget:
+            context = truncate_to_tokens(context, context_budget)
+            trimmed_tokens = context_tokens - count_tokens(context)
+            context_tokens -= trimmed_tokens
+
+        annotate(instruction_tokens=instruction_tokens, persona_tokens=persona_tokens,
+                 prompt_context_tokens=context_tokens, question_tokens=question_tokens,
+                 trimmed_tokens=trimmed_tokens, estimated_prompt_tokens=fixed_tokens + context_tokens)
+        return [
+            dict(self._instructions),
+            dict(persona_message),
+            {"role": "user", "content": USER_TEMPLATE.format(context=context, question=question)},
+        ]
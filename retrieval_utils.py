@@ -0,0 +1,429 @@
+import math
+import re
+import time
+import threading
+from collections import Counter
+import numpy as np
+from embedding_utils import STOPWORDS
+
+# --- Retrieval Settings ---
+# Below this many documents we score every vector; above it we switch to IVF.
+ANN_THRESHOLD = 2000
+IVF_PROBES = 8
+RRF_K = 60
+# Each query word that matches one of a document's tags raises its score by this fraction
+TAG_BOOST = 0.2
+# How often an incremental refresh also checks for deleted documents
+RECONCILE_SECONDS = 900
+
+
+def tokenize(text: str) -> list:
+    return re.findall(r"\w+", text.lower())
+
+
+class VectorIndex:
+    """
+    In-memory nearest-neighbour index over L2-normalised vectors.
+    Small corpora are searched with a brute-force matrix product. Once the
+    index grows past `ann_threshold` rows, an IVF (inverted file) layout is
+    built with a few rounds of k-means and only the `n_probe` closest lists
+    are scored.
+    """
+
+    def __init__(self, ann_threshold: int = ANN_THRESHOLD, n_probe: int = IVF_PROBES):
+        self.ann_threshold = ann_threshold
+        self.n_probe = n_probe
+        self.ids = []
+        self.matrix = None
+        self._row_of = {}
+        self._centroids = None
+        self._lists = None
+        self._ivf_size = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, ids: list, vectors: np.ndarray):
+        """Adds new rows or overwrites existing ones in place."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.matrix is not None and not self.matrix.flags.writeable:
+            # Detach from a snapshot's read-only memory map before changing rows
+            self.matrix = np.array(self.matrix, dtype=np.float32)
+        new_rows = []
+        for doc_id, vector in zip(ids, vectors):
+            row = self._row_of.get(doc_id)
+            if row is None:
+                self._row_of[doc_id] = len(self.ids)
+                self.ids.append(doc_id)
+                new_rows.append(vector)
+            else:
+                self.matrix[row] = vector
+        if new_rows:
+            stacked = np.stack(new_rows)
+            self.matrix = stacked if self.matrix is None else np.vstack([self.matrix, stacked])
+
+        # Rebuild the IVF layout when the index has grown enough to matter
+        if len(self.ids) >= self.ann_threshold and len(self.ids) >= 2 * self._ivf_size:
+            self._build_ivf()
+        elif self._lists is not None and new_rows:
+            self._assign_to_lists(range(len(self.ids) - len(new_rows), len(self.ids)))
+
+    def remove(self, ids):
+        """Drops rows; the remaining ones are packed into a new matrix (and IVF layout)."""
+        gone = set(ids) & self._row_of.keys()
+        if not gone:
+            return
+        keep = [row for row, doc_id in enumerate(self.ids) if doc_id not in gone]
+        self.attach([self.ids[row] for row in keep], np.array(self.matrix[keep], dtype=np.float32))
+
+    def attach(self, ids: list, matrix):
+        """
+        Serves `matrix` (rows already L2-normalised) as it is, without copying,
+        so a read-only memory map stays shared with other processes.
+        """
+        self.ids = list(ids)
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        self.matrix = matrix if self.ids else None
+        self._centroids, self._lists, self._ivf_size = None, None, 0
+        if len(self.ids) >= self.ann_threshold:
+            self._build_ivf()
+
+    def search(self, query_vector: np.ndarray, k: int = 10, row_mask: np.ndarray = None) -> list:
+        """Returns [(id, cosine score), ...] for the k best rows, best first."""
+        if self.matrix is None:
+            return []
+
+        if self._lists is None:
+            rows = np.arange(len(self.ids))
+        else:
+            nearest_lists = np.argsort(-(self._centroids @ query_vector))[:self.n_probe]
+            rows = np.concatenate([self._lists[i] for i in nearest_lists])
+        if row_mask is not None:
+            rows = rows[row_mask[rows]]
+        if rows.size == 0:
+            return []
+
+        scores = self.matrix[rows] @ query_vector
+        top = np.argsort(-scores)[:k]
+        return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+    def search_many(self, query_matrix: np.ndarray, k: int = 10, row_masks: list = None) -> list:
+        """
+        search() for a batch of queries, one result list per row of
+        `query_matrix`. Without IVF the whole batch is scored with a single
+        matrix product. `row_masks` holds one mask (or None) per query.
+        """
+        row_masks = row_masks or [None] * len(query_matrix)
+        if self.matrix is None:
+            return [[] for _ in row_masks]
+        if self._lists is not None:
+            return [self.search(vector, k=k, row_mask=mask) for vector, mask in zip(query_matrix, row_masks)]
+
+        scores = np.asarray(query_matrix, dtype=np.float32) @ self.matrix.T
+        results = []
+        for row_scores, mask in zip(scores, row_masks):
+            if mask is not None:
+                row_scores = np.where(mask, row_scores, -np.inf)
+            top = np.argpartition(-row_scores, k - 1)[:k] if k < len(row_scores) else np.arange(len(row_scores))
+            top = top[np.argsort(-row_scores[top])]
+            results.append([(self.ids[i], float(row_scores[i])) for i in top if row_scores[i] > -np.inf])
+        return results
+
+    def _build_ivf(self, iterations: int = 10):
+        n_lists = max(int(math.sqrt(len(self.ids))), 1)
+        rng = np.random.default_rng(0)
+        centroids = np.array(self.matrix[rng.choice(len(self.ids), n_lists, replace=False)], dtype=np.float32)
+        for _ in range(iterations):
+            assignment = np.argmax(self.matrix @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = self.matrix[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids
+        self._lists = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+        self._ivf_size = len(self.ids)
+
+    def _assign_to_lists(self, rows):
+        rows = np.fromiter(rows, dtype=np.int64)
+        assignment = np.argmax(self.matrix[rows] @ self._centroids.T, axis=1)
+        for c in np.unique(assignment):
+            self._lists[c] = np.concatenate([self._lists[c], rows[assignment == c]])
+
+
+class BM25Index:
+    """Okapi BM25 over a small in-memory corpus."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_terms = []
+        self.doc_lengths = []
+        self.doc_freq = Counter()
+        self.avg_len = 0.0
+
+    def build(self, texts: list):
+        self.doc_terms = [Counter(tokenize(text)) for text in texts]
+        self.doc_freq = Counter()
+        for terms in self.doc_terms:
+            self.doc_freq.update(terms.keys())
+        self.doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_len = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def scores(self, query: str, mask: np.ndarray = None) -> np.ndarray:
+        """BM25 score of every document; with a boolean `mask`, only the selected ones are scored (others stay 0)."""
+        n_docs = len(self.doc_terms)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        rows = range(n_docs) if mask is None else np.flatnonzero(mask[:n_docs])
+        for term in set(tokenize(query)):
+            df = self.doc_freq.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for i in rows:
+                tf = self.doc_terms[i].get(term)
+                if tf:
+                    norm = 1 - self.b + self.b * self.doc_lengths[i] / self.avg_len
+                    scores[i] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = RRF_K) -> dict:
+    """Fuses several ranked id lists into one {id: score} map."""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return fused
+
+
+class KnowledgeIndex:
+    """
+    Process-local retrieval index over the knowledge_base collection.
+    Loads every document once, then refreshes incrementally using the
+    'updated_at' watermark written by ingestion; documents written in the
+    same instant as the watermark are picked up too. Every
+    `reconcile_seconds` a refresh also lists the collection's ids and drops
+    documents that were deleted. Supports pure vector search
+    and hybrid BM25 + vector search fused with reciprocal rank fusion.
+    Searches can be restricted to one persona's documents (those listing it
+    in 'personas', plus those with no personas), using candidate masks that
+    are precomputed for every persona on refresh, and results whose tags
+    share words with the query are boosted.
+    `embed_fn` maps a list of strings to an (n, dim) matrix of normalised
+    vectors, so the index can run offline with any embedder.
+    """
+
+    FIELDS = {"topic": 1, "content": 1, "tags": 1, "personas": 1, "related_videos": 1,
+              "related_blogs": 1, "embedding": 1, "updated_at": 1}
+
+    def __init__(self, embed_fn, ann_threshold: int = ANN_THRESHOLD, reconcile_seconds: float = RECONCILE_SECONDS):
+        self.embed_fn = embed_fn
+        self.reconcile_seconds = reconcile_seconds
+        self.docs = {}
+        self.order = []
+        self.vectors = VectorIndex(ann_threshold=ann_threshold)
+        self.bm25 = BM25Index()
+        self.watermark = None
+        # Ids of the loaded documents whose 'updated_at' equals the watermark
+        self._at_watermark = set()
+        self._reconciled_at = 0.0
+        self._tag_terms = {}
+        self._persona_masks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def reconcile_due(self) -> bool:
+        """True if the index was loaded from the collection and hasn't looked for deletions lately."""
+        return self.watermark is not None and time.time() - self._reconciled_at >= self.reconcile_seconds
+
+    def refresh(self, collection) -> int:
+        """Pulls new and changed documents, and drops deleted ones when due. Returns how many were (re)loaded or dropped."""
+        if self.watermark is None:
+            # Full load: anything not returned has been deleted
+            changed = list(collection.find({}, self.FIELDS))
+            present = {doc["_id"] for doc in changed}
+        else:
+            query = {"updated_at": {"$gte": self.watermark}, "_id": {"$nin": list(self._at_watermark)}}
+            changed = list(collection.find(query, self.FIELDS))
+            present = None
+            if self.reconcile_due():
+                present = {doc["_id"] for doc in collection.find({}, {"_id": 1})}
+        removed = []
+        if present is not None:
+            self._reconciled_at = time.time()
+            removed = [doc_id for doc_id in self.docs if doc_id not in present]
+        if not changed and not removed:
+            return 0
+
+        with self._lock:
+            if removed:
+                gone = set(removed)
+                for doc_id in removed:
+                    del self.docs[doc_id]
+                    self._tag_terms.pop(doc_id, None)
+                self.order = [doc_id for doc_id in self.order if doc_id not in gone]
+                self._at_watermark -= gone
+                self.vectors.remove(removed)
+            embedded_ids, embedded_vectors = [], []
+            for doc in changed:
+                doc_id = doc["_id"]
+                if doc_id not in self.docs:
+                    self.order.append(doc_id)
+                embedding = doc.pop("embedding", None)
+                self.docs[doc_id] = doc
+                if embedding:
+                    embedded_ids.append(doc_id)
+                    embedded_vectors.append(embedding)
+                self._tag_terms[doc_id] = set(tokenize(" ".join(doc.get("tags") or []))) - STOPWORDS
+                updated_at = doc.get("updated_at")
+                if updated_at is None:
+                    continue
+                if self.watermark is None or updated_at > self.watermark:
+                    self.watermark, self._at_watermark = updated_at, {doc_id}
+                elif updated_at == self.watermark:
+                    self._at_watermark.add(doc_id)
+
+            if embedded_ids:
+                vectors = np.asarray(embedded_vectors, dtype=np.float32)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+                self.vectors.upsert(embedded_ids, vectors)
+            self.bm25.build([self._bm25_text(self.docs[doc_id]) for doc_id in self.order])
+            self._rebuild_masks()
+        return len(changed) + len(removed)
+
+    def load_snapshot(self, docs: list, vector_ids: list, matrix) -> int:
+        """
+        Replaces the whole index with the rows of a local snapshot (see
+        snapshot.py). The embedding matrix is used as is, typically a
+        read-only float16 memory map. Returns the number of documents.
+        """
+        vectors = VectorIndex(ann_threshold=self.vectors.ann_threshold, n_probe=self.vectors.n_probe)
+        vectors.attach(vector_ids, matrix)
+        bm25 = BM25Index(k1=self.bm25.k1, b=self.bm25.b)
+        bm25.build([self._bm25_text(doc) for doc in docs])
+        tag_terms = {doc["_id"]: set(tokenize(" ".join(doc.get("tags") or []))) - STOPWORDS for doc in docs}
+
+        with self._lock:
+            self.docs = {doc["_id"]: doc for doc in docs}
+            self.order = [doc["_id"] for doc in docs]
+            self.vectors, self.bm25, self._tag_terms = vectors, bm25, tag_terms
+            # Snapshots are replaced whole, never refreshed incrementally
+            self.watermark, self._at_watermark = None, set()
+            self._rebuild_masks()
+        return len(docs)
+
+    def _visible(self, doc: dict) -> bool:
+        """Whether a document may be returned at all, whatever the persona."""
+        return True
+
+    def _rebuild_masks(self):
+        """Rebuilds the candidate masks of every persona (call with the lock held)."""
+        personas = {p for doc in self.docs.values() for p in doc.get("personas") or []}
+        self._persona_masks = {persona: self._build_masks(persona) for persona in personas}
+        # Without a persona every document is a candidate, unless some are hidden
+        hidden = any(not self._visible(doc) for doc in self.docs.values())
+        self._persona_masks[None] = self._build_masks(None) if hidden else (None, None)
+
+    def _build_masks(self, persona: str) -> tuple:
+        """(mask over documents in `order`, mask over vector rows) of the documents a persona may see."""
+        allowed = {doc_id for doc_id, doc in self.docs.items()
+                   if self._visible(doc) and (persona is None or not doc.get("personas") or persona in doc["personas"])}
+        doc_mask = np.fromiter((doc_id in allowed for doc_id in self.order), dtype=bool, count=len(self.order))
+        row_mask = np.fromiter((doc_id in allowed for doc_id in self.vectors.ids), dtype=bool, count=len(self.vectors.ids))
+        return doc_mask, row_mask
+
+    def _masks(self, persona: str) -> tuple:
+        masks = self._persona_masks.get(persona)
+        if masks is None:
+            # A persona no document lists still sees the documents meant for everyone
+            masks = self._persona_masks[persona] = self._build_masks(persona)
+        return masks
+
+    def _boost_tags(self, query: str, scored: list) -> list:
+        """Re-ranks (id, score) pairs, raising documents whose tags share words with the query."""
+        query_terms = set(tokenize(query)) - STOPWORDS
+        if not query_terms:
+            return scored
+        boosted = [(doc_id, score * (1 + TAG_BOOST * len(query_terms & self._tag_terms.get(doc_id, set()))))
+                   for doc_id, score in scored]
+        return sorted(boosted, key=lambda item: item[1], reverse=True)
+
+    def search(self, query: str, k: int = 3, mode: str = "hybrid", candidates: int = 20, query_vector=None,
+               persona: str = None) -> list:
+        """
+        Returns up to k documents, best first, each with a 'score' field.
+        mode is 'vector', 'hybrid' or 'bm25' (keywords only, no embedding).
+        Pass `query_vector` if the query has already been embedded (e.g.
+        asynchronously), and `persona` (a stored persona value such as
+        'student') to search only that persona's documents. Raises if the
+        query cannot be embedded, so callers can fall back to $text search.
+        """
+        query_vectors = None if query_vector is None else [query_vector]
+        return self.search_many([query], k=k, mode=mode, candidates=candidates, query_vectors=query_vectors,
+                                personas=[persona])[0]
+
+    def search_many(self, queries: list, k: int = 3, mode: str = "hybrid", candidates: int = 20, query_vectors=None,
+                    personas: list = None) -> list:
+        """
+        search() for a batch of queries, one result list per query. The
+        queries are embedded in one call and scored against the vectors in
+        one pass; `personas` holds one stored persona value (or None) per query.
+        """
+        if not self.docs:
+            return [[] for _ in queries]
+        personas = personas or [None] * len(queries)
+        # Embed outside the lock; it is usually a network call
+        if mode == "bm25":
+            query_vectors = None
+        elif query_vectors is None and len(self.vectors):
+            query_vectors = self.embed_fn(list(queries))
+
+        with self._lock:
+            masks = [self._masks(persona) for persona in personas]
+            if query_vectors is not None:
+                vector_hits = self.vectors.search_many(np.asarray(query_vectors), k=candidates,
+                                                       row_masks=[row_mask for _, row_mask in masks])
+            else:
+                vector_hits = [[] for _ in queries]
+            return [self._rank(query, hits, mode, doc_mask, k, candidates)
+                    for query, hits, (doc_mask, _) in zip(queries, vector_hits, masks)]
+
+    def _rank(self, query: str, vector_hits: list, mode: str, doc_mask, k: int, candidates: int) -> list:
+        """Fuses one query's vector hits with its BM25 ranking (call with the lock held)."""
+        if mode == "vector":
+            scored = vector_hits
+        else:
+            bm25_scores = self.bm25.scores(query, mask=doc_mask)
+            bm25_ranking = [self.order[i] for i in np.argsort(-bm25_scores)[:candidates] if bm25_scores[i] > 0]
+            fused = reciprocal_rank_fusion([[doc_id for doc_id, _ in vector_hits], bm25_ranking])
+            scored = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+        scored = self._boost_tags(query, scored)
+        return [dict(self.docs[doc_id], score=score) for doc_id, score in scored[:k]]
+
+    @staticmethod
+    def _bm25_text(doc: dict) -> str:
+        return f"{doc.get('topic', '')} {' '.join(doc.get('tags', []))} {doc.get('content', '')}"
+
+
+class PassageIndex(KnowledgeIndex):
+    """
+    The same index over the knowledge_chunks collection: one row per passage
+    instead of per article. Chunks left over after a document was re-chunked
+    into fewer passages are marked 'retired'; they are left out of every
+    candidate mask, so neither the vector nor the BM25 search returns them.
+    """
+
+    FIELDS = {"doc_id": 1, "chunk_index": 1, "text": 1, "start": 1, "end": 1, "topic": 1, "tags": 1, "personas": 1,
+              "related_videos": 1, "related_blogs": 1, "retired": 1, "embedding": 1, "updated_at": 1}
+
+    def _visible(self, doc: dict) -> bool:
+        return not doc.get("retired")
+
+    @staticmethod
+    def _bm25_text(doc: dict) -> str:
+        if doc.get("retired"):
+            return ""
+        return f"{doc.get('topic', '')} {' '.join(doc.get('tags', []))} {doc.get('text', '')}"
@@ -0,0 +1,135 @@
+import os
+import re
+import threading
+import numpy as np
+from embedding_utils import hashed_embedding, normalize_query, STOPWORDS
+
+# --- Routing Settings ---
+# Set ROUTER_ENABLED=false to send every question to the main model.
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Model used for short "what is X?" questions
+ROUTER_SIMPLE_MODEL = os.getenv("ROUTER_SIMPLE_MODEL", "gpt-4o-mini")
+# A question naming a non-finance subject is still on-topic if it is this close to a knowledge base topic
+ROUTER_TOPIC_SIMILARITY = float(os.getenv("ROUTER_TOPIC_SIMILARITY", "0.2"))
+# Definitional questions name a short term ("what is a credit score?")
+DEFINITION_MAX_TERM_WORDS = 4
+
+OFF_TOPIC = "off_topic"
+DEFINITIONAL = "definitional"
+COMPLEX = "complex"
+ROUTES = (OFF_TOPIC, DEFINITIONAL, COMPLEX)
+
+OFF_TOPIC_REFUSAL = (
+    "I'm Arthavivek, your financial coach, so I can only help with questions about money, "
+    "saving, investing, banking, taxes and careers. Try asking something like "
+    "*\"How do I start an emergency fund?\"* or *\"What is a SIP?\"*"
+)
+
+# Words that mark a question as financial. Knowledge base topics and tags are added at runtime.
+FINANCE_TERMS = {
+    "money", "finance", "financial", "budget", "budgeting", "save", "saving", "savings", "spend", "spending",
+    "expense", "expenses", "income", "salary", "stipend", "pocket", "invest", "investing", "investment",
+    "investments", "investor", "return", "returns", "interest", "compound", "inflation", "economy", "economics",
+    "gdp", "rbi", "repo", "sebi", "bank", "banking", "account", "deposit", "fd", "rd", "loan", "loans", "emi",
+    "debt", "credit", "cibil", "score", "card", "upi", "payment", "payments", "wallet", "tax", "taxes", "itr",
+    "gst", "tds", "80c", "elss", "ppf", "epf", "nps", "pension", "retirement", "insurance", "premium", "policy",
+    "term", "health", "mutual", "fund", "funds", "sip", "stock", "stocks", "share", "shares", "equity", "market",
+    "sensex", "nifty", "ipo", "dividend", "bond", "bonds", "gold", "crypto", "bitcoin", "portfolio", "asset",
+    "assets", "risk", "diversification", "nav", "index", "etf", "demat", "broker", "trading", "rent", "house",
+    "home", "property", "car", "fees", "education", "scholarship", "career", "job", "jobs", "internship",
+    "freelance", "startup", "business", "rate", "rates", "worth", "value", "valuation", "revenue", "profit",
+    "profits", "derivative", "derivatives", "futures", "options", "hedge", "hedging", "rupee", "rupees", "inr", "lakh", "crore", "price", "cost", "afford",
+    "scam", "fraud", "emergency", "goal", "goals", "wealth", "rich", "paisa", "paise", "bachat", "nivesh",
+    "kharcha", "kamai", "karz",
+}
+
+# Words that mark a question as being about something else. A question is only
+# refused when it has one of these and nothing financial; anything uncertain
+# goes to the LLM, whose instructions already decline off-topic questions.
+NON_FINANCE_TERMS = {
+    "cricket", "football", "soccer", "tennis", "hockey", "ipl", "wicket", "olympics", "movie", "movies", "film",
+    "films", "actor", "actress", "song", "songs", "singer", "lyrics", "album", "netflix", "anime", "celebrity",
+    "bollywood", "hollywood", "recipe", "recipes", "cook", "cooking", "bake", "weather", "poem", "poetry", "joke",
+    "jokes", "riddle", "minecraft", "pubg", "homework", "physics", "chemistry", "biology", "planet", "planets",
+    "dinosaur", "dinosaurs", "girlfriend", "boyfriend", "dating", "horoscope", "astrology", "zodiac", "hairstyle",
+    "makeup", "workout", "calories", "javascript",
+}
+
+DEFINITION_PATTERN = re.compile(
+    r"^(what\s+(is|are|s|does)|whats|define|definition\s+of|meaning\s+of|full\s+form\s+of|"
+    r"explain|tell\s+me\s+about)\s+(?P<term>.+)$"
+    r"|^(?P<hinglish_term>.+?)\s+kya\s+(hai|hota\s+hai|hoti\s+hai)$"
+)
+# Words that turn "what is ..." into a comparison, a decision or a plan
+COMPLEX_MARKERS = {
+    "difference", "between", "vs", "versus", "compare", "better", "best", "worse", "should", "which", "when",
+    "why", "how", "if", "plan", "strategy", "instead", "or", "and", "my", "me", "i", "much", "many", "worth",
+}
+ARTICLES = {"a", "an", "the", "mean", "meant", "means", "by", "in", "india", "finance", "kya", "hai"}
+
+
+class QueryRouter:
+    """
+    A local, network-free classifier that sends each question down one route:
+      off_topic    -- names a non-finance subject, with no finance keyword
+                      and no knowledge base topic nearby
+      definitional -- "what is X?" where every word of X is a finance keyword
+      complex      -- everything else
+    Keywords come from FINANCE_TERMS plus the knowledge base topics and tags;
+    topic similarity uses the hashed query embedding. Questions that are
+    neither clearly financial nor clearly about something else ("what is
+    NEFT?", "what is the capital of France?"), or that mix a finance keyword
+    with another subject ("what are weather derivatives?"), go to the main
+    model, whose instructions decide whether to answer.
+    """
+
+    def __init__(self, terms=FINANCE_TERMS, similarity_threshold: float = ROUTER_TOPIC_SIMILARITY):
+        self.base_terms = frozenset(terms)
+        self.terms = set(terms)
+        self.similarity_threshold = similarity_threshold
+        self._topic_vectors = np.zeros((0, 512), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def learn_topics(self, docs):
+        """Rebuilds the on-topic vocabulary and topic vectors from the knowledge base documents."""
+        terms, vectors = set(), []
+        for doc in docs:
+            text = f"{doc.get('topic', '')} {' '.join(doc.get('tags') or [])}"
+            terms.update(w for w in normalize_query(text).split() if w not in STOPWORDS and len(w) > 2)
+            vector = hashed_embedding(text)
+            if vector.any():
+                vectors.append(vector)
+        with self._lock:
+            self.terms = set(self.base_terms | terms)
+            self._topic_vectors = np.asarray(vectors, dtype=np.float32) if vectors else np.zeros((0, 512), dtype=np.float32)
+
+    def is_on_topic(self, query: str) -> bool:
+        """False only for questions that are clearly about something else."""
+        words = [w for w in normalize_query(query).split() if w not in STOPWORDS]
+        if any(w in self.terms for w in words):
+            return True
+        if not any(w in NON_FINANCE_TERMS for w in words):
+            return True
+        topic_vectors = self._topic_vectors
+        if not len(topic_vectors):
+            return False
+        return float(np.max(topic_vectors @ hashed_embedding(query))) >= self.similarity_threshold
+
+    def classify(self, query: str) -> str:
+        if not self.is_on_topic(query):
+            return OFF_TOPIC
+        # Only terms made entirely of known finance words go to the smaller model
+        term = [w for w in definition_term(query) if w not in STOPWORDS]
+        terms = self.terms
+        return DEFINITIONAL if term and all(w in terms for w in term) else COMPLEX
+
+
+def definition_term(query: str) -> list:
+    """The words of the term a "what is X?" question asks about, or [] for any other question."""
+    match = DEFINITION_PATTERN.match(normalize_query(query))
+    if not match:
+        return []
+    term = [w for w in (match.group("term") or match.group("hinglish_term")).split() if w not in ARTICLES]
+    if not term or len(term) > DEFINITION_MAX_TERM_WORDS or COMPLEX_MARKERS.intersection(term):
+        return []
+    return term
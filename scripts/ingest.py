@@ -1,43 +1,92 @@
 import os
-import requests
+import re
+import argparse
+import hashlib
+import threading
 import json
-from bs4 import BeautifulSoup
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 from dotenv import load_dotenv
-from openai import OpenAI
-from db_utils import get_db_connection
+from pymongo import UpdateOne, UpdateMany
+from pymongo.errors import BulkWriteError
+from clients import get_openai_client, get_database
+from db_utils import close_db_connection, bump_kb_version
+from embedding_utils import embed_texts, document_embedding_text
+from fetcher import Fetcher, get_fetcher, set_fetcher
+from batch_llm import run_batch, clear_batch_state, BATCH_POLL_SECONDS
+from chunking import chunk_document, chunk_embedding_text, CHUNK_FIELDS
+from llm_gateway import LLMGateway
+from snapshot import export_snapshot, SNAPSHOT_DIR
 
 # --- INITIALIZATION ---
+# The OpenAI and MongoDB clients are created on first use (see clients.py),
+# so importing this module needs no credentials and does no network I/O.
 load_dotenv()
-openai_api_key = os.getenv("LLM_API_KEY")
-if not openai_api_key:
-    raise ValueError("LLM_API_KEY not found. Please check your .env file.")
 
-client = OpenAI(api_key=openai_api_key)
-db_client, db, knowledge_base, _ = get_db_connection()
 
+def _db():
+    """The shared database; missing indexes are created on first use. None if MongoDB is unreachable."""
+    return get_database()[1]
 
-def scrape_article_text(url: str) -> str:
-    """Scrapes the main text content from a given URL."""
+# --- Concurrency Defaults (override with CLI flags) ---
+SCRAPE_WORKERS = 8
+PER_HOST_LIMIT = 2
+LLM_WORKERS = 4
+LLM_MAX_RETRIES = 5
+BULK_BATCH_SIZE = 100
+
+SUMMARY_MODEL = "gpt-4o"
+SUMMARY_TEMPERATURE = 0.5
+# Summaries are long and not latency-sensitive: a generous deadline, more retries and no hedging
+SUMMARY_DEADLINE_SECONDS = float(os.getenv("SUMMARY_DEADLINE_SECONDS", "300"))
+llm = LLMGateway(deadline_seconds=SUMMARY_DEADLINE_SECONDS, max_retries=LLM_MAX_RETRIES, hedge=False)
+BATCH_STATE_PATH = os.getenv("INGEST_BATCH_STATE_PATH", ".cache/ingest_batch_state.json")
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(url: str, limit: int) -> threading.BoundedSemaphore:
+    """Returns the semaphore that caps concurrent requests to one host."""
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+        return _host_semaphores[host]
+
+
+def content_hash(text: str) -> str:
+    """Hash of the scraped text, ignoring whitespace differences."""
+    return hashlib.sha256(re.sub(r"\s+", " ", text).strip().encode("utf-8")).hexdigest()
+
+
+def fetch_article(url: str, etag: str = None, last_modified: str = None) -> dict:
+    """
+    Downloads and extracts an article, as a conditional GET when validators
+    from the previous fetch are given (see fetcher.Fetcher.fetch).
+    Returns {"status": "ok" | "not_modified" | "failed", "text", "etag", "last_modified"}.
+    """
     print(f"  Scraping URL: {url}...")
     try:
-        response = requests.get(url, headers={'User-Agent': 'Mozilla/5.0'}, timeout=10)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        main_content = soup.find('article') or soup.find('main') or soup.body
-        paragraphs = main_content.find_all('p')
-        
-        text = ' '.join([p.get_text() for p in paragraphs])
-        print(f"  Successfully scraped {len(text)} characters.")
-        return text[:4000] # Limit text to a manageable size for the LLM
+        result = get_fetcher().fetch(url, etag, last_modified)
+        if result["status"] == "not_modified":
+            print("  Not modified since the last ingest.")
+        elif result["status"] == "ok":
+            print(f"  Successfully scraped {len(result['text'])} characters{' (cached)' if result['from_cache'] else ''}.")
+        return result
     except Exception as e:
         print(f"  Error scraping {url}: {e}")
-        return ""
+        return {"status": "failed", "text": "", "etag": None, "last_modified": None}
 
 
-def structure_content_with_ai(scraped_text: str, article_info: dict) -> dict:
-    """Uses an LLM to summarize and structure the scraped text."""
-    print("  Asking AI to summarize and structure...")
-    
+def scrape_article_text(url: str) -> str:
+    """Scrapes the main text content from a given URL."""
+    return fetch_article(url)["text"]
+
+
+def summary_messages(scraped_text: str) -> list:
+    """The chat messages that ask the LLM to summarise one article."""
     system_prompt = """
     You are an expert financial analyst. Your job is to read the provided article text and create a concise, easy-to-understand summary.
     This summary will be the 'content' field in a larger JSON object.
@@ -45,58 +94,343 @@ def structure_content_with_ai(scraped_text: str, article_info: dict) -> dict:
     """
     
     user_prompt = f"Please read the following article text and provide a detailed but simplified summary.\n\nArticle Text: \"{scraped_text}\""
-    
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def build_document(summary: str, article_info: dict) -> dict:
+    """Combines the AI-generated summary with the manually provided metadata."""
+    return {
+        "topic": article_info['topic'],
+        "content": summary,
+        "tags": article_info['tags'],
+        "personas": article_info['personas'],
+        "related_videos": article_info['related_videos'],
+        "related_blogs": article_info['related_blogs']
+    }
+
+
+def structure_content_with_ai(scraped_text: str, article_info: dict) -> dict:
+    """Uses an LLM to summarize and structure the scraped text."""
+    print("  Asking AI to summarize and structure...")
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.5
+        response = llm.chat(
+            get_openai_client(),
+            model=SUMMARY_MODEL,
+            messages=summary_messages(scraped_text),
+            temperature=SUMMARY_TEMPERATURE
         )
-        summary = response.choices[0].message.content
-        
-        # Combine AI-generated summary with manually provided metadata
-        final_document = {
-            "topic": article_info['topic'],
-            "content": summary,
-            "tags": article_info['tags'],
-            "personas": article_info['personas'],
-            "related_videos": article_info['related_videos'],
-            "related_blogs": article_info['related_blogs']
-        }
+        final_document = build_document(response.choices[0].message.content, article_info)
         print("  AI structuring successful.")
         return final_document
     except Exception as e:
         print(f"  Error structuring content with AI: {e}")
         return None
 
-def ingest_articles(articles_to_process: list):
-    """Main function to loop through articles, process them, and save to DB."""
-    if not db_client:
+def _scrape_limited(article: dict, per_host_limit: int, stored: dict = None) -> dict:
+    stored = stored or {}
+    with _host_semaphore(article['url'], per_host_limit):
+        return fetch_article(article['url'], stored.get('etag'), stored.get('last_modified'))
+
+
+def _add_embeddings(documents: list):
+    """Stores a semantic embedding on each document for vector retrieval."""
+    _add_embeddings_to(documents, document_embedding_text)
+
+
+def _add_embeddings_to(items: list, text_fn):
+    try:
+        vectors = embed_texts(get_openai_client(), [text_fn(item) for item in items])
+        for item, vector in zip(items, vectors):
+            item['embedding'] = vector.tolist()
+    except Exception as e:
+        print(f"  Error computing embeddings: {e}. Documents will be saved without them.")
+
+
+def _bulk_write(operations: list, batch_size: int = BULK_BATCH_SIZE, collection=None) -> tuple:
+    """
+    Runs the write operations in unordered batches (on knowledge_base by
+    default). A failed operation (e.g. a renamed topic clashing with the
+    unique topic index) is logged and skipped; the others are still written.
+    Returns (number of documents written, indexes of the failed operations).
+    """
+    collection = collection if collection is not None else _db().knowledge_base
+    written, failed = 0, []
+    for start in range(0, len(operations), batch_size):
+        try:
+            result = collection.bulk_write(operations[start:start + batch_size], ordered=False)
+            written += result.upserted_count + result.modified_count
+        except BulkWriteError as e:
+            written += e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+            for error in e.details.get("writeErrors", []):
+                failed.append(start + error["index"])
+                print(f"  Write failed on {collection.name} ({error.get('code')}): {error.get('errmsg')}")
+    return written, failed
+
+
+def _save_documents(documents: list, batch_size: int = BULK_BATCH_SIZE) -> int:
+    """Upserts the structured documents by topic in batches. Returns the number written."""
+    now = datetime.now(timezone.utc)
+    written, _ = _bulk_write([UpdateOne({'topic': doc['topic']}, {'$set': dict(doc, updated_at=now)}, upsert=True)
+                              for doc in documents], batch_size)
+    return written
+
+
+# --- Change Detection ---
+# Fields copied from the article list (not produced by the LLM)
+METADATA_FIELDS = ('topic', 'tags', 'personas', 'related_videos', 'related_blogs')
+STORED_PROJECTION = {field: 1 for field in METADATA_FIELDS + ('source_url', 'etag', 'last_modified', 'content_hash', 'content')}
+
+
+def _load_stored(articles: list) -> dict:
+    """
+    Looks up the stored document for every article in one query.
+    Documents are matched by source URL, so a renamed topic is an update, not
+    a new article; documents ingested before source URLs were recorded are
+    matched by topic. Returns {url: stored document or None}.
+    """
+    urls = [article['url'] for article in articles]
+    topics = [article['topic'] for article in articles]
+    by_url, by_topic = {}, {}
+    for doc in _db().knowledge_base.find({'$or': [{'source_url': {'$in': urls}}, {'topic': {'$in': topics}}]}, STORED_PROJECTION):
+        if doc.get('source_url'):
+            by_url[doc['source_url']] = doc
+        by_topic[doc['topic']] = doc
+    return {article['url']: by_url.get(article['url']) or by_topic.get(article['topic']) for article in articles}
+
+
+def _content_unchanged(fetched: dict, stored: dict) -> bool:
+    if stored is None:
+        return False
+    if fetched['status'] == 'not_modified':
+        return True
+    # Documents from before content hashes were stored adopt the current page as their baseline
+    return stored.get('content_hash') in (None, content_hash(fetched['text']))
+
+
+def _fetch_fields(article: dict, fetched: dict, now) -> dict:
+    fields = {'source_url': article['url'], 'fetched_at': now}
+    if fetched['status'] == 'ok':
+        fields.update(etag=fetched['etag'], last_modified=fetched['last_modified'], content_hash=content_hash(fetched['text']))
+    return fields
+
+
+def _metadata_changed(article: dict, stored: dict) -> bool:
+    return any(article[field] != stored.get(field) for field in METADATA_FIELDS)
+
+
+def _batch_request_id(article: dict, fetched: dict) -> str:
+    """Stable across restarts as long as the page content is the same."""
+    url_key = hashlib.sha256(article['url'].encode("utf-8")).hexdigest()[:16]
+    return f"{url_key}-{content_hash(fetched['text'])[:16]}"
+
+
+def _summarise_in_batch(pending: list, state_path: str, poll_seconds: float) -> tuple:
+    """
+    Summarises (article, fetched, stored) items through the OpenAI Batch API.
+    Returns (summarised items, items whose batch request failed).
+    """
+    requests_by_id = {_batch_request_id(article, fetched): summary_messages(fetched['text']) for article, fetched, _ in pending}
+    print(f"\nSummarising {len(requests_by_id)} articles with the Batch API (state: {state_path})...")
+    results, errors = run_batch(get_openai_client(), requests_by_id, state_path, SUMMARY_MODEL, poll_seconds=poll_seconds,
+                                temperature=SUMMARY_TEMPERATURE)
+    summarised, failed = [], []
+    for article, fetched, stored in pending:
+        request_id = _batch_request_id(article, fetched)
+        if request_id in results:
+            summarised.append((build_document(results[request_id], article), article, fetched, stored))
+        else:
+            print(f"  Batch request for '{article['topic']}' failed: {errors.get(request_id)}")
+            failed.append((article, fetched, stored))
+    return summarised, failed
+
+
+def ingest_articles(articles_to_process: list, scrape_workers: int = SCRAPE_WORKERS,
+                    per_host_limit: int = PER_HOST_LIMIT, llm_workers: int = LLM_WORKERS, force: bool = False,
+                    batch: bool = False, batch_state_path: str = BATCH_STATE_PATH,
+                    batch_poll_seconds: float = BATCH_POLL_SECONDS):
+    """
+    Main function to process articles and save them to the DB.
+    Ingestion is incremental: pages are fetched with conditional GETs using
+    the stored ETag/Last-Modified, and an article is only re-summarised when
+    the hash of its scraped text changed (or with force=True). Changed
+    metadata (topic, tags, links) is updated without calling the LLM.
+    Scraping and AI structuring run in two bounded thread pools, so an article
+    is summarised as soon as its page arrives while other pages are still
+    downloading. All documents are written with batched upserts at the end.
+
+    With batch=True the summaries go through the OpenAI Batch API instead
+    (cheaper, but may take hours). Progress is saved in `batch_state_path`,
+    so re-running the same command after a restart resumes the batch rather
+    than paying for it again; requests the batch could not answer fall back
+    to regular calls.
+    """
+    db = _db()
+    if db is None:
         print("Database connection failed. Cannot ingest.")
         return
 
     total_articles = len(articles_to_process)
     print(f"Starting ingestion process for {total_articles} articles...")
 
-    for i, article in enumerate(articles_to_process):
-        print(f"\n--- Processing article {i+1}/{total_articles}: {article['topic']} ---")
-        
-        # Check if an article with this topic already exists to avoid duplicates
-        if knowledge_base.count_documents({'topic': article['topic']}) > 0:
-            print(f"Skipped: Article on '{article['topic']}' already exists.")
-            continue
-
-        scraped_text = scrape_article_text(article['url'])
-        if scraped_text:
-            structured_data = structure_content_with_ai(scraped_text, article)
+    # Check all articles in one round trip instead of one query per article
+    stored_docs = _load_stored(articles_to_process)
+
+    summarised, unchanged, batch_pending, failed = [], [], [], 0
+    with ThreadPoolExecutor(max_workers=scrape_workers, thread_name_prefix="scrape") as scrape_pool, \
+         ThreadPoolExecutor(max_workers=llm_workers, thread_name_prefix="llm") as llm_pool:
+        scrape_futures = {
+            scrape_pool.submit(_scrape_limited, article, per_host_limit, None if force else stored_docs.get(article['url'])): article
+            for article in articles_to_process
+        }
+        llm_futures = {}
+        for future in as_completed(scrape_futures):
+            article = scrape_futures[future]
+            fetched = future.result()
+            stored = stored_docs.get(article['url'])
+            if fetched['status'] == 'failed' or (fetched['status'] == 'ok' and not fetched['text']):
+                print(f"❌ Failed to scrape content for: {article['topic']}")
+                failed += 1
+            elif not force and _content_unchanged(fetched, stored):
+                print(f"Unchanged: '{article['topic']}' needs no new summary.")
+                unchanged.append((article, fetched, stored))
+            elif batch:
+                batch_pending.append((article, fetched, stored))
+            else:
+                llm_futures[llm_pool.submit(structure_content_with_ai, fetched['text'], article)] = (article, fetched, stored)
+
+        if batch_pending:
+            summarised, retry = _summarise_in_batch(batch_pending, batch_state_path, batch_poll_seconds)
+            for article, fetched, stored in retry:
+                llm_futures[llm_pool.submit(structure_content_with_ai, fetched['text'], article)] = (article, fetched, stored)
+
+        for future in as_completed(llm_futures):
+            structured_data = future.result()
             if structured_data:
-                knowledge_base.insert_one(structured_data)
-                print(f"✅ Successfully ingested and saved: {structured_data['topic']}")
-        else:
-            print(f"❌ Failed to scrape content for: {article['topic']}")
+                summarised.append((structured_data, *llm_futures[future]))
+                print(f"✅ Successfully structured: {structured_data['topic']}")
+
+    now = datetime.now(timezone.utc)
+    operations = []
+
+    # New or changed content: the whole document is replaced
+    documents = [doc for doc, _, _, _ in summarised]
+    if documents:
+        _add_embeddings(documents)
+    for doc, article, fetched, stored in summarised:
+        target = {'_id': stored['_id']} if stored else {'source_url': article['url']}
+        operations.append(UpdateOne(target, {'$set': dict(doc, updated_at=now, **_fetch_fields(article, fetched, now))}, upsert=True))
+
+    # Same content: refresh the validators, and the metadata if it was edited
+    retagged = [(article, fetched, stored) for article, fetched, stored in unchanged if _metadata_changed(article, stored)]
+    retagged_docs = [dict(stored, **{field: article[field] for field in METADATA_FIELDS}) for article, _, stored in retagged]
+    if retagged_docs:
+        _add_embeddings(retagged_docs)
+    for (article, fetched, stored), doc in zip(retagged, retagged_docs):
+        update = {field: doc[field] for field in METADATA_FIELDS + ('embedding',) if field in doc}
+        operations.append(UpdateOne({'_id': stored['_id']}, {'$set': dict(update, updated_at=now, **_fetch_fields(article, fetched, now))}))
+    for article, fetched, stored in unchanged:
+        if not _metadata_changed(article, stored):
+            operations.append(UpdateOne({'_id': stored['_id']}, {'$set': _fetch_fields(article, fetched, now)}))
+
+    unsaved = set()
+    if operations:
+        _, failed_ops = _bulk_write(operations)
+        # The first operations are the summarised documents, in order
+        unsaved = {i for i in failed_ops if i < len(summarised)}
+        for i in sorted(unsaved):
+            print(f"❌ Could not save the summary of '{summarised[i][0]['topic']}'.")
+        failed += len(failed_ops)
+        summarised = [item for i, item in enumerate(summarised) if i not in unsaved]
+    new_count = sum(1 for _, _, _, stored in summarised if stored is None)
+    print(f"\nIngested {total_articles} articles: {new_count} new, {len(summarised) - new_count} re-summarised, "
+          f"{len(retagged)} metadata-only updates, {len(unchanged) - len(retagged)} unchanged, {failed} failed.")
+
+    changed_urls = [article['url'] for _, article, _, _ in summarised] + [article['url'] for article, _, _ in retagged]
+    if changed_urls:
+        write_chunks({'source_url': {'$in': changed_urls}})
+
+    if batch_pending and not unsaved:
+        # The summaries are stored now; the next batch run starts fresh
+        clear_batch_state(batch_state_path)
+    elif batch_pending:
+        # Keep the paid-for batch results, so the next run saves the failed ones without summarising them again
+        print(f"Kept the batch state in {batch_state_path} for the {len(unsaved)} summaries that could not be saved.")
+
+    if summarised or retagged:
+        # Let running apps know their cached answers are stale
+        bump_kb_version(db)
+
+
+def write_chunks(query: dict = None) -> int:
+    """
+    (Re)builds the knowledge_chunks passages for the documents matching
+    `query` (all documents by default). Chunk ids are "<doc _id>:<index>", so
+    re-chunking overwrites in place; passages left over when a document now
+    has fewer chunks are marked retired. Returns the number of chunks written.
+    """
+    documents = list(_db().knowledge_base.find(query or {}, {'content': 1, **{field: 1 for field in CHUNK_FIELDS}}))
+    chunks = [chunk for doc in documents for chunk in chunk_document(doc)]
+    if not chunks:
+        return 0
+    _add_embeddings_to(chunks, chunk_embedding_text)
+
+    now = datetime.now(timezone.utc)
+    operations = [UpdateOne({'_id': f"{chunk['doc_id']}:{chunk['chunk_index']}"},
+                            {'$set': dict(chunk, updated_at=now, retired=False)}, upsert=True) for chunk in chunks]
+    counts = {}
+    for chunk in chunks:
+        counts[chunk['doc_id']] = counts.get(chunk['doc_id'], 0) + 1
+    for doc_id, count in counts.items():
+        operations.append(UpdateMany({'doc_id': doc_id, 'chunk_index': {'$gte': count}, 'retired': False},
+                                     {'$set': {'retired': True, 'text': '', 'updated_at': now}}))
+    _bulk_write(operations, collection=_db().knowledge_chunks)
+    print(f"Wrote {len(chunks)} passages for {len(documents)} documents.")
+    return len(chunks)
+
+
+def rebuild_chunks():
+    """Re-chunks every knowledge base document, e.g. after changing CHUNK_TOKENS."""
+    if write_chunks():
+        bump_kb_version(_db())
+
+
+def backfill_embeddings():
+    """Computes embeddings for knowledge base documents that don't have one yet."""
+    documents = list(_db().knowledge_base.find({'embedding': {'$exists': False}}))
+    if not documents:
+        print("All documents already have embeddings.")
+        return
+    print(f"Computing embeddings for {len(documents)} documents...")
+    _add_embeddings(documents)
+    documents = [doc for doc in documents if 'embedding' in doc]
+    written = _save_documents(documents)
+    print(f"Saved embeddings for {written} documents.")
+    if written:
+        bump_kb_version(_db())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape, summarise and store the curated articles.")
+    parser.add_argument("--scrape-workers", type=int, default=SCRAPE_WORKERS, help="Pages downloaded in parallel.")
+    parser.add_argument("--per-host", type=int, default=PER_HOST_LIMIT, help="Maximum parallel requests to a single host.")
+    parser.add_argument("--llm-workers", type=int, default=LLM_WORKERS, help="Parallel AI summarisation calls.")
+    parser.add_argument("--backfill-embeddings", action="store_true", help="Only add embeddings to existing documents.")
+    parser.add_argument("--rechunk", action="store_true", help="Only rebuild the passage index (knowledge_chunks).")
+    parser.add_argument("--force", action="store_true", help="Re-scrape and re-summarise every article, even if unchanged.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Summarise with the OpenAI Batch API (cheaper, slower). Re-run to resume after a restart.")
+    parser.add_argument("--batch-state", default=BATCH_STATE_PATH, help="Where batch progress is saved.")
+    parser.add_argument("--batch-poll", type=float, default=BATCH_POLL_SECONDS, help="Seconds between batch status checks.")
+    parser.add_argument("--fetch-mode", choices=["live", "record", "replay"], default=None,
+                        help="live (default), record pages as fixtures, or replay fixtures offline.")
+    parser.add_argument("--fixtures", default=None, help="Fixture directory for --fetch-mode record/replay.")
+    parser.add_argument("--snapshot", nargs="?", const=SNAPSHOT_DIR or ".cache/snapshots", default=None, metavar="DIR",
+                        help="Afterwards, export and publish a local snapshot (default directory: SNAPSHOT_DIR).")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
@@ -193,8 +527,24 @@ if __name__ == "__main__":
         
     ]
     
-    ingest_articles(ARTICLES_TO_INGEST)
+    args = parse_args()
+    if args.fetch_mode or args.fixtures:
+        fetcher_options = {"mode": args.fetch_mode} if args.fetch_mode else {}
+        if args.fixtures:
+            fetcher_options["fixtures_dir"] = args.fixtures
+        set_fetcher(Fetcher(**fetcher_options))
+    if args.backfill_embeddings:
+        backfill_embeddings()
+    elif args.rechunk:
+        rebuild_chunks()
+    else:
+        ingest_articles(ARTICLES_TO_INGEST, scrape_workers=args.scrape_workers,
+                        per_host_limit=args.per_host, llm_workers=args.llm_workers, force=args.force,
+                        batch=args.batch, batch_state_path=args.batch_state, batch_poll_seconds=args.batch_poll)
+    db = _db()
+    if args.snapshot and db is not None:
+        print(f"Published snapshot {export_snapshot(db, args.snapshot)}.")
     
-    if db_client:
-        db_client.close()
+    if db is not None:
+        close_db_connection()
         print("\nDatabase connection closed.")
\ No newline at end of file
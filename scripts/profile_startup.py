@@ -0,0 +1,83 @@
+"""
+Reports what importing the app costs, per module.
+
+    python scripts/profile_startup.py                # agent and api
+    python scripts/profile_startup.py app --top 40   # the Streamlit script (run in bare mode)
+
+Each target is imported in a fresh interpreter with `python -X importtime`;
+the report lists the top-level packages (ours and third-party) with the
+largest cumulative import time, then the slowest individual modules.
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def profile_import(module: str) -> tuple:
+    """Imports `module` in a new interpreter. Returns (wall seconds, [(module, self_us, cumulative_us, depth)])."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    # Settings the modules insist on; nothing connects at import time
+    env.setdefault("LLM_API_KEY", "profile")
+    env.setdefault("MONGO_URI", "mongodb://localhost:27017")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise RuntimeError(f"Importing {module} failed: {tail[0]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return elapsed, rows
+
+
+def report(module: str, top: int):
+    elapsed, rows = profile_import(module)
+    target = next((row for row in rows if row[0] == module), None)
+    print(f"\n=== import {module}: {target[2] / 1000:.0f} ms importing, {elapsed * 1000:.0f} ms wall (incl. interpreter start) ===")
+
+    # Cost of each top-level package, counted where it is first entered from another package
+    packages, stack = {}, []
+    for name, _, cumulative_us, depth in reversed(rows):  # parents first
+        while stack and stack[-1][1] >= depth:
+            stack.pop()
+        root = name.split(".")[0]
+        if name != module and (not stack or stack[-1][0].split(".")[0] != root):
+            packages[root] = packages.get(root, 0) + cumulative_us
+        stack.append((name, depth))
+    print(f"{'cumulative ms':>14}  package")
+    for name, cumulative_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:14.1f}  {name}")
+
+    print(f"\n{'self ms':>14}  slowest modules")
+    for name, self_us, _, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+        print(f"{self_us / 1000:14.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import-time cost per module (python -X importtime).")
+    parser.add_argument("modules", nargs="*", default=["agent", "api"], help="Modules to import (default: agent api).")
+    parser.add_argument("--top", type=int, default=20, help="Rows to show per table.")
+    args = parser.parse_args()
+    for module in args.modules:
+        try:
+            report(module, args.top)
+        except RuntimeError as e:
+            print(e)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+"""
+Local, read-only snapshots of the knowledge base for in-process retrieval.
+
+    python snapshot.py                  # export knowledge_base and knowledge_chunks, then publish
+    python snapshot.py --info           # describe the published snapshot
+
+A snapshot is a directory holding, per collection:
+    <name>.columns.json    metadata by column (topic, tags, personas, links, ...)
+    <name>.text.bin        every document's text, UTF-8, back to back
+    <name>.offsets.npy     int64 byte offsets into the text blob (rows + 1)
+    <name>.embeddings.npy  float16 L2-normalised embeddings, memory-mapped on load
+    <name>.vector_rows.npy row number of each embedding
+plus manifest.json. Snapshots are written under a temporary name and
+published by atomically repointing the `current` symlink, so readers see
+either the old snapshot or the new one. Every process that loads the same
+snapshot shares the embedding pages through the OS page cache.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+from retrieval_utils import KnowledgeIndex, PassageIndex
+
+# --- Snapshot Settings ---
+# Directory of published snapshots; empty disables snapshot retrieval.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+# Published snapshots kept on disk (older ones are deleted after a publish)
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+SNAPSHOT_FORMAT = 1
+CURRENT_LINK = "current"
+
+# Collection -> (text field stored in the blob, fields exported)
+COLLECTIONS = {
+    "knowledge_base": ("content", KnowledgeIndex.FIELDS),
+    "knowledge_chunks": ("text", PassageIndex.FIELDS),
+}
+
+
+def _plain(value):
+    """A JSON-friendly copy of a metadata value (ObjectIds become strings, datetimes ISO strings)."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool, dict)):
+        return value
+    return str(value)
+
+
+# --- Export ---
+def _write_collection(directory: str, name: str, docs, text_field: str, fields: dict) -> dict:
+    """Writes one collection's files. Returns its manifest entry."""
+    columns = {field: [] for field in ["_id", *fields] if field not in (text_field, "embedding")}
+    offsets, vector_rows, vectors, dim = [0], [], [], None
+    with open(os.path.join(directory, f"{name}.text.bin"), "wb") as blob:
+        for row, doc in enumerate(docs):
+            text = (doc.get(text_field) or "").encode("utf-8")
+            blob.write(text)
+            offsets.append(offsets[-1] + len(text))
+            for field, column in columns.items():
+                column.append(_plain(doc.get(field)))
+            embedding = doc.get("embedding")
+            if embedding:
+                dim = dim or len(embedding)
+                if len(embedding) == dim:
+                    vector_rows.append(row)
+                    vectors.append(embedding)
+
+    with open(os.path.join(directory, f"{name}.columns.json"), "w", encoding="utf-8") as f:
+        json.dump(columns, f, ensure_ascii=False, separators=(",", ":"))
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), dim or 0)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    np.save(os.path.join(directory, f"{name}.embeddings.npy"), matrix.astype(np.float16))
+    np.save(os.path.join(directory, f"{name}.vector_rows.npy"), np.asarray(vector_rows, dtype=np.int64))
+    return {"rows": len(offsets) - 1, "text_field": text_field, "embedded": len(vector_rows), "embedding_dim": dim or 0}
+
+
+def export_snapshot(db, directory: str = SNAPSHOT_DIR, keep: int = SNAPSHOT_KEEP) -> str:
+    """Writes a snapshot of the knowledge base, publishes it and prunes old ones. Returns its path."""
+    from db_utils import get_kb_version
+    if not directory:
+        raise ValueError("No snapshot directory given (set SNAPSHOT_DIR).")
+    os.makedirs(directory, exist_ok=True)
+    kb_version = get_kb_version(db)
+    name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%fZ}-v{kb_version}"
+    staging = os.path.join(directory, f".{name}.tmp")
+    os.makedirs(staging)
+    try:
+        manifest = {"format": SNAPSHOT_FORMAT, "version": name, "kb_version": kb_version,
+                    "created_at": datetime.now(timezone.utc).isoformat(), "collections": {}}
+        for collection, (text_field, fields) in COLLECTIONS.items():
+            # Retired chunks are never served, so they are left out
+            query = {"retired": {"$ne": True}} if collection == "knowledge_chunks" else {}
+            manifest["collections"][collection] = _write_collection(
+                staging, collection, db[collection].find(query, fields), text_field, fields)
+        with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        path = os.path.join(directory, name)
+        os.rename(staging, path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    publish(directory, name)
+    prune(directory, keep)
+    return path
+
+
+def publish(directory: str, name: str):
+    """Points `current` at the snapshot `name`, atomically."""
+    staging_link = os.path.join(directory, f".{CURRENT_LINK}.{os.getpid()}")
+    if os.path.lexists(staging_link):
+        os.remove(staging_link)
+    os.symlink(name, staging_link)
+    os.replace(staging_link, os.path.join(directory, CURRENT_LINK))
+
+
+def prune(directory: str, keep: int = SNAPSHOT_KEEP):
+    """
+    Deletes all but the newest `keep` snapshots (never the published one).
+    Processes still reading a deleted snapshot keep their open memory maps.
+    """
+    current = current_snapshot(directory)
+    names = sorted((n for n in os.listdir(directory)
+                    if not n.startswith(".") and n != CURRENT_LINK and os.path.isdir(os.path.join(directory, n))),
+                   reverse=True)
+    for name in names[max(keep, 1):]:
+        path = os.path.join(directory, name)
+        # `current` is resolved, so resolve this too (the directory may be relative or a symlink)
+        if os.path.realpath(path) != current:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# --- Loading ---
+def current_snapshot(directory: str = SNAPSHOT_DIR):
+    """The path of the published snapshot, or None. Cheap enough to call per request (one readlink)."""
+    if not directory:
+        return None
+    link = os.path.join(directory, CURRENT_LINK)
+    if not os.path.lexists(link):
+        return None
+    path = os.path.realpath(link)
+    return path if os.path.isdir(path) else None
+
+
+class Snapshot:
+    """A published snapshot, opened read-only. Embedding matrices are memory maps, not copies."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {self.manifest.get('format')} in {path}.")
+        self.version = self.manifest["version"]
+
+    def has(self, name: str) -> bool:
+        return self.manifest["collections"].get(name, {}).get("rows", 0) > 0
+
+    def _file(self, name: str, suffix: str) -> str:
+        return os.path.join(self.path, f"{name}.{suffix}")
+
+    def documents(self, name: str) -> list:
+        """Every row of a collection as a dict, text included."""
+        entry = self.manifest["collections"][name]
+        with open(self._file(name, "columns.json"), encoding="utf-8") as f:
+            columns = json.load(f)
+        offsets = np.load(self._file(name, "offsets.npy"))
+        with open(self._file(name, "text.bin"), "rb") as f:
+            blob = f.read()
+        fields = list(columns)
+        docs = []
+        for row in range(entry["rows"]):
+            doc = {field: columns[field][row] for field in fields}
+            doc[entry["text_field"]] = blob[offsets[row]:offsets[row + 1]].decode("utf-8")
+            docs.append(doc)
+        return docs
+
+    def embeddings(self, name: str) -> tuple:
+        """(row numbers, read-only float16 memory map) of a collection's embeddings."""
+        rows = np.load(self._file(name, "vector_rows.npy"))
+        matrix = np.load(self._file(name, "embeddings.npy"), mmap_mode="r") if len(rows) else None
+        return rows, matrix
+
+    def index_rows(self, name: str) -> tuple:
+        """(documents, ids of the embedded rows, embedding matrix), the arguments of KnowledgeIndex.load_snapshot."""
+        docs = self.documents(name)
+        rows, matrix = self.embeddings(name)
+        return docs, [docs[row]["_id"] for row in rows], matrix
+
+
+def load_snapshot(path: str = None):
+    """Opens the given or the published snapshot. Returns None if there is none."""
+    path = path or current_snapshot()
+    return Snapshot(path) if path else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the knowledge base to a local snapshot and publish it.")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR or ".cache/snapshots", help="Snapshot directory (default: SNAPSHOT_DIR).")
+    parser.add_argument("--keep", type=int, default=SNAPSHOT_KEEP, help="Published snapshots to keep.")
+    parser.add_argument("--info", action="store_true", help="Describe the published snapshot instead of exporting.")
+    args = parser.parse_args()
+
+    if args.info:
+        snapshot = load_snapshot(current_snapshot(args.dir))
+        if snapshot is None:
+            print(f"No snapshot published in {args.dir}.")
+            return 1
+        print(json.dumps(snapshot.manifest, indent=2))
+        return 0
+
+    from db_utils import get_db_connection, close_db_connection
+    db_client, db, _, _ = get_db_connection()
+    if not db_client:
+        print("Database connection failed.")
+        return 1
+    try:
+        path = export_snapshot(db, args.dir, args.keep)
+    finally:
+        close_db_connection()
+    snapshot = Snapshot(path)
+    counts = ", ".join(f"{entry['rows']} {name}" for name, entry in snapshot.manifest["collections"].items())
+    print(f"Published snapshot {snapshot.version} ({counts}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
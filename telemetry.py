@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import uuid
+import inspect
+import functools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+# --- Telemetry Settings ---
+# Comma-separated exporters: "memory" (admin panel), "jsonl" (local file), "otel" (OpenTelemetry).
+TELEMETRY_EXPORTERS = os.getenv("TELEMETRY_EXPORTERS", "memory")
+TELEMETRY_BUFFER_SIZE = int(os.getenv("TELEMETRY_BUFFER_SIZE", "5000"))
+TELEMETRY_JSONL_PATH = os.getenv("TELEMETRY_JSONL_PATH", ".cache/telemetry.jsonl")
+
+_current_span = contextvars.ContextVar("arthavivek_span", default=None)
+
+
+class Span:
+    """One timed stage of a request. Attributes hold token counts, sizes and cache flags."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "duration_ms", "attributes", "error")
+
+    def __init__(self, name: str, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.end = None
+        self.duration_ms = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start": self.start, "duration_ms": self.duration_ms, "attributes": self.attributes, "error": self.error}
+
+
+# --- Exporters ---
+class InMemoryExporter:
+    """Keeps the most recent spans in a ring buffer and summarises them for the admin panel."""
+
+    def __init__(self, max_spans: int = TELEMETRY_BUFFER_SIZE):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            self._spans.append(span.to_dict())
+
+    def spans(self, window_seconds: float = None) -> list:
+        with self._lock:
+            spans = list(self._spans)
+        if window_seconds is not None:
+            cutoff = time.time() - window_seconds
+            spans = [s for s in spans if s["start"] >= cutoff]
+        return spans
+
+    def summary(self, window_seconds: float = None) -> dict:
+        """
+        Per stage: count, error count, p50/p95/p99 latency, the hit rate of
+        any boolean "cache_hit" attribute, and the share of prompt tokens
+        served from the provider's prompt cache ("cached_tokens").
+        """
+        by_name = {}
+        for s in self.spans(window_seconds):
+            by_name.setdefault(s["name"], []).append(s)
+        return {name: _summarise(spans) for name, spans in sorted(by_name.items())}
+
+    def breakdown(self, name: str, attribute: str, window_seconds: float = None) -> dict:
+        """The same summary for one stage, split by the value of one of its attributes (e.g. advice by route)."""
+        by_value = {}
+        for s in self.spans(window_seconds):
+            if s["name"] == name and attribute in s["attributes"]:
+                by_value.setdefault(str(s["attributes"][attribute]), []).append(s)
+        return {value: _summarise(spans) for value, spans in sorted(by_value.items())}
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+def _summarise(spans: list) -> dict:
+    durations = [s["duration_ms"] for s in spans]
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+    row = {"count": len(spans), "errors": sum(1 for s in spans if s["error"]),
+           "p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1)}
+    hits = [s["attributes"]["cache_hit"] for s in spans if "cache_hit" in s["attributes"]]
+    if hits:
+        row["cache_hit_rate"] = round(sum(hits) / len(hits), 3)
+    cached = [(s["attributes"]["cached_tokens"], s["attributes"].get("prompt_tokens") or 0)
+              for s in spans if s["attributes"].get("cached_tokens") is not None]
+    if cached and sum(prompt for _, prompt in cached):
+        row["prompt_cache_hit_rate"] = round(sum(c for c, _ in cached) / sum(p for _, p in cached), 3)
+    return row
+
+
+class JSONLExporter:
+    """Appends one JSON line per finished span, for local analysis."""
+
+    def __init__(self, path: str = TELEMETRY_JSONL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class OpenTelemetryExporter:
+    """
+    Re-emits finished spans through the OpenTelemetry API, so any configured
+    OTel SDK/exporter picks them up. Requires the 'opentelemetry-api' package.
+    """
+
+    def __init__(self, tracer_name: str = "arthavivek"):
+        from opentelemetry import trace
+        self._tracer = trace.get_tracer(tracer_name)
+
+    def export(self, span: Span):
+        attributes = {k: v for k, v in span.attributes.items() if isinstance(v, (str, bool, int, float))}
+        attributes.update({"arthavivek.trace_id": span.trace_id, "arthavivek.parent_id": span.parent_id or ""})
+        if span.error:
+            attributes["error"] = span.error
+        otel_span = self._tracer.start_span(span.name, start_time=int(span.start * 1e9), attributes=attributes)
+        otel_span.end(end_time=int(span.end * 1e9))
+
+
+def create_exporters(names: str = TELEMETRY_EXPORTERS) -> list:
+    """Builds the exporters named in TELEMETRY_EXPORTERS. Unavailable ones are skipped with a message."""
+    factories = {"memory": InMemoryExporter, "jsonl": JSONLExporter, "otel": OpenTelemetryExporter}
+    exporters = []
+    for name in (n.strip() for n in names.split(",")):
+        if not name:
+            continue
+        if name not in factories:
+            print(f"Unknown telemetry exporter '{name}'. Ignoring it.")
+            continue
+        try:
+            exporters.append(factories[name]())
+        except ImportError as e:
+            print(f"Telemetry exporter '{name}' is not available: {e}")
+    return exporters
+
+
+exporters = create_exporters()
+
+
+def memory_exporter():
+    """The in-memory exporter used by the admin panel, or None if it is disabled."""
+    return next((e for e in exporters if isinstance(e, InMemoryExporter)), None)
+
+
+# --- Recording ---
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times a stage and exports it when the block ends. Spans opened inside the
+    block (in the same thread or asyncio task) become its children.
+
+        with span("retrieval", mode="hybrid") as s:
+            docs = search(...)
+            s.set(documents=len(docs))
+    """
+    current = Span(name, parent=_current_span.get(), attributes=attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.end = time.time()
+        current.duration_ms = round((current.end - current.start) * 1000, 2)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # A generator was resumed in a different context; nothing to restore
+            pass
+        _export(current)
+
+
+def span_generator(generator_fn):
+    """
+    Decorator for generators that open spans. Their spans are current only
+    while the generator runs: at every yield the caller's span is restored,
+    so spans the caller opens between items (e.g. for rendering or
+    translating them) are not parented under the generator's open spans.
+    Works for plain and async generators.
+    """
+    if inspect.isasyncgenfunction(generator_fn):
+        @functools.wraps(generator_fn)
+        async def async_wrapper(*args, **kwargs):
+            events = generator_fn(*args, **kwargs)
+            outer = inner = _current_span.get()
+            try:
+                while True:
+                    _current_span.set(inner)
+                    try:
+                        item = await events.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        inner = _current_span.get()
+                        _current_span.set(outer)
+                    yield item
+            finally:
+                # Let the generator close its spans in its own span context
+                _current_span.set(inner)
+                try:
+                    await events.aclose()
+                finally:
+                    _current_span.set(outer)
+        return async_wrapper
+
+    @functools.wraps(generator_fn)
+    def wrapper(*args, **kwargs):
+        events = generator_fn(*args, **kwargs)
+        outer = inner = _current_span.get()
+        try:
+            while True:
+                _current_span.set(inner)
+                try:
+                    item = next(events)
+                except StopIteration:
+                    return
+                finally:
+                    inner = _current_span.get()
+                    _current_span.set(outer)
+                yield item
+        finally:
+            _current_span.set(inner)
+            try:
+                events.close()
+            finally:
+                _current_span.set(outer)
+    return wrapper
+
+
+def _export(finished: Span):
+    for exporter in exporters:
+        try:
+            exporter.export(finished)
+        except Exception as e:
+            print(f"Telemetry export error: {e}")
+
+
+def record_span(name: str, duration_ms: float, error: str = None, **attributes):
+    """Exports a stage that was timed elsewhere (e.g. by a driver callback) as a child of the current span."""
+    finished = Span(name, parent=_current_span.get(), attributes=attributes)
+    finished.end = finished.start
+    finished.start -= duration_ms / 1000
+    finished.duration_ms = round(duration_ms, 2)
+    finished.error = error
+    _export(finished)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def annotate(**attributes):
+    """Adds attributes to the innermost open span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def usage_attributes(usage) -> dict:
+    """Token counts from an OpenAI usage object (empty if the API didn't send one)."""
+    if usage is None:
+        return {}
+    attributes = {"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                  "completion_tokens": getattr(usage, "completion_tokens", None)}
+    # Prompt tokens served from the provider's prefix cache
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is not None and getattr(details, "cached_tokens", None) is not None:
+        attributes["cached_tokens"] = details.cached_tokens
+    return attributes
+
+
+def prompt_chars(messages: list) -> int:
+    return sum(len(m.get("content") or "") for m in messages)
@@ -0,0 +1,41 @@
+import asyncio
+import types
+
+import pytest
+
+import advice_service
+
+
+def chunk(text):
+    return types.SimpleNamespace(usage=None, choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+
+
+async def provider(delays):
+    for delay in delays:
+        await asyncio.sleep(delay)
+        yield chunk("x")
+
+
+def read(delays, consumer_delay=0.0):
+    async def scenario():
+        received = 0
+        async for _ in advice_service._timed_chunks(provider(delays), first_timeout=0.2, idle_timeout=0.05):
+            received += 1
+            await asyncio.sleep(consumer_delay)
+        return received
+    return asyncio.run(scenario())
+
+
+def test_slow_consumer_does_not_count_against_the_provider():
+    assert read([0.1, 0.01, 0.01, 0.01], consumer_delay=0.1) == 4
+
+
+def test_stalled_provider_times_out_between_tokens():
+    with pytest.raises(TimeoutError):
+        read([0.01, 0.01, 0.2])
+
+
+def test_first_token_gets_the_longer_timeout():
+    assert read([0.15, 0.01]) == 2
+    with pytest.raises(TimeoutError):
+        read([0.3])
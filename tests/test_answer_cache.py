@@ -0,0 +1,24 @@
+from cache_utils import AnswerCache
+
+
+def test_exact_key_ignores_case_and_punctuation():
+    cache = AnswerCache()
+    cache.put("Should I invest in crypto?", "Student", {"answer": "a"})
+    assert cache.get("should i invest in CRYPTO", "student") == {"answer": "a"}
+    assert cache.get("Should I invest in crypto?", "Retiree") is None
+
+
+def test_negated_question_does_not_reuse_the_answer():
+    cache = AnswerCache()
+    cache.put("should I invest in crypto", "student", {"answer": "yes"})
+    assert cache.get("should I not invest in crypto", "student") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    for query in ("a", "b", "c"):
+        cache.put(query, "p", query)
+    assert cache.get("a", "p") is None
+    assert cache.get("c", "p") == "c"
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,46 @@
+import json
+
+from batch_advice import ResultWriter
+
+
+def record(key, answered_by="llm", **extra):
+    return {"key": key, "query": key, "persona": "Student", "ids": [key], "answer": "...",
+            "videos": [], "blogs": [], "route": "complex", "answered_by": answered_by, **extra}
+
+
+def write_lines(path, lines):
+    path.write_text("".join(lines), encoding="utf-8")
+
+
+def test_resume_keeps_answers_and_drops_failures_refusals_and_a_torn_line(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [
+        json.dumps(record("answered")) + "\n",
+        json.dumps(record("failed", answered_by="knowledge_base", error="timeout")) + "\n",
+        json.dumps(record("refused", answered_by="router")) + "\n",
+        json.dumps(record("extractive", answered_by="extractive")) + "\n",
+        '{"key": "torn", "query": "cut sh',
+    ])
+
+    writer = ResultWriter(str(path))
+    writer.close()
+
+    assert writer.done == {"answered", "extractive"}
+    assert [json.loads(line)["key"] for line in path.read_text(encoding="utf-8").splitlines()] == ["answered", "extractive"]
+
+
+def test_resumed_file_appends_new_results_on_their_own_lines(tmp_path):
+    path = tmp_path / "answers.jsonl"
+    write_lines(path, [json.dumps(record("answered"))])
+
+    writer = ResultWriter(str(path))
+    writer.write(record("next"))
+    writer.write(record("broken", error="timeout"))
+    writer.close()
+
+    keys = [json.loads(line)["key"] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert keys == ["answered", "next", "broken"]
+    assert writer.counts == {"llm": 1, "failed": 1}
+
+    # A second resume retries the failure only
+    assert ResultWriter(str(path)).done == {"answered", "next"}
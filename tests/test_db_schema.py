@@ -0,0 +1,46 @@
+"""
+Checks the declared indexes (see db_schema.py) against a real MongoDB server:
+every hot query must use an index, and the startup path must never drop one.
+Skipped unless MONGO_URI is set; the tests use a throwaway database.
+"""
+import os
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+from db_schema import ensure_indexes, explain_query, hot_queries
+
+MONGO_URI = os.getenv("MONGO_URI")
+pytestmark = pytest.mark.skipif(not MONGO_URI, reason="MONGO_URI is not set")
+
+
+@pytest.fixture(scope="module")
+def db():
+    client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    name = f"arthavivek_test_{os.getpid()}"
+    try:
+        database = client[name]
+        ensure_indexes(database)
+        yield database
+    finally:
+        client.drop_database(name)
+        client.close()
+
+
+@pytest.mark.parametrize("query", hot_queries(), ids=lambda query: query["name"])
+def test_hot_query_uses_an_index(db, query):
+    stages = explain_query(db, query)
+    assert "COLLSCAN" not in stages, " <- ".join(stages)
+
+
+def test_only_the_cli_rebuilds_indexes(db):
+    chunks = db["knowledge_chunks"]
+    chunks.drop_index("doc_id")
+    chunks.create_index([("doc_id", pymongo.ASCENDING)], name="legacy_doc_id")
+
+    assert ensure_indexes(db) == []
+    assert "legacy_doc_id" in chunks.index_information()
+
+    assert ensure_indexes(db, rebuild=True) == ["doc_id"]
+    indexes = chunks.index_information()
+    assert "doc_id" in indexes and "legacy_doc_id" not in indexes
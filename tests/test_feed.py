@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+import advice_service
+import feed_utils
+from feed_utils import FeedCache
+
+T0 = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def updates():
+    return mongomock.MongoClient().db.updates
+
+
+def publish(collection, title, date):
+    collection.insert_one({"title": title, "source": "test", "date_published": date, "summary": "", "original_link": "#"})
+
+
+def test_poll_picks_up_updates_sharing_the_newest_timestamp(updates):
+    publish(updates, "first", T0)
+    feed = FeedCache(updates, size=5)
+    feed.reload()
+    publish(updates, "same time", T0)
+    publish(updates, "later", T0 + timedelta(hours=1))
+    feed.poll()
+    feed.poll()
+    assert [a["title"] for a in feed.latest(10)] == ["later", "same time", "first"]
+    assert all("_id" not in a for a in feed.latest(10))
+
+
+def test_paging_does_not_skip_updates_sharing_the_boundary_timestamp(updates):
+    for i in range(7):
+        publish(updates, f"tie {i}", T0)
+    publish(updates, "oldest", T0 - timedelta(days=1))
+    feed = FeedCache(updates, size=3)
+    feed.reload()
+
+    shown = feed.latest(3)
+    while True:
+        last = shown[-1]
+        older = feed.page(last["date_published"], last["id"], limit=3)
+        if not older:
+            break
+        shown += older
+    assert [a["title"] for a in shown] == [f"tie {i}" for i in reversed(range(7))] + ["oldest"]
+
+
+def test_api_first_page_is_served_from_the_feed_cache(updates, monkeypatch):
+    publish(updates, "cached", T0)
+    monkeypatch.setattr(feed_utils, "_feed_cache", None)
+    monkeypatch.setattr(feed_utils.FeedCache, "start", FeedCache.reload)
+    monkeypatch.setattr(advice_service, "get_database", lambda: (object(), updates.database))
+
+    def no_query():
+        raise AssertionError("the first page must not query the database")
+
+    monkeypatch.setattr(advice_service, "get_async_db", no_query)
+    assert [a["title"] for a in asyncio.run(advice_service.get_updates_page_async(limit=5))] == ["cached"]
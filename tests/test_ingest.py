@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_needs_no_credentials_or_network():
+    env = {key: value for key, value in os.environ.items() if key not in ("LLM_API_KEY", "MONGO_URI")}
+    code = "import sys, clients; from scripts import ingest; assert 'openai' not in sys.modules and not clients._clients"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, check=True, timeout=60)
+
+
+def test_bulk_write_skips_failed_operations(monkeypatch):
+    import mongomock
+    from pymongo import UpdateOne
+    from scripts import ingest
+
+    db = mongomock.MongoClient().db
+    db.knowledge_base.create_index("topic", unique=True)
+    db.knowledge_base.insert_one({"topic": "PPF", "source_url": "https://a"})
+    monkeypatch.setattr(ingest, "_db", lambda: db)
+
+    operations = [
+        # A renamed article whose new topic is already taken
+        UpdateOne({"source_url": "https://b"}, {"$set": {"topic": "PPF"}}, upsert=True),
+        UpdateOne({"source_url": "https://c"}, {"$set": {"topic": "NPS"}}, upsert=True),
+    ]
+    written, failed = ingest._bulk_write(operations)
+    assert (written, failed) == (1, [0])
+    assert db.knowledge_base.count_documents({"topic": "NPS"}) == 1
@@ -0,0 +1,95 @@
+import time
+import asyncio
+import types
+import pytest
+
+from llm_gateway import LLMGateway, LLMUnavailable, CircuitBreaker, TokenBucket, LatencyTracker
+
+
+class ServerError(Exception):
+    status_code = 503
+
+
+class FakeClient:
+    """Stands in for OpenAI/AsyncOpenAI: `create` is called with the request parameters."""
+
+    def __init__(self, create):
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=create))
+
+    def with_options(self, **options):
+        return self
+
+
+def tripped_gateway(**options) -> LLMGateway:
+    """A gateway whose breaker has opened and cooled down, so the next call is the half-open probe."""
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0)
+    breaker.record_failure()
+    return LLMGateway(breaker=breaker, max_retries=0, hedge=False, **options)
+
+
+def test_breaker_opens_and_a_successful_probe_closes_it():
+    gateway = LLMGateway(breaker=CircuitBreaker(failure_threshold=2, cooldown_seconds=60), max_retries=0, hedge=False)
+
+    def failing(**params):
+        raise ServerError("down")
+
+    for _ in range(2):
+        with pytest.raises(ServerError):
+            gateway.chat(FakeClient(failing), model="m")
+    with pytest.raises(LLMUnavailable) as rejected:
+        gateway.chat(FakeClient(failing), model="m")
+    assert rejected.value.reason == "circuit_open"
+
+    gateway.breaker.cooldown_seconds = 0
+    assert gateway.chat(FakeClient(lambda **params: "ok"), model="m") == "ok"
+    assert gateway.breaker.state == "closed"
+
+
+def test_rate_limited_probe_releases_the_probe_slot():
+    gateway = tripped_gateway(bucket=TokenBucket(rate=0.001, capacity=1))
+    gateway.bucket.try_acquire()  # empty the bucket
+    with pytest.raises(LLMUnavailable) as limited:
+        gateway.chat(FakeClient(lambda **params: "ok"), model="m", deadline=0.05)
+    assert limited.value.reason == "rate_limited"
+
+    gateway.bucket = TokenBucket(rate=0)
+    assert gateway.chat(FakeClient(lambda **params: "ok"), model="m") == "ok"
+    assert gateway.breaker.state == "closed"
+
+
+def test_cancelled_async_probe_releases_the_probe_slot():
+    gateway = tripped_gateway(bucket=TokenBucket(rate=0))
+
+    async def slow(**params):
+        await asyncio.sleep(10)
+
+    async def fast(**params):
+        return "ok"
+
+    async def scenario():
+        task = asyncio.create_task(gateway.achat(FakeClient(slow), model="m"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await gateway.achat(FakeClient(fast), model="m")
+
+    assert asyncio.run(scenario()) == "ok"
+    assert gateway.breaker.state == "closed"
+
+
+def test_hedge_does_not_take_the_probe_slot():
+    latencies = LatencyTracker(min_samples=1)
+    latencies.record(("m", False), 0.001)
+    gateway = tripped_gateway(bucket=TokenBucket(rate=0), latencies=latencies)
+    gateway.hedge = True
+    calls = []
+
+    def slow(**params):
+        calls.append(params)
+        time.sleep(0.4)
+        return "ok"
+
+    assert gateway.chat(FakeClient(slow), model="m") == "ok"
+    assert len(calls) == 1
+    assert gateway.stats()["hedges"] == 0
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import numpy as np
+import pytest
+
+from retrieval_utils import KnowledgeIndex, PassageIndex
+
+T0 = datetime(2026, 1, 1)
+
+
+def embed(texts):
+    return np.ones((len(texts), 4), dtype=np.float32) / 2
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def kb_doc(topic, updated_at, **fields):
+    return dict({"_id": topic.lower(), "topic": topic, "content": f"{topic} explained", "tags": [],
+                 "embedding": [0.5, 0.5, 0.5, 0.5], "updated_at": updated_at}, **fields)
+
+
+def test_refresh_loads_documents_written_at_the_watermark(db):
+    db.knowledge_base.insert_one(kb_doc("PPF", T0))
+    index = KnowledgeIndex(embed)
+    assert index.refresh(db.knowledge_base) == 1
+    db.knowledge_base.insert_one(kb_doc("NPS", T0))
+    assert index.refresh(db.knowledge_base) == 1
+    assert index.refresh(db.knowledge_base) == 0
+    assert set(index.docs) == {"ppf", "nps"}
+
+
+def test_refresh_drops_deleted_documents_when_reconcile_is_due(db):
+    db.knowledge_base.insert_many([kb_doc("PPF", T0), kb_doc("NPS", T0 + timedelta(seconds=1))])
+    index = KnowledgeIndex(embed, reconcile_seconds=3600)
+    index.refresh(db.knowledge_base)
+    db.knowledge_base.delete_one({"_id": "ppf"})
+
+    assert index.refresh(db.knowledge_base) == 0
+    assert "ppf" in index.docs
+    index.reconcile_seconds = 0
+    assert index.reconcile_due()
+    assert index.refresh(db.knowledge_base) == 1
+    assert list(index.docs) == ["nps"] and index.vectors.ids == ["nps"]
+    assert [doc["_id"] for doc in index.search("PPF NPS", k=3)] == ["nps"]
+
+
+def test_retired_passages_are_never_returned(db):
+    chunks = [{"_id": f"old:{i}", "doc_id": "old", "chunk_index": i, "text": "ppf interest rate", "topic": "PPF",
+               "tags": [], "retired": True, "embedding": [1, 0, 0, 0], "updated_at": T0} for i in range(10)]
+    chunks.append({"_id": "live:0", "doc_id": "live", "chunk_index": 0, "text": "ppf lock in period", "topic": "PPF",
+                   "tags": [], "embedding": [0.5, 0.5, 0.5, 0.5], "updated_at": T0})
+    db.knowledge_chunks.insert_many(chunks)
+    index = PassageIndex(embed)
+    index.refresh(db.knowledge_chunks)
+    for mode in ("hybrid", "vector", "bm25"):
+        assert [hit["_id"] for hit in index.search("ppf interest rate", k=3, mode=mode)] == ["live:0"]
+
+
+def test_persona_filter_keeps_documents_for_everyone(db):
+    db.knowledge_base.insert_many([kb_doc("PPF", T0, personas=["student"]), kb_doc("NPS", T0, personas=["professional"]),
+                                   kb_doc("Budget", T0)])
+    index = KnowledgeIndex(embed)
+    index.refresh(db.knowledge_base)
+    found = {doc["_id"] for doc in index.search("ppf nps budget", k=5, persona="student")}
+    assert found == {"ppf", "budget"}
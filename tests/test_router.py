@@ -0,0 +1,44 @@
+import pytest
+
+from router import QueryRouter, OFF_TOPIC, DEFINITIONAL, COMPLEX
+
+
+@pytest.fixture
+def router():
+    router = QueryRouter()
+    router.learn_topics([
+        {"topic": "Capital gains tax", "tags": ["tax", "stocks"]},
+        {"topic": "NEFT and IMPS transfers", "tags": ["banking", "upi"]},
+    ])
+    return router
+
+
+@pytest.mark.parametrize("query, route", [
+    ("What is a SIP?", DEFINITIONAL),
+    ("what is a credit score", DEFINITIONAL),
+    ("What is the repo rate?", DEFINITIONAL),
+    ("sip kya hai", DEFINITIONAL),
+    ("What is NEFT?", DEFINITIONAL),
+    ("What is IMPS?", DEFINITIONAL),
+    ("what is a recession", COMPLEX),
+    ("How do I start an emergency fund?", COMPLEX),
+    ("SIP vs FD, which is better?", COMPLEX),
+    # Finance words mixed with another subject go to the main model, not a refusal
+    ("what are the weather derivatives", COMPLEX),
+    ("what is an ipl team worth", COMPLEX),
+    ("how much do cricket players earn in salary", COMPLEX),
+    # Not recognisably financial, so the main model decides
+    ("What is the capital of France?", COMPLEX),
+    ("Who won the cricket world cup?", OFF_TOPIC),
+    ("Give me a recipe for biryani", OFF_TOPIC),
+    ("tell me a joke", OFF_TOPIC),
+])
+def test_routes(router, query, route):
+    assert router.classify(query) == route
+
+
+def test_topic_terms_are_learnt_from_the_knowledge_base():
+    router = QueryRouter()
+    assert router.classify("What is NEFT?") == COMPLEX
+    router.learn_topics([{"topic": "NEFT transfers", "tags": []}])
+    assert router.classify("What is NEFT?") == DEFINITIONAL
@@ -0,0 +1,47 @@
+import os
+
+import mongomock
+
+import snapshot
+
+
+def make_snapshots(directory, names):
+    for name in names:
+        os.makedirs(os.path.join(directory, name))
+
+
+def test_prune_keeps_the_published_snapshot_with_a_relative_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_snapshots("snaps", ["a", "b", "c", "d"])
+    snapshot.publish("snaps", "a")
+
+    snapshot.prune("snaps", keep=2)
+
+    assert sorted(os.listdir("snaps")) == ["a", "c", "current", "d"]
+    assert snapshot.current_snapshot("snaps") == os.path.realpath("snaps/a")
+
+
+def test_prune_keeps_the_published_snapshot_through_a_symlinked_directory(tmp_path):
+    real = tmp_path / "real"
+    make_snapshots(str(real), ["a", "b", "c"])
+    os.symlink(real, tmp_path / "link")
+    snapshot.publish(str(tmp_path / "link"), "a")
+
+    snapshot.prune(str(tmp_path / "link"), keep=1)
+
+    assert sorted(os.listdir(real)) == ["a", "c", "current"]
+
+
+def test_export_publishes_and_loads(tmp_path):
+    db = mongomock.MongoClient().db
+    db.knowledge_base.insert_one({"topic": "SIP", "content": "A systematic investment plan.", "embedding": [1.0, 0.0]})
+    db.knowledge_chunks.insert_many([
+        {"text": "Live passage", "embedding": [0.0, 1.0]},
+        {"text": "Retired passage", "embedding": [1.0, 1.0], "retired": True},
+    ])
+
+    path = snapshot.export_snapshot(db, str(tmp_path), keep=1)
+
+    assert snapshot.current_snapshot(str(tmp_path)) == os.path.realpath(path)
+    manifest = snapshot.load_snapshot(path).manifest
+    assert manifest["collections"]["knowledge_chunks"]["rows"] == 1
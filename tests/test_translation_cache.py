@@ -0,0 +1,18 @@
+from translation_utils import TranslationCache
+
+
+def test_memory_is_bounded_and_sqlite_still_has_everything(tmp_path):
+    cache = TranslationCache(str(tmp_path / "translations.sqlite3"), memory_size=2)
+    cache.put_many("hi", {"a": "A", "b": "B", "c": "C"})
+    assert len(cache._memory) == 2
+    assert cache.get_many("hi", ["a", "b", "c", "d"]) == {"a": "A", "b": "B", "c": "C"}
+    assert len(cache._memory) == 2
+
+
+def test_answer_translations_survive_a_new_cache(tmp_path):
+    path = str(tmp_path / "translations.sqlite3")
+    TranslationCache(path).put_answer("key", "hi", "translated")
+    reopened = TranslationCache(path)
+    assert reopened.get_answer("key", "hi") == "translated"
+    assert reopened.answer_languages("key") == {"hi"}
+    assert reopened.get_answer("key", "ta") is None
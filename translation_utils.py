@@ -1,12 +1,52 @@
-from googletrans import Translator
-import streamlit as st
+import os
+import re
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from telemetry import span
 
-@st.cache_resource
-def get_translator():
-    """Initializes and returns the Translator object."""
-    print("Initializing Google Translator...")
+class StubTranslator:
+    """
+    Offline stand-in for googletrans, used by the benchmarks and for offline runs.
+    "Translates" by tagging the text with the language code.
+    """
+
+    class _Result:
+        def __init__(self, text):
+            self.text = text
+
+    async def translate(self, text: str, dest: str):
+        return self._Result(f"[{dest}] {text}")
+
+
+def create_translator():
+    """
+    Builds a new translator backend. Set TRANSLATION_BACKEND=stub to run
+    without network access.
+    """
+    if os.getenv("TRANSLATION_BACKEND", "google") == "stub":
+        return StubTranslator()
+    # Imported here so processes that never translate don't pay for it
+    from googletrans import Translator
     return Translator()
 
+
+_translator = None
+_translator_lock = threading.Lock()
+
+
+def get_translator():
+    """The process-wide translator, created on first use."""
+    global _translator
+    if _translator is None:
+        with _translator_lock:
+            if _translator is None:
+                print("Initializing Google Translator...")
+                _translator = create_translator()
+    return _translator
+
 # The final, comprehensive map of Indian languages supported by Google Translate
 LANG_CODE_MAP = {
     # Official Languages
@@ -32,9 +72,235 @@ LANG_CODE_MAP = {
     "भोजपुरी (Bhojpuri)": "bho",
 }
 
-async def translate(text_to_translate: str, target_language: str) -> str:
+# --- Translation Engine Settings ---
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", os.path.join(".cache", "translations.sqlite3"))
+TRANSLATION_CONCURRENCY = int(os.getenv("TRANSLATION_CONCURRENCY", "8"))
+TRANSLATION_SEGMENT_TIMEOUT = float(os.getenv("TRANSLATION_SEGMENT_TIMEOUT", "8"))
+# Segments kept in memory in front of SQLite; the least recently used are dropped first
+TRANSLATION_MEMORY_SIZE = int(os.getenv("TRANSLATION_MEMORY_SIZE", "5000"))
+
+# Markdown syntax that must survive translation untouched: inline code, link
+# brackets and link targets, and bare URLs. Emphasis stays inside the segment
+# so sentences are translated whole.
+_PROTECTED = re.compile(r"(`[^`]*`|!?\[|\]\([^)]*\)|https?://\S+)")
+# Line prefixes: indentation, headings, quotes, bullets and numbered lists.
+_LINE_PREFIX = re.compile(r"^(\s*(?:#{1,6}\s+|>\s*)*(?:[-*+]\s+|\d+[.)]\s+)?)")
+
+
+def split_markdown(text: str) -> list:
+    """
+    Splits markdown into parts: (is_translatable, string).
+    Joining every string in order gives back the original text exactly.
+    """
+    parts = []
+    for line in text.splitlines(keepends=True):
+        prefix = _LINE_PREFIX.match(line).group(1)
+        if prefix:
+            parts.append((False, prefix))
+        for piece in _PROTECTED.split(line[len(prefix):]):
+            if not piece:
+                continue
+            if _PROTECTED.fullmatch(piece) or not any(ch.isalpha() for ch in piece):
+                parts.append((False, piece))
+            else:
+                # Keep surrounding whitespace (and the newline) out of the segment
+                stripped = piece.strip()
+                lead = piece[:len(piece) - len(piece.lstrip())]
+                trail = piece[len(piece.rstrip()):]
+                if lead:
+                    parts.append((False, lead))
+                parts.append((True, stripped))
+                if trail:
+                    parts.append((False, trail))
+    return parts
+
+
+def _segment_hash(segment: str) -> str:
+    return hashlib.sha256(segment.encode("utf-8")).hexdigest()
+
+
+class TranslationCache:
+    """
+    Persistent (language, segment hash) -> translation store backed by SQLite,
+    with a bounded in-memory LRU in front of it. A second table keeps whole
+    pre-translated answers (see pretranslate.py), so they survive restarts
+    and are shared by every process using the same file.
+    """
+
+    def __init__(self, path: str = TRANSLATION_CACHE_PATH, memory_size: int = TRANSLATION_MEMORY_SIZE):
+        self.path = path
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "lang TEXT NOT NULL, segment_hash TEXT NOT NULL, translation TEXT NOT NULL, "
+                "PRIMARY KEY (lang, segment_hash))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_translations ("
+                "answer_key TEXT NOT NULL, lang TEXT NOT NULL, translation TEXT NOT NULL, "
+                "PRIMARY KEY (answer_key, lang))"
+            )
+        return self._conn
+
+    def _remember(self, lang: str, translations: dict):
+        with self._memory_lock:
+            for h, translation in translations.items():
+                self._memory[(lang, h)] = translation
+                self._memory.move_to_end((lang, h))
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get_many(self, lang: str, hashes: list) -> dict:
+        found = {}
+        with self._memory_lock:
+            for h in hashes:
+                translation = self._memory.get((lang, h))
+                if translation is not None:
+                    self._memory.move_to_end((lang, h))
+                    found[h] = translation
+        missing = [h for h in hashes if h not in found]
+        if missing:
+            try:
+                with self._lock:
+                    conn = self._connection()
+                    placeholders = ",".join("?" * len(missing))
+                    rows = conn.execute(
+                        f"SELECT segment_hash, translation FROM translations WHERE lang = ? AND segment_hash IN ({placeholders})",
+                        [lang, *missing],
+                    ).fetchall()
+                loaded = dict(rows)
+                self._remember(lang, loaded)
+                found.update(loaded)
+            except sqlite3.Error as e:
+                print(f"Translation cache read error: {e}")
+        return found
+
+    def put_many(self, lang: str, translations: dict):
+        if not translations:
+            return
+        self._remember(lang, translations)
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO translations (lang, segment_hash, translation) VALUES (?, ?, ?)",
+                    [(lang, h, t) for h, t in translations.items()],
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Translation cache write error: {e}")
+
+
+    def get_answer(self, answer_key: str, language: str):
+        """A stored translation of a whole answer, or None."""
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT translation FROM answer_translations WHERE answer_key = ? AND lang = ?",
+                    (answer_key, language),
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Translation cache read error: {e}")
+            return None
+        return row[0] if row else None
+
+    def answer_languages(self, answer_key: str) -> set:
+        """The languages an answer has been stored in."""
+        try:
+            with self._lock:
+                rows = self._connection().execute(
+                    "SELECT lang FROM answer_translations WHERE answer_key = ?", (answer_key,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Translation cache read error: {e}")
+            return set()
+        return {lang for lang, in rows}
+
+    def put_answer(self, answer_key: str, language: str, translation: str):
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO answer_translations (answer_key, lang, translation) VALUES (?, ?, ?)",
+                    (answer_key, language, translation),
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Translation cache write error: {e}")
+
+    def count_answers(self) -> int:
+        try:
+            with self._lock:
+                return self._connection().execute("SELECT COUNT(DISTINCT answer_key) FROM answer_translations").fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Translation cache read error: {e}")
+            return 0
+
+
+translation_cache = TranslationCache()
+
+
+async def _translate_segment(translator, segment: str, lang_code: str, semaphore, timeout: float):
+    """Translates one segment. Returns None on failure or timeout."""
+    async with semaphore:
+        try:
+            translated_obj = await asyncio.wait_for(translator.translate(segment, dest=lang_code), timeout)
+            return translated_obj.text
+        except Exception as e:
+            print(f"Error translating segment: {e!r}")
+            return None
+
+
+async def translate_markdown(text_to_translate: str, lang_code: str, translator=None) -> tuple:
+    """
+    Translates English markdown into `lang_code`.
+    Returns (translated_text, complete); `complete` is False if any segment
+    failed or timed out and was left in English.
+    """
+    with span("translation", language=lang_code) as s:
+        parts = split_markdown(text_to_translate)
+        segments = {_segment_hash(part): part for is_text, part in parts if is_text}
+        translations = translation_cache.get_many(lang_code, list(segments))
+
+        missing = {h: seg for h, seg in segments.items() if h not in translations}
+        s.set(segments=len(segments), cached_segments=len(segments) - len(missing), cache_hit=not missing)
+        complete = True
+        if missing:
+            translator = translator or get_translator()
+            semaphore = asyncio.Semaphore(TRANSLATION_CONCURRENCY)
+            results = await asyncio.gather(*[
+                _translate_segment(translator, seg, lang_code, semaphore, TRANSLATION_SEGMENT_TIMEOUT)
+                for seg in missing.values()
+            ])
+            fresh = {h: result for h, result in zip(missing, results) if result}
+            translation_cache.put_many(lang_code, fresh)
+            translations.update(fresh)
+            if len(fresh) < len(missing):
+                complete = False
+                print(f"Translation incomplete: {len(missing) - len(fresh)} of {len(segments)} segments left in English.")
+        s.set(complete=complete)
+
+        text = "".join(translations.get(_segment_hash(part), part) if is_text else part for is_text, part in parts)
+        return text, complete
+
+
+async def translate(text_to_translate: str, target_language: str, translator=None) -> str:
     """
-    Translates English text to the selected target language using Google Translate.
+    Translates English markdown to the selected target language.
+    Only the prose is sent for translation: headings, bullets, emphasis and
+    links are kept as they are. Segments are translated concurrently, cached
+    persistently per language, and any segment that fails or times out is
+    left in English instead of failing the whole answer.
     """
     if target_language == "English":
         return text_to_translate
@@ -43,13 +309,8 @@ async def translate(text_to_translate: str, target_language: str) -> str:
     if not lang_code:
         return "Language not supported."
 
-    try:
-        translator = get_translator()
-        translated_obj = await translator.translate(text_to_translate, dest=lang_code)
-        return translated_obj.text
-    except Exception as e:
-        print(f"Error during translation: {e}")
-        return "Translation service failed. Please check your internet connection."
+    text, _ = await translate_markdown(text_to_translate, lang_code, translator)
+    return text
     
 # from googletrans import Translator  -------------- Old Best
 # import streamlit as st